@@ -1,9 +1,10 @@
 import streamlit as st
-from src.configs.llm_config import get_chat_model, get_embeddings_model
-from src.utils.vectorstore_utils import create_vectorstore, load_documents
-from src.chains.llm_route_chain import invoke_llm_with_vectorstore, invoke_llm_with_vectorstore_mmr_improved
-from src.chains.retrieval_qa_chain import invoke_retrieval_qa_chain
+from src.utils.api_client import stream_chat
+from src.utils.warmup import WarmupState
+from src.configs.tracing_config import configure_langsmith_tracing
 import os
+import time
+import uuid
 from dotenv import load_dotenv
 
 st.set_page_config(
@@ -13,23 +14,44 @@ st.set_page_config(
 )
 
 load_dotenv()
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = os.getenv("LANGSMITH_PROJECT")
-os.environ["LANGCHAIN_ENDPOINT"] = os.getenv("LANGSMITH_ENDPOINT")
-os.environ["LANGCHAIN_API_KEY"] = os.getenv("LANGSMITH_API_KEY")
+# LangSmith tracing is optional; it is only enabled when LANGSMITH_API_KEY is set
+configure_langsmith_tracing()
+
+# When set, the UI is a thin client of the API server (server.py) and loads no models itself
+CHAT_API_URL = os.getenv("CHAT_API_URL")
 
 st.title("🛍️ E-commerce Support Chatbot")
 
+def build():
+    # Imported here so the page renders before langchain, Chroma and the Gemini clients are loaded
+    from src.utils.app_resources import build_resources
+    return build_resources("data", "chroma_vectorstore")
+
 @st.cache_resource
 def initialize_resources():
-    """Initialize and cache the chat model, embeddings model, and vectorstore."""
-    chat_model = get_chat_model()
-    embeddings_model = get_embeddings_model()
-    docs = load_documents("data")
-    vectorstore = create_vectorstore(docs, embeddings_model, "chroma_vectorstore")
-    return chat_model, vectorstore
+    """Start building the chat model, vectorstore, chain registry and semantic answer cache in the background (once per process)."""
+    return WarmupState(build).start()
+
+resources_ready = True
+if not CHAT_API_URL:
+    warmup = initialize_resources()
+    if warmup.status == "failed":
+        st.error(f"Lỗi khởi tạo: {warmup.error}")
+        st.stop()
+    resources_ready = warmup.ready
+    if resources_ready:
+        registry, answer_cache = warmup.resources.registry, warmup.resources.answer_cache
+        conversation = warmup.resources.conversation
+        from src.utils.metrics import METRICS
+        with st.sidebar.expander("Metrics"):
+            # In thin-client mode the metrics live in the API server (GET /metrics)
+            st.json(METRICS.to_dict())
+    else:
+        st.info("⏳ Loading the knowledge base, the chat will be available in a moment...")
 
-chat_model, vectorstore = initialize_resources()
+# Identifies this chat as one conversation, locally or in the API server
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
 
 if 'messages' not in st.session_state:
     st.session_state['messages'] = [
@@ -44,7 +66,7 @@ for message in st.session_state.messages:
         else:
             st.write(message["content"])
 
-if prompt := st.chat_input("Question here..."):
+if prompt := st.chat_input("Question here...", disabled=not resources_ready):
     st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.write(prompt)
@@ -54,20 +76,44 @@ if prompt := st.chat_input("Question here..."):
         message_placeholder.markdown("⏳ Processing...")
         
         try:
-            #Invoke with llm vectorstore using MMR for search_type
-            #response, doc_info = invoke_llm_with_vectorstore_mmr_improved(chat_model, vectorstore, prompt)
-            
-            #Invoke with llm vectorstore using similarity search for search_type
-            #response, doc_info = invoke_llm_with_vectorstore(chat_model, vectorstore, prompt)
-
-            #Invoke with retrieval qa chain
-            response, doc_info = invoke_retrieval_qa_chain(chat_model, vectorstore, prompt)
-            message_placeholder.empty()
-            if isinstance(response, list):
-                for item in response:
-                    st.write(item)
+            #Serve product lookups from the catalog and repeated or paraphrased questions from the cache,
+            #otherwise answer with the conversation chain; follow-ups depend on the conversation and skip both
+            follow_up = False
+            cached = None
+            if not CHAT_API_URL:
+                from src.chains.conversation_chain import is_follow_up
+                memory = warmup.resources.sessions.get(st.session_state.session_id)
+                follow_up = is_follow_up(prompt, memory, registry.catalog)
+                if not follow_up:
+                    cached = registry.answer_from_catalog(prompt) or answer_cache.lookup(prompt, registry.label())
+            if cached is not None:
+                response, doc_info = cached
+                memory.add_turn(prompt, response, doc_info)
+                message_placeholder.empty()
+                if isinstance(response, list):
+                    for item in response:
+                        st.write(item)
+                else:
+                    st.write(response)
             else:
-                st.write(response)
+                # Render each line as soon as Gemini finishes generating it
+                if CHAT_API_URL:
+                    lines, doc_info = stream_chat(CHAT_API_URL, prompt, session_id=st.session_state.session_id)
+                    response = []
+                    for line in lines:
+                        response.append(line)
+                        message_placeholder.markdown("\n\n".join(response))
+                else:
+                    from src.utils.metrics import observe_request_usage, track_usage
+                    with track_usage() as usage:
+                        lines, doc_info = conversation.stream(prompt, memory)
+                        response = []
+                        for line in lines:
+                            response.append(line)
+                            message_placeholder.markdown("\n\n".join(response))
+                    observe_request_usage(usage)
+                    if not follow_up:
+                        answer_cache.store(prompt, response, doc_info, registry.label())
                 
             if doc_info:
                 st.caption(f"*Thông tin dựa trên tài liệu: {doc_info}*")
@@ -77,4 +123,9 @@ if prompt := st.chat_input("Question here..."):
         except Exception as e:
             message_placeholder.error(f"Lỗi xảy ra: {str(e)}")
             import traceback
-            st.error(traceback.format_exc())
\ No newline at end of file
+            st.error(traceback.format_exc())
+
+if not resources_ready:
+    # Poll the background warm-up until the chat can be enabled
+    time.sleep(1)
+    st.rerun()
@@ -0,0 +1,280 @@
+"""Offline latency and throughput benchmark for the answer pipelines.
+
+Uses the deterministic OfflineChatModel and HashEmbeddings (LLM_PROVIDER=offline), so it needs no
+network or credentials. Replays the few-shot example questions and the questions from data/faqs.txt
+against each pipeline variant at each concurrency level, and measures ingestion time vs. corpus size.
+EMBEDDING_CACHE_PATH is ignored, so every run measures the uncached embedding model.
+
+    python -m benchmarks.run_benchmark --variants routed mmr --concurrency 1 8 --repeat 5
+    python -m benchmarks.run_benchmark --mode async --concurrency 32 --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("LLM_PROVIDER", "offline")
+# Embeddings are counted on the uncached model, and a persistent cache would turn cold ingestion runs warm
+os.environ.pop("EMBEDDING_CACHE_PATH", None)
+
+from langchain_community.document_loaders import TextLoader
+from langchain_core.documents import Document
+
+from src.chains.chain_registry import VARIANTS, ChainRegistry
+from src.chains.doc_type_router import CentroidRouter, LLMRouter
+from src.chains.retrieval_qa_chain import FEW_SHOT_EXAMPLES
+from src.configs.llm_config import get_chat_model, get_embeddings_model
+from src.utils.lexical_index import load_or_build_lexical_index
+from src.utils.metrics import METRICS
+from src.utils.mmap_vectorstore import sync_mmap_index
+from src.utils.product_catalog import ProductCatalog
+from src.utils.vectorstore_utils import create_vectorstore, load_documents
+
+
+class StageRecorder:
+    """Collects per-stage durations from wrapped methods."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    def wrap(self, obj, method, stage):
+        """Replaces obj.method (sync or async) with a version that records its duration."""
+        original = getattr(obj, method)
+
+        if asyncio.iscoroutinefunction(original):
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        else:
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+
+        setattr(obj, method, timed)
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+
+
+def percentiles(values):
+    """Returns p50/p95/p99/mean in milliseconds (nearest-rank percentiles)."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(50) * 1000, 3),
+        "p95_ms": round(rank(95) * 1000, 3),
+        "p99_ms": round(rank(99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def load_query_corpus(data_path):
+    """Returns the few-shot example questions plus every question in data/faqs.txt."""
+    queries = [example["query"] for example in FEW_SHOT_EXAMPLES]
+    with open(os.path.join(data_path, "faqs.txt"), encoding="utf-8") as f:
+        queries += re.findall(r"^Q: (.+)$", f.read(), flags=re.MULTILINE)
+    return queries
+
+
+def scale_corpus(docs, factor):
+    """Returns factor distinct copies of the corpus (each line tagged with its copy number)."""
+    scaled = []
+    for copy in range(factor):
+        for doc in docs:
+            content = doc.page_content if copy == 0 else "\n".join(
+                f"{line} (edition {copy})" if line.strip() else line for line in doc.page_content.split("\n")
+            )
+            scaled.append(Document(page_content=content, metadata=dict(doc.metadata)))
+    return scaled
+
+
+def benchmark_ingestion(docs, scales, max_workers=None):
+    results = []
+    for factor in scales:
+        corpus = scale_corpus(docs, factor)
+        persist_directory = tempfile.mkdtemp(prefix="bench_index_")
+        try:
+            runs = {}
+            for run in ("cold", "warm"):
+                embeddings = get_embeddings_model()
+                started = time.perf_counter()
+                vectorstore = create_vectorstore(corpus, embeddings, persist_directory, max_workers=max_workers)
+                runs[run] = {
+                    "seconds": round(time.perf_counter() - started, 4),
+                    "embedded_texts": embeddings.stats["texts"],
+                    "embedding_calls": embeddings.stats["calls"],
+                }
+            chunks = len(vectorstore.get(include=[])["ids"])
+        finally:
+            shutil.rmtree(persist_directory, ignore_errors=True)
+        results.append({"scale": factor, "documents": len(corpus), "chunks": chunks, **runs})
+    return results
+
+
+def run_queries(registry, variant, queries, concurrency, mode):
+    """Replays the queries at the given concurrency; returns (per-query latencies, wall seconds)."""
+    latencies = []
+
+    def one(query):
+        started = time.perf_counter()
+        registry.answer(query, variant=variant)
+        latencies.append(time.perf_counter() - started)
+
+    async def aone(query, semaphore):
+        async with semaphore:
+            started = time.perf_counter()
+            await registry.aanswer(query, variant=variant)
+            latencies.append(time.perf_counter() - started)
+
+    async def arun():
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(aone(query, semaphore) for query in queries))
+
+    started = time.perf_counter()
+    if mode == "async":
+        asyncio.run(arun())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, queries))
+    return latencies, time.perf_counter() - started
+
+
+def benchmark_queries(args, docs, queries):
+    persist_directory = tempfile.mkdtemp(prefix="bench_index_")
+    try:
+        chat_model = get_chat_model()
+        embeddings = get_embeddings_model()
+        vectorstore = create_vectorstore(docs, embeddings, persist_directory, partition_by_doc_type=args.backend == "chroma")
+        if args.backend == "mmap":
+            vectorstore = sync_mmap_index(vectorstore, os.path.join(persist_directory, "mmap_index"), quantize=args.quantize)
+        router = None
+        if args.router == "centroid":
+            router = CentroidRouter.from_vectorstore(
+                vectorstore, embeddings, fallback=LLMRouter(chat_model), confidence_threshold=args.router_threshold
+            )
+        lexical_index = load_or_build_lexical_index(vectorstore, persist_directory)
+        catalog = ProductCatalog.from_documents(docs) if args.catalog else None
+        registry = ChainRegistry(chat_model, vectorstore, router=router, lexical_index=lexical_index, catalog=catalog)
+
+        recorder = StageRecorder()
+        for method in ("similarity_search", "max_marginal_relevance_search"):
+            recorder.wrap(vectorstore, method, "vector_search")
+        if router is not None:
+            recorder.wrap(router, "route", "route")
+            recorder.wrap(router, "aroute", "route")
+
+        results = []
+        for variant in args.variants:
+            registry.get(variant)
+            for concurrency in args.concurrency:
+                recorder.reset()
+                chat_model.stats.update(calls=0, input_tokens=0, output_tokens=0, durations=[])
+                embeddings.stats.update(calls=0, texts=0, durations=[])
+                replay = queries * args.repeat
+                latencies, wall = run_queries(registry, variant, replay, concurrency, args.mode)
+
+                stages = {stage: percentiles(values) for stage, values in recorder.durations.items()}
+                stages["llm_call"] = percentiles(chat_model.stats["durations"])
+                stages["embedding_call"] = percentiles(embeddings.stats["durations"])
+                results.append({
+                    "variant": variant,
+                    "mode": args.mode,
+                    "concurrency": concurrency,
+                    "queries": len(replay),
+                    "qps": round(len(replay) / wall, 2),
+                    "latency": percentiles(latencies),
+                    "stages": stages,
+                    "llm_calls": chat_model.stats["calls"],
+                    "llm_input_tokens": chat_model.stats["input_tokens"],
+                    "llm_output_tokens": chat_model.stats["output_tokens"],
+                    "embedding_calls": embeddings.stats["calls"],
+                    "router": router.get_stats() if router is not None else None,
+                })
+                if router is not None:
+                    router.stats.clear()
+        return results
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+def print_report(report):
+    print("Ingestion (cold = empty index, warm = unchanged corpus re-synced)")
+    print(f"{'scale':>6} {'docs':>6} {'chunks':>7} {'cold s':>9} {'embedded':>9} {'warm s':>9} {'embedded':>9}")
+    for row in report["ingestion"]:
+        print(f"{row['scale']:>6} {row['documents']:>6} {row['chunks']:>7} {row['cold']['seconds']:>9.4f} "
+              f"{row['cold']['embedded_texts']:>9} {row['warm']['seconds']:>9.4f} {row['warm']['embedded_texts']:>9}")
+
+    print("\nQueries")
+    print(f"{'variant':<13} {'conc':>4} {'qps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'llm':>5} {'embed':>6}")
+    for row in report["queries"]:
+        latency = row["latency"]
+        print(f"{row['variant']:<13} {row['concurrency']:>4} {row['qps']:>8} {latency['p50_ms']:>9} "
+              f"{latency['p95_ms']:>9} {latency['p99_ms']:>9} {row['llm_calls']:>5} {row['embedding_calls']:>6}")
+        for stage, stats in sorted(row["stages"].items()):
+            if stats:
+                print(f"    {stage:<16} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  n={stats['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--repeat", type=int, default=3, help="times the query corpus is replayed")
+    parser.add_argument("--router", choices=["centroid", "llm"], default="centroid")
+    parser.add_argument("--router-threshold", type=float, default=0.05)
+    parser.add_argument("--backend", choices=["chroma", "mmap"], default="chroma", help="vector store serving the queries")
+    parser.add_argument("--quantize", choices=["int8"], default=None, help="quantization of the mmap backend")
+    parser.add_argument("--catalog", action="store_true", help="answer product attribute lookups from the catalog")
+    parser.add_argument("--ingest-scales", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--ingest-workers", type=int, default=None, help="processes used to chunk documents")
+    parser.add_argument("--json", help="also write the full report to this file")
+    parser.add_argument("--metrics", help="also write the metrics registry snapshot to this file")
+    args = parser.parse_args()
+
+    if os.getenv("LLM_PROVIDER") != "offline":
+        parser.error("the benchmark must run with LLM_PROVIDER=offline")
+
+    docs = load_documents(args.data, loader_cls=TextLoader)
+    queries = load_query_corpus(args.data)
+    report = {
+        "settings": vars(args),
+        "ingestion": benchmark_ingestion(docs, args.ingest_scales, max_workers=args.ingest_workers),
+        "queries": benchmark_queries(args, docs, queries),
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.metrics:
+        METRICS.dump_json(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
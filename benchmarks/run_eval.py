@@ -0,0 +1,239 @@
+"""Retrieval quality vs. latency evaluation of the answer pipelines.
+
+Builds a labeled question -> expected chunk set from data/ (FAQ questions, product
+lookups by name and by features, policy and common-issue questions), then sweeps pipeline
+variants and retrieval parameters. For each configuration it reports recall@k and MRR of
+the chunks the pipeline retrieves, per-query retrieval and answer latency, and LLM calls and
+input/output tokens per query. The best configuration within a latency budget can be written out and selected
+at runtime with PIPELINE_CONFIG.
+
+    python -m benchmarks.run_eval --variants routed mmr hybrid --k 1 3 --lambda-mult 0.5 0.75
+    LLM_PROVIDER=google python -m benchmarks.run_eval --max-latency-ms 80 --write-config pipeline_config.json
+    PIPELINE_CONFIG=pipeline_config.json streamlit run app.py
+
+A chunk counts as relevant when it contains the item's expected text, so labels do not
+depend on the chunking settings. Runs with LLM_PROVIDER=offline unless another provider is set;
+the offline models only approximate routing and retrieval, so --write-config needs the real provider.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "offline")
+
+from langchain_community.document_loaders import TextLoader
+
+from benchmarks.run_benchmark import percentiles
+
+from src.chains.chain_registry import VARIANTS, ChainRegistry
+from src.chains.doc_type_router import CentroidRouter, LLMRouter
+from src.configs.llm_config import get_chat_model, get_embeddings_model
+from src.configs.pipeline_config import VARIANT_PARAMS, PipelineConfig, save_pipeline_config
+from src.utils.lexical_index import load_or_build_lexical_index
+from src.utils.metrics import TokenUsage, track_usage
+from src.utils.product_catalog import parse_products
+from src.utils.vectorstore_utils import create_vectorstore, load_documents
+
+HEADING_PATTERN = re.compile(r"^([A-Z][\w ]* Policy):\s*$", re.MULTILINE)
+FAQ_PATTERN = re.compile(r"^Q: (.+)$", re.MULTILINE)
+ISSUE_PATTERN = re.compile(r"^Issue: (.+)$", re.MULTILINE)
+
+
+def _read(data_path, name):
+    path = os.path.join(data_path, name)
+    if not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def build_eval_set(data_path):
+    """Returns [{"question", "expected", "doc_type"}] derived from the files in data_path."""
+    items = []
+    for question in FAQ_PATTERN.findall(_read(data_path, "faqs.txt")):
+        items.append({"question": question, "expected": f"Q: {question}", "doc_type": "faqs"})
+    for product in parse_products(_read(data_path, "products.txt")):
+        expected = f"Product Name: {product.name}"
+        items.append({"question": f"Tell me about the {product.name}.", "expected": expected, "doc_type": "products"})
+        # Asking by features alone has no name to match, which separates lexical from semantic retrieval
+        features = product.attributes.get("Features")
+        if features:
+            items.append({
+                "question": f"Do you sell something that is {features.lower()}?",
+                "expected": expected,
+                "doc_type": "products",
+            })
+    for issue in ISSUE_PATTERN.findall(_read(data_path, "common_issue.txt")):
+        items.append({
+            "question": f"How do you handle {issue.strip().lower()}?",
+            "expected": f"Issue: {issue.strip()}",
+            "doc_type": "common_issue",
+        })
+    for name in ("returns.txt", "shipping.txt", "ordering.txt"):
+        for heading in HEADING_PATTERN.findall(_read(data_path, name)):
+            items.append({
+                "question": f"What is your {heading.lower()}?",
+                "expected": f"{heading}:",
+                "doc_type": name[:-len(".txt")],
+            })
+    return items
+
+
+def first_relevant_rank(docs, expected):
+    """Returns the 1-based rank of the first retrieved chunk containing the expected text, or None."""
+    expected = " ".join(expected.split())
+    for rank, doc in enumerate(docs, start=1):
+        if expected in " ".join(doc.page_content.split()):
+            return rank
+    return None
+
+
+def build_configs(args):
+    """Returns the grid of configurations; each variant only varies the parameters it uses."""
+    grid = {
+        "k": args.k, "fetch_k": args.fetch_k, "lambda_mult": args.lambda_mult, "rrf_k": args.rrf_k,
+        "few_shot": [False, True] if args.few_shot else None,
+    }
+    configs = []
+    for variant in args.variants:
+        names = [name for name in VARIANT_PARAMS[variant] if grid[name]]
+        for values in itertools.product(*(grid[name] for name in names)):
+            params = dict(zip(names, values))
+            if params.get("fetch_k") is not None and params.get("k") is not None and params["fetch_k"] < params["k"]:
+                continue
+            configs.append(PipelineConfig(variant=variant, **params))
+    return configs
+
+
+def evaluate(registry, config, items, answer=True):
+    """Runs every item through the configuration's retrieval (and full answer); returns the report row."""
+    ranks, retrieval_latencies, answer_latencies = [], [], []
+    # The answer pass repeats the retrieval (and its LLM calls, e.g. routing), so only one pass
+    # is tracked, otherwise routed variants would be charged for routing twice
+    usage = TokenUsage()
+    for item in items:
+        started = time.perf_counter()
+        with track_usage(usage if not answer else TokenUsage()):
+            docs = registry.retrieve(item["question"])
+        retrieval_latencies.append(time.perf_counter() - started)
+        ranks.append(first_relevant_rank(docs, item["expected"]))
+        if answer:
+            started = time.perf_counter()
+            with track_usage(usage):
+                registry.answer(item["question"])
+            answer_latencies.append(time.perf_counter() - started)
+    hits = [rank for rank in ranks if rank is not None]
+    return {
+        "config": config.to_dict(),
+        "label": config.label,
+        "queries": len(items),
+        "recall_at_k": round(len(hits) / len(items), 4),
+        "mrr": round(sum(1 / rank for rank in hits) / len(items), 4),
+        "retrieval_latency": percentiles(retrieval_latencies),
+        "answer_latency": percentiles(answer_latencies),
+        "llm_calls_per_query": round(usage.llm_calls / len(items), 3),
+        "input_tokens_per_query": round(usage.input_tokens / len(items), 1),
+        "output_tokens_per_query": round(usage.output_tokens / len(items), 1),
+        "misses": [item["question"] for item, rank in zip(items, ranks) if rank is None],
+    }
+
+
+def select_best(rows, max_latency_ms=None):
+    """Returns the row with the best recall, then MRR, then p50 latency, among rows within the p95 budget."""
+    def latency(row):
+        return (row["answer_latency"] or row["retrieval_latency"])
+
+    eligible = [row for row in rows if max_latency_ms is None or latency(row)["p95_ms"] <= max_latency_ms]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda row: (row["recall_at_k"], row["mrr"], -latency(row)["p50_ms"]))
+
+
+def print_report(rows, best):
+    print(f"{'configuration':<58} {'recall@k':>8} {'mrr':>7} {'retr p50':>9} {'retr p95':>9} "
+          f"{'ans p50':>9} {'ans p95':>9} {'llm/q':>6} {'in tok/q':>9} {'out tok/q':>9}")
+    for row in rows:
+        retrieval, answer = row["retrieval_latency"], row["answer_latency"] or {}
+        marker = " *" if row is best else ""
+        print(f"{row['label']:<58} {row['recall_at_k']:>8} {row['mrr']:>7} {retrieval['p50_ms']:>9} "
+              f"{retrieval['p95_ms']:>9} {answer.get('p50_ms', '-'):>9} {answer.get('p95_ms', '-'):>9} "
+              f"{row['llm_calls_per_query']:>6} {row['input_tokens_per_query']:>9} "
+              f"{row['output_tokens_per_query']:>9}{marker}")
+    if best is not None:
+        print(f"\nBest: {best['label']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--dataset", help="labeled set as JSON (default: derived from --data)")
+    parser.add_argument("--write-dataset", help="write the derived labeled set to this file and exit")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 3])
+    parser.add_argument("--fetch-k", nargs="+", type=int, default=None, help="default: each variant's own")
+    parser.add_argument("--lambda-mult", nargs="+", type=float, default=None, help="default: each variant's own")
+    parser.add_argument("--rrf-k", nargs="+", type=int, default=None, help="default: each variant's own")
+    parser.add_argument("--few-shot", action="store_true", help="compare retrieval_qa with and without the few-shot prompt")
+    parser.add_argument("--router", choices=["centroid", "llm"], default="centroid")
+    parser.add_argument("--router-threshold", type=float, default=0.05)
+    parser.add_argument("--no-answer", action="store_true", help="only evaluate retrieval, without answer generation")
+    parser.add_argument("--max-latency-ms", type=float, help="p95 latency budget when selecting the best configuration")
+    parser.add_argument("--write-config", help="write the best configuration to this file (for PIPELINE_CONFIG)")
+    parser.add_argument("--json", help="also write the full report to this file")
+    args = parser.parse_args()
+    offline = os.environ["LLM_PROVIDER"] == "offline"
+    if args.write_config and offline:
+        parser.error("--write-config needs the real models: run with LLM_PROVIDER=google")
+    if offline:
+        print("Warning: LLM_PROVIDER=offline routes by keywords and embeds with hashed n-grams, so recall "
+              "and latency only approximate the Gemini models.\n", file=sys.stderr)
+
+    if args.dataset:
+        with open(args.dataset, encoding="utf-8") as f:
+            items = json.load(f)
+    else:
+        items = build_eval_set(args.data)
+    if args.write_dataset:
+        with open(args.write_dataset, "w", encoding="utf-8") as f:
+            json.dump(items, f, indent=2, ensure_ascii=False)
+        return
+
+    docs = load_documents(args.data, loader_cls=TextLoader)
+    persist_directory = tempfile.mkdtemp(prefix="eval_index_")
+    try:
+        chat_model = get_chat_model()
+        embeddings = get_embeddings_model()
+        vectorstore = create_vectorstore(docs, embeddings, persist_directory)
+        router = None
+        if args.router == "centroid":
+            router = CentroidRouter.from_vectorstore(
+                vectorstore, embeddings, fallback=LLMRouter(chat_model), confidence_threshold=args.router_threshold
+            )
+        lexical_index = load_or_build_lexical_index(vectorstore, persist_directory)
+
+        rows = []
+        for config in build_configs(args):
+            registry = ChainRegistry(chat_model, vectorstore, router=router, config=config, lexical_index=lexical_index)
+            rows.append(evaluate(registry, config, items, answer=not args.no_answer))
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+    best = select_best(rows, args.max_latency_ms)
+    print_report(rows, best)
+    if args.write_config:
+        if best is None:
+            parser.error(f"no configuration is within the {args.max_latency_ms} ms p95 budget")
+        save_pipeline_config(PipelineConfig.from_dict(best["config"]), args.write_config)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "items": len(items), "results": rows, "best": best}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Local stub of the Gemini REST API for testing the client layer without quota or network.
+
+Serves the generateContent, streamGenerateContent, embedContent and batchEmbedContents
+methods with the deterministic offline models, plus cachedContents for context caching
+(cached prefixes are prepended to the request and reported as cached tokens), and can inject
+latency, server errors and rate limiting:
+
+    STUB_LATENCY=0.2 STUB_ERROR_RATE=0.1 STUB_RPM=60 uvicorn benchmarks.stub_gemini_server:app --port 8001
+    GEMINI_API_ENDPOINT=http://localhost:8001 GOOGLE_API_KEY=stub streamlit run app.py
+
+GET /stats returns the number of requests served per method and the errors injected, e.g.
+to check that identical concurrent prompts reach the stub only once.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from src.utils.metrics import estimate_tokens
+from src.utils.offline_models import HashEmbeddings, OfflineChatModel
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.05"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+RPM = int(os.getenv("STUB_RPM", "0"))
+
+app = FastAPI(title="Gemini API stub")
+chat_model = OfflineChatModel(latency=0)
+embeddings = HashEmbeddings(size=768)
+stats = Counter()
+cached_contents = {}
+_window = {"start": time.monotonic(), "count": 0}
+_lock = threading.Lock()
+_random = random.Random(int(os.getenv("STUB_SEED", "0")))
+
+
+def _error(status, message):
+    return JSONResponse({"error": {"code": status, "message": message}}, status_code=status)
+
+
+def _inject_fault(method):
+    """Returns an error response for rate-limited or randomly failed requests, otherwise None."""
+    with _lock:
+        stats[method] += 1
+        now = time.monotonic()
+        if now - _window["start"] >= 60:
+            _window["start"], _window["count"] = now, 0
+        _window["count"] += 1
+        if RPM and _window["count"] > RPM:
+            stats["rate_limited"] += 1
+            return _error(429, "Resource has been exhausted (stub rate limit).")
+        if _random.random() < ERROR_RATE:
+            stats["server_errors"] += 1
+            return _error(503, "The service is currently unavailable (stub error injection).")
+    return None
+
+
+def _text(content):
+    return "".join(part.get("text", "") for part in (content or {}).get("parts", []))
+
+
+def _messages(body):
+    """Returns the request's messages, preceded by those of its cached content if it names one."""
+    cached = cached_contents.get(body.get("cachedContent") or body.get("cached_content"), {})
+    messages = []
+    for source in (cached, body):
+        instruction = source.get("systemInstruction") or source.get("system_instruction")
+        if instruction:
+            messages.append(SystemMessage(content=_text(instruction)))
+        messages.extend(
+            (AIMessage if content.get("role") == "model" else HumanMessage)(content=_text(content))
+            for content in source.get("contents", [])
+        )
+    return messages
+
+
+def _cached_tokens(body):
+    cached = cached_contents.get(body.get("cachedContent") or body.get("cached_content"))
+    return cached["usageMetadata"]["totalTokenCount"] if cached else 0
+
+
+def _response(text, prompt_tokens, final=True, cached_tokens=0):
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if final:
+        candidate["finishReason"] = "STOP"
+    output_tokens = estimate_tokens(text)
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + output_tokens,
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return {"candidates": [candidate], "usageMetadata": usage}
+
+
+@app.get("/stats")
+async def get_stats():
+    return dict(stats)
+
+
+@app.post("/v1beta/cachedContents")
+async def create_cached_content(request: Request):
+    """Stores the system instruction and contents; the TTL is not enforced."""
+    body = await request.json()
+    fault = _inject_fault("createCachedContent")
+    if fault is not None:
+        return fault
+    name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+    tokens = sum(estimate_tokens(str(message.content)) for message in _messages(body))
+    cached_contents[name] = {**body, "name": name, "usageMetadata": {"totalTokenCount": tokens}}
+    return {key: value for key, value in cached_contents[name].items() if key != "contents"}
+
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def generate_content(model: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY)
+    fault = _inject_fault("generateContent")
+    if fault is not None:
+        return fault
+    messages = _messages(body)
+    text = str(chat_model.invoke(messages).content)
+    return _response(text, sum(estimate_tokens(str(message.content)) for message in messages), cached_tokens=_cached_tokens(body))
+
+
+@app.post("/v1beta/models/{model}:streamGenerateContent")
+async def stream_generate_content(model: str, request: Request):
+    """Streams one response per answer line, as SSE with ?alt=sse and as a JSON array otherwise."""
+    body = await request.json()
+    await asyncio.sleep(LATENCY)
+    fault = _inject_fault("streamGenerateContent")
+    if fault is not None:
+        return fault
+    messages = _messages(body)
+    prompt_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+    cached_tokens = _cached_tokens(body)
+    lines = str(chat_model.invoke(messages).content).splitlines(keepends=True)
+    sse = request.query_params.get("alt") == "sse"
+
+    async def events():
+        if not sse:
+            yield "["
+        for i, line in enumerate(lines):
+            chunk = json.dumps(_response(line, prompt_tokens, final=i == len(lines) - 1, cached_tokens=cached_tokens))
+            yield f"data: {chunk}\r\n\r\n" if sse else (chunk if i == 0 else f",{chunk}")
+            await asyncio.sleep(0)
+        if not sse:
+            yield "]"
+
+    return StreamingResponse(events(), media_type="text/event-stream" if sse else "application/json")
+
+
+@app.post("/v1beta/models/{model}:embedContent")
+async def embed_content(model: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY)
+    fault = _inject_fault("embedContent")
+    if fault is not None:
+        return fault
+    return {"embedding": {"values": embeddings.embed_query(_text(body.get("content")))}}
+
+
+@app.post("/v1beta/models/{model}:batchEmbedContents")
+async def batch_embed_contents(model: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY)
+    fault = _inject_fault("batchEmbedContents")
+    if fault is not None:
+        return fault
+    texts = [_text(item.get("content")) for item in body.get("requests", [])]
+    return {"embeddings": [{"values": vector} for vector in embeddings.embed_documents(texts)]}
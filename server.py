@@ -0,0 +1,197 @@
+"""Headless HTTP API for the support chatbot.
+
+Run one or more workers behind a load balancer, e.g.:
+
+    uvicorn server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Each worker builds its resources (models, vector index, chains) once in the background at
+startup; /readyz reports 503 until that warm-up has finished. The heavy modules are only
+imported by the warm-up, so the worker accepts connections immediately. Set
+INDEX_MODE=prebuilt to open an index built ahead of time (python -m src.utils.app_resources)
+instead of syncing it with data/. Otherwise workers take turns syncing the shared index
+directory under a file lock: the first one syncs and the others open the result.
+
+Requests carrying a session_id are answered as one conversation. Conversation memory lives in
+the worker that served the session, so route sessions to the same worker (sticky sessions).
+"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from src.configs.tracing_config import configure_langsmith_tracing
+from src.utils.warmup import WarmupState
+
+load_dotenv()
+configure_langsmith_tracing()
+
+
+def build_resources():
+    from src.utils.app_resources import build_resources
+
+    return build_resources()
+
+
+class ChatRequest(BaseModel):
+    query: str
+    variant: Optional[str] = None
+    # Multi-turn sessions use the conversation chain, which retrieves with the variant's pipeline too
+    session_id: Optional[str] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.warmup = WarmupState(build_resources)
+    warmup_task = asyncio.create_task(asyncio.to_thread(app.state.warmup.run))
+    yield
+    warmup_task.cancel()
+
+
+app = FastAPI(title="E-commerce Support Bot API", lifespan=lifespan)
+
+
+def get_resources(request):
+    warmup = app.state.warmup
+    if not warmup.ready:
+        raise HTTPException(status_code=503, detail=f"Service not ready ({warmup.status})")
+    # Imported by the warm-up, so this import is free once the worker is ready
+    from src.chains.chain_registry import VARIANTS
+
+    if request.variant is not None and request.variant not in VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unknown variant '{request.variant}', expected one of {VARIANTS}")
+    return warmup.resources
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: resources are built and the index is warm."""
+    warmup = app.state.warmup
+    body = {"status": warmup.status, "error": warmup.error}
+    if warmup.ready:
+        body["chunks_indexed"] = warmup.resources.chunk_count
+        body["warmup_seconds"] = warmup.warmup_seconds
+        return body
+    return JSONResponse(body, status_code=503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Stage latency histograms, LLM/embedding counters and cache gauges in the Prometheus text format."""
+    from src.utils.metrics import METRICS
+
+    return PlainTextResponse(METRICS.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics.json")
+async def metrics_json():
+    """The same metrics as JSON, with approximate p50/p95/p99 per stage."""
+    from src.utils.metrics import METRICS
+
+    return METRICS.to_dict()
+
+
+async def lookup_cached(resources, request, memory):
+    """Returns (follow_up, cached answer or None) for a request.
+
+    Follow-ups depend on the conversation, so they skip the catalog and the semantic cache. Cached
+    answers are kept per pipeline configuration, so a request only gets answers of its variant.
+    """
+    from src.chains.conversation_chain import is_follow_up
+
+    if memory is not None and is_follow_up(request.query, memory, resources.registry.catalog):
+        return True, None
+    # Catalog lookups take microseconds, so they are tried before the semantic cache (which embeds the query)
+    cached = resources.registry.answer_from_catalog(request.query) or await asyncio.to_thread(
+        resources.answer_cache.lookup, request.query, resources.registry.label(request.variant)
+    )
+    return False, cached
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    """Answers the query; "usage" holds the LLM calls and tokens the request used."""
+    from src.utils.metrics import observe_request_usage, track_usage
+
+    resources = get_resources(request)
+    memory = resources.sessions.get(request.session_id) if request.session_id else None
+    with track_usage() as usage:
+        follow_up, cached = await lookup_cached(resources, request, memory)
+        if cached is not None:
+            response, doc_info = cached
+            if memory is not None:
+                memory.add_turn(request.query, response, doc_info)
+        else:
+            if memory is not None:
+                response, doc_info = await resources.conversation.aanswer(request.query, memory, variant=request.variant)
+            else:
+                response, doc_info = await resources.registry.aanswer(request.query, variant=request.variant)
+            if not follow_up:
+                await asyncio.to_thread(
+                    resources.answer_cache.store, request.query, response, doc_info,
+                    resources.registry.label(request.variant),
+                )
+    observe_request_usage(usage)
+    return {"response": response, "doc_info": doc_info, "usage": usage.to_dict()}
+
+
+async def with_usage(events, usage):
+    """Keeps tracking tokens while the events are produced, then sends them as a final {"usage": ...} event."""
+    from src.utils.metrics import observe_request_usage, track_usage
+
+    with track_usage(usage):
+        async for event in events:
+            yield event
+    observe_request_usage(usage)
+    yield json.dumps({"usage": usage.to_dict()}) + "\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streams newline-delimited JSON: {"doc_info": ...} first, then {"line": ...} per answer line and {"usage": ...} last."""
+    from src.utils.metrics import track_usage
+
+    resources = get_resources(request)
+    memory = resources.sessions.get(request.session_id) if request.session_id else None
+    with track_usage() as usage:
+        follow_up, cached = await lookup_cached(resources, request, memory)
+        if cached is None:
+            # Routing and retrieval (and condensing a follow-up) run before the first event
+            if memory is not None:
+                lines, doc_info = await resources.conversation.astream(request.query, memory, variant=request.variant)
+            else:
+                lines, doc_info = await resources.registry.astream(request.query, variant=request.variant)
+
+    if cached is not None:
+        response, doc_info = cached
+
+        async def events():
+            yield json.dumps({"doc_info": doc_info}) + "\n"
+            for line in (response if isinstance(response, list) else [response]):
+                yield json.dumps({"line": line}) + "\n"
+            if memory is not None:
+                memory.add_turn(request.query, response, doc_info)
+    else:
+        async def events():
+            yield json.dumps({"doc_info": doc_info}) + "\n"
+            response = []
+            async for line in lines:
+                response.append(line)
+                yield json.dumps({"line": line}) + "\n"
+            if not follow_up:
+                await asyncio.to_thread(
+                    resources.answer_cache.store, request.query, response, doc_info,
+                    resources.registry.label(request.variant),
+                )
+
+    return StreamingResponse(with_usage(events(), usage), media_type="application/x-ndjson")
@@ -0,0 +1,175 @@
+import asyncio
+
+from src.chains.llm_route_chain import (
+    DOC_TYPES,
+    LIST_PARSER,
+    NO_DOCS_ANSWER,
+    RESPONSE_PROMPT,
+    aroute_to_doc_type,
+    get_context,
+    get_doc_info,
+    get_doc_type_filter,
+    parse_answer,
+)
+from src.chains.retrieval_qa_chain import build_retrieval_qa_chain, format_qa_prompt, get_source_info
+from src.utils.context_budget import fit_context
+from src.utils.concurrency import get_llm_limiter
+from src.utils.metrics import get_metrics_callbacks, timed
+
+
+
+async def aroute(llm, query, doc_types=None, router=None, limiter=None):
+    """Routes the query with the router if given, otherwise with the LLM classifier."""
+    with timed("route"):
+        if router is not None:
+            return await router.aroute(query)
+        return await aroute_to_doc_type(llm, query, doc_types or DOC_TYPES, limiter=limiter or get_llm_limiter())
+
+
+async def aspeculative_routed_search(llm, vectorstore, query, doc_types=None, router=None, limiter=None,
+                                     k=1, fetch_k=12, lambda_mult=None):
+    """Runs routing and an unfiltered candidate search concurrently, then narrows the candidates to the routed doc_type.
+
+    The speculative search returns the ``fetch_k`` most similar chunks of any doc_type. When ``k`` is 1 the
+    best candidate of the routed doc_type is exactly what a filtered similarity or MMR search would return
+    (MMR always picks the most similar document first), so no second search is needed. Otherwise, or if no
+    candidate has the routed doc_type, a filtered search runs after routing. Returns (docs, doc_type).
+    """
+    route_task = asyncio.create_task(aroute(llm, query, doc_types=doc_types, router=router, limiter=limiter))
+    try:
+        with timed("vector_search"):
+            candidates = await vectorstore.asimilarity_search(query, k=fetch_k)
+    except BaseException:
+        route_task.cancel()
+        raise
+    doc_type = await route_task
+    if not doc_type:
+        # Routing failed (the model is unavailable), so the unfiltered candidates are used
+        return candidates[:k], doc_type
+    doc_filter = get_doc_type_filter(doc_type)
+
+    narrowed = [doc for doc in candidates if doc.metadata.get("doc_type") == doc_filter["doc_type"]]
+    if narrowed and k == 1:
+        return narrowed[:1], doc_type
+
+    with timed("vector_search"):
+        if lambda_mult is None:
+            docs = await vectorstore.asimilarity_search(query, k=k, filter=doc_filter)
+        else:
+            docs = await vectorstore.amax_marginal_relevance_search(
+                query, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=doc_filter
+            )
+    return docs or candidates[:k], doc_type
+
+
+async def agenerate(llm, prompt, limiter=None):
+    """Generates the answer for a prompt and parses it into lines."""
+    async with limiter or get_llm_limiter():
+        result = await llm.ainvoke(prompt)
+    return parse_answer(str(result.content))
+
+
+async def astream_lines(llm, prompt, limiter=None):
+    """Yields answer lines as the LLM generates them; holds a limiter slot for the whole stream."""
+    async with limiter or get_llm_limiter():
+        async def text_chunks():
+            async for chunk in llm.astream(prompt):
+                yield str(chunk.content)
+
+        async for line in LIST_PARSER.aparse_iter(text_chunks()):
+            yield line
+
+
+async def _single_line(text):
+    yield text
+
+
+async def aprepare_similarity_search(vectorstore, query, retriever=None):
+    """Async variant of prepare_similarity_search: returns (prompt, doc_info)."""
+    retriever = retriever or vectorstore.as_retriever(search_kwargs={"k": 1})
+    docs = await retriever.ainvoke(query, config={"callbacks": get_metrics_callbacks()})
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs), query=query), get_doc_info(docs, "unknown")
+
+
+async def aprepare_llm_with_vectorstore(llm, vectorstore, query, router=None, limiter=None, k=1):
+    """Async variant of prepare_llm_with_vectorstore, overlapping routing with retrieval."""
+    docs, doc_type = await aspeculative_routed_search(
+        llm, vectorstore, query, router=router, limiter=limiter, k=k, fetch_k=12
+    )
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs), query=query), get_doc_info(docs, doc_type)
+
+
+async def aprepare_llm_with_vectorstore_mmr(llm, vectorstore, query, doc_types=None, router=None, limiter=None,
+                                            k=1, fetch_k=12, lambda_mult=0.75):
+    """Async variant of prepare_llm_with_vectorstore_mmr, overlapping routing with retrieval."""
+    docs, doc_type = await aspeculative_routed_search(
+        llm, vectorstore, query, doc_types=doc_types, router=router, limiter=limiter,
+        k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+    )
+    if not docs:
+        return None, None
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs, numbered=True), query=query), get_doc_info(docs, doc_type)
+
+
+async def aprepare_retrieval_qa(llm, vectorstore, query, qa_chain=None):
+    """Runs the RetrievalQA chain's retriever and "stuff" prompt: returns (prompt, source_info)."""
+    if qa_chain is None:
+        qa_chain = build_retrieval_qa_chain(llm, vectorstore)
+    source_docs = fit_context(await qa_chain.retriever.ainvoke(query, config={"callbacks": get_metrics_callbacks()}))
+    return format_qa_prompt(qa_chain, query, source_docs), get_source_info(source_docs)
+
+
+async def ainvoke_llm_with_similarity_search(llm, vectorstore, query, retriever=None, limiter=None):
+    prompt, doc_info = await aprepare_similarity_search(vectorstore, query, retriever=retriever)
+    return await agenerate(llm, prompt, limiter=limiter), doc_info
+
+
+async def ainvoke_llm_with_vectorstore(llm, vectorstore, query, router=None, limiter=None, k=1):
+    prompt, doc_info = await aprepare_llm_with_vectorstore(llm, vectorstore, query, router=router, limiter=limiter, k=k)
+    return await agenerate(llm, prompt, limiter=limiter), doc_info
+
+
+async def ainvoke_llm_with_vectorstore_mmr_improved(llm, vectorstore, query, doc_types=None, router=None, limiter=None,
+                                                    k=1, fetch_k=12, lambda_mult=0.75):
+    prompt, source_info = await aprepare_llm_with_vectorstore_mmr(
+        llm, vectorstore, query, doc_types=doc_types, router=router, limiter=limiter,
+        k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+    )
+    if prompt is None:
+        return NO_DOCS_ANSWER, None
+    return await agenerate(llm, prompt, limiter=limiter), source_info
+
+
+async def ainvoke_retrieval_qa_chain(llm, vectorstore, query, qa_chain=None, limiter=None):
+    prompt, source_info = await aprepare_retrieval_qa(llm, vectorstore, query, qa_chain=qa_chain)
+    return await agenerate(llm, prompt, limiter=limiter), source_info
+
+
+async def astream_llm_with_similarity_search(llm, vectorstore, query, retriever=None, limiter=None):
+    """Returns (async iterator of answer lines, doc_info)."""
+    prompt, doc_info = await aprepare_similarity_search(vectorstore, query, retriever=retriever)
+    return astream_lines(llm, prompt, limiter=limiter), doc_info
+
+
+async def astream_llm_with_vectorstore(llm, vectorstore, query, router=None, limiter=None, k=1):
+    """Returns (async iterator of answer lines, doc_info)."""
+    prompt, doc_info = await aprepare_llm_with_vectorstore(llm, vectorstore, query, router=router, limiter=limiter, k=k)
+    return astream_lines(llm, prompt, limiter=limiter), doc_info
+
+
+async def astream_llm_with_vectorstore_mmr_improved(llm, vectorstore, query, doc_types=None, router=None, limiter=None,
+                                                    k=1, fetch_k=12, lambda_mult=0.75):
+    """Returns (async iterator of answer lines, source_info)."""
+    prompt, source_info = await aprepare_llm_with_vectorstore_mmr(
+        llm, vectorstore, query, doc_types=doc_types, router=router, limiter=limiter,
+        k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+    )
+    if prompt is None:
+        return _single_line(NO_DOCS_ANSWER), None
+    return astream_lines(llm, prompt, limiter=limiter), source_info
+
+
+async def astream_retrieval_qa_chain(llm, vectorstore, query, qa_chain=None, limiter=None):
+    """Returns (async iterator of answer lines, source_info)."""
+    prompt, source_info = await aprepare_retrieval_qa(llm, vectorstore, query, qa_chain=qa_chain)
+    return astream_lines(llm, prompt, limiter=limiter), source_info
@@ -0,0 +1,306 @@
+import threading
+from dataclasses import replace
+from functools import partial
+
+from src.chains.async_chain import (
+    agenerate,
+    ainvoke_llm_with_similarity_search,
+    ainvoke_llm_with_vectorstore,
+    ainvoke_llm_with_vectorstore_mmr_improved,
+    ainvoke_retrieval_qa_chain,
+    aspeculative_routed_search,
+    astream_lines,
+    astream_llm_with_similarity_search,
+    astream_llm_with_vectorstore,
+    astream_llm_with_vectorstore_mmr_improved,
+    astream_retrieval_qa_chain,
+)
+from src.chains.llm_route_chain import (
+    LIST_PARSER,
+    RESPONSE_PROMPT,
+    RESPONSE_SYSTEM_MESSAGE,
+    get_context,
+    get_doc_info,
+    invoke_llm_with_similarity_search,
+    invoke_llm_with_vectorstore,
+    invoke_llm_with_vectorstore_mmr_improved,
+    parse_answer,
+    retrieve_routed,
+    retrieve_similarity,
+    stream_llm_with_similarity_search,
+    stream_llm_with_vectorstore,
+    stream_llm_with_vectorstore_mmr_improved,
+    stream_text,
+)
+from src.chains.retrieval_qa_chain import (
+    build_retrieval_qa_chain,
+    format_qa_prompt,
+    get_few_shot_prefix,
+    get_qa_prefix,
+    invoke_retrieval_qa_chain,
+    stream_retrieval_qa_chain,
+)
+from src.configs.pipeline_config import VARIANT_PARAMS, PipelineConfig
+from src.utils.context_budget import fit_context
+from src.utils.hybrid_vectorstore import HybridVectorStore
+from src.utils.metrics import METRICS, get_metrics_callbacks, timed
+from src.utils.resilient_client import DEGRADED_ANSWER, is_unavailable
+
+VARIANTS = tuple(VARIANT_PARAMS)
+
+
+async def _aiter_lines(lines):
+    for line in lines:
+        yield line
+
+
+def _docs_only(retrieve):
+    """Drops the routed doc_type from a (docs, doc_type) retrieval step."""
+    return lambda query: retrieve(query)[0]
+
+
+def _adocs_only(aretrieve):
+    """Async variant of _docs_only."""
+    async def retrieve(query):
+        return (await aretrieve(query))[0]
+    return retrieve
+
+
+def get_prompt_prefix(config):
+    """Returns the static messages the answer prompts of the configured variant start with.
+
+    They are sent byte-identical with every prompt, so the provider can cache them (see
+    src.utils.prompt_cache).
+    """
+    if config.variant != "retrieval_qa":
+        return (RESPONSE_SYSTEM_MESSAGE,)
+    return get_few_shot_prefix() if config.params()["few_shot"] else get_qa_prefix()
+
+
+def _response_prompt(query, docs, numbered=False):
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs, numbered=numbered), query=query)
+
+
+def _qa_prompt(qa_chain, query, docs):
+    return format_qa_prompt(qa_chain, query, fit_context(docs))
+
+
+class ChainRegistry:
+    """Builds each answer pipeline once per process and exposes a single answer(query) entry point.
+
+    Pipelines are built lazily on first use and then reused, so a request only runs the chain.
+    Every pipeline returns ``(response, doc_info)``; the streaming ones return an iterator of
+    answer lines instead of the response. If a product catalog is given, simple product
+    attribute lookups are answered from it before any pipeline runs.
+
+    Retrieval parameters (k, fetch_k, lambda_mult, rrf_k) come from ``config``, a PipelineConfig
+    whose variant is the default one; parameters it leaves unset use each variant's defaults.
+
+    While the embedding model is unavailable, the pipelines answer from the BM25 lexical index
+    (if one is given) with the variant's prompt, and otherwise return DEGRADED_ANSWER.
+    """
+
+    def __init__(self, llm, vectorstore, router=None, default_variant="retrieval_qa", lexical_index=None,
+                 catalog=None, config=None):
+        self.config = config or PipelineConfig(variant=default_variant)
+        self.llm = llm
+        self.vectorstore = vectorstore
+        self.router = router
+        self.lexical_index = lexical_index
+        self.catalog = catalog
+        self.default_variant = self.config.variant
+        self._pipelines = {}
+        self._lock = threading.Lock()
+
+    def _build(self, variant):
+        """Returns the invoke, stream, ainvoke and astream callables of a variant, its retrieve(query) and
+        aretrieve(query) steps and its prompt(query, docs) step."""
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown chain variant '{variant}', expected one of {VARIANTS}")
+        params = self.config.params(variant)
+        vectorstore = self.vectorstore
+        if variant == "similarity":
+            functions = (
+                invoke_llm_with_similarity_search, stream_llm_with_similarity_search,
+                ainvoke_llm_with_similarity_search, astream_llm_with_similarity_search,
+            )
+            kwargs = {"retriever": self.vectorstore.as_retriever(search_kwargs=params)}
+            retrieve = partial(retrieve_similarity, vectorstore, **kwargs)
+            aretrieve = partial(kwargs["retriever"].ainvoke, config={"callbacks": get_metrics_callbacks()})
+            prompt = _response_prompt
+        elif variant == "routed":
+            functions = (
+                invoke_llm_with_vectorstore, stream_llm_with_vectorstore,
+                ainvoke_llm_with_vectorstore, astream_llm_with_vectorstore,
+            )
+            kwargs = {"router": self.router, **params}
+            retrieve = _docs_only(partial(retrieve_routed, self.llm, vectorstore, **kwargs))
+            aretrieve = _adocs_only(partial(aspeculative_routed_search, self.llm, vectorstore, **kwargs))
+            prompt = _response_prompt
+        elif variant == "mmr":
+            functions = (
+                invoke_llm_with_vectorstore_mmr_improved, stream_llm_with_vectorstore_mmr_improved,
+                ainvoke_llm_with_vectorstore_mmr_improved, astream_llm_with_vectorstore_mmr_improved,
+            )
+            kwargs = {"router": self.router, **params}
+            retrieve = _docs_only(partial(retrieve_routed, self.llm, vectorstore, search="mmr", **kwargs))
+            aretrieve = _adocs_only(partial(aspeculative_routed_search, self.llm, vectorstore, **kwargs))
+            prompt = partial(_response_prompt, numbered=True)
+        elif variant == "retrieval_qa":
+            functions = (
+                invoke_retrieval_qa_chain, stream_retrieval_qa_chain,
+                ainvoke_retrieval_qa_chain, astream_retrieval_qa_chain,
+            )
+            kwargs = {"qa_chain": build_retrieval_qa_chain(self.llm, self.vectorstore, **params)}
+            qa_chain = kwargs["qa_chain"]
+            retrieve = partial(qa_chain.retriever.invoke, config={"callbacks": get_metrics_callbacks()})
+            aretrieve = partial(qa_chain.retriever.ainvoke, config={"callbacks": get_metrics_callbacks()})
+            prompt = partial(_qa_prompt, qa_chain)
+        else:
+            # "hybrid": routed pipeline whose searches fuse BM25 and vector rankings
+            if self.lexical_index is None:
+                raise ValueError("The 'hybrid' chain variant needs a lexical_index")
+            functions = (
+                invoke_llm_with_vectorstore, stream_llm_with_vectorstore,
+                ainvoke_llm_with_vectorstore, astream_llm_with_vectorstore,
+            )
+            vectorstore = HybridVectorStore(
+                self.vectorstore, self.lexical_index, fetch_k=params["fetch_k"], rrf_k=params["rrf_k"]
+            )
+            kwargs = {"router": self.router, "k": params["k"]}
+            retrieve = _docs_only(partial(retrieve_routed, self.llm, vectorstore, **kwargs))
+            aretrieve = _adocs_only(partial(aspeculative_routed_search, self.llm, vectorstore, **kwargs))
+            prompt = _response_prompt
+        pipelines = {
+            mode: partial(function, self.llm, vectorstore, **kwargs)
+            for mode, function in zip(("invoke", "stream", "ainvoke", "astream"), functions)
+        }
+        pipelines.update(retrieve=retrieve, aretrieve=aretrieve, prompt=prompt)
+        return pipelines
+
+    def label(self, variant=None):
+        """Returns the configuration label of the variant (e.g. "mmr k=1 fetch_k=12 lambda_mult=0.75")."""
+        return replace(self.config, variant=variant or self.default_variant).label
+
+    def _get_pipelines(self, variant):
+        variant = variant or self.default_variant
+        pipelines = self._pipelines.get(variant)
+        if pipelines is None:
+            with self._lock:
+                pipelines = self._pipelines.get(variant)
+                if pipelines is None:
+                    pipelines = self._pipelines[variant] = self._build(variant)
+        return pipelines
+
+    def get(self, variant=None, mode="invoke"):
+        """Returns the pipeline callable of a variant ("invoke", "stream", "ainvoke", "astream", "retrieve",
+        "aretrieve" or "prompt"), building it on first use."""
+        return self._get_pipelines(variant)[mode]
+
+    def _fallback_docs(self, exc, query, variant):
+        """Returns BM25 results for the query if exc means the embedding model is unavailable.
+
+        Returns None if there is no lexical index to fall back to; other errors are re-raised.
+        """
+        if not is_unavailable(exc):
+            raise exc
+        METRICS.increment("chatbot_retrieval_fallback_total", source="lexical" if self.lexical_index else "degraded")
+        if self.lexical_index is None:
+            return None
+        return [doc for doc, _ in self.lexical_index.search(query, k=self.config.params(variant)["k"])]
+
+    def retrieve(self, query, variant=None):
+        """Returns the documents the variant's pipeline would put in the prompt, ranked, without calling the answer LLM."""
+        try:
+            return self.get(variant, "retrieve")(query)
+        except Exception as exc:
+            docs = self._fallback_docs(exc, query, variant)
+            if docs is None:
+                raise
+            return docs
+
+    async def aretrieve(self, query, variant=None):
+        """Async variant of retrieve; routing overlaps with retrieval."""
+        try:
+            return await self.get(variant, "aretrieve")(query)
+        except Exception as exc:
+            docs = self._fallback_docs(exc, query, variant)
+            if docs is None:
+                raise
+            return docs
+
+    def prompt(self, query, docs, variant=None):
+        """Returns the variant's answer prompt for the query over already retrieved docs (e.g. from retrieve)."""
+        return self.get(variant, "prompt")(query, docs)
+
+    def answer_from_catalog(self, query):
+        """Returns (lines, doc_info) if the query is a product attribute lookup the catalog can answer, else None."""
+        if self.catalog is None:
+            return None
+        with timed("catalog_lookup"):
+            result = self.catalog.answer(query)
+        if result is not None:
+            METRICS.increment("chatbot_catalog_answers_total")
+        return result
+
+    def answer(self, query, variant=None):
+        """Answers the query with the given (or default) pipeline variant."""
+        pipeline = self.get(variant)
+        with timed("answer"):
+            catalog_answer = self.answer_from_catalog(query)
+            if catalog_answer is not None:
+                return catalog_answer
+            try:
+                return pipeline(query)
+            except Exception as exc:
+                docs = self._fallback_docs(exc, query, variant)
+            if docs is None:
+                return [DEGRADED_ANSWER], None
+            result = self.llm.invoke(self.prompt(query, docs, variant))
+            return parse_answer(str(result.content)), get_doc_info(docs, "unknown")
+
+    def stream(self, query, variant=None):
+        """Answers the query as an iterator of lines produced while the LLM generates; returns (lines, doc_info)."""
+        pipeline = self.get(variant, "stream")
+        catalog_answer = self.answer_from_catalog(query)
+        if catalog_answer is not None:
+            lines, doc_info = catalog_answer
+            return iter(lines), doc_info
+        try:
+            return pipeline(query)
+        except Exception as exc:
+            docs = self._fallback_docs(exc, query, variant)
+        if docs is None:
+            return iter([DEGRADED_ANSWER]), None
+        prompt = self.prompt(query, docs, variant)
+        return LIST_PARSER.parse_iter(stream_text(self.llm, prompt)), get_doc_info(docs, "unknown")
+
+    async def aanswer(self, query, variant=None):
+        """Async variant of answer; routing and retrieval overlap and Gemini calls share a concurrency limit."""
+        pipeline = self.get(variant, "ainvoke")
+        with timed("answer"):
+            catalog_answer = self.answer_from_catalog(query)
+            if catalog_answer is not None:
+                return catalog_answer
+            try:
+                return await pipeline(query)
+            except Exception as exc:
+                docs = self._fallback_docs(exc, query, variant)
+            if docs is None:
+                return [DEGRADED_ANSWER], None
+            return await agenerate(self.llm, self.prompt(query, docs, variant)), get_doc_info(docs, "unknown")
+
+    async def astream(self, query, variant=None):
+        """Async variant of stream; returns (async iterator of lines, doc_info)."""
+        pipeline = self.get(variant, "astream")
+        catalog_answer = self.answer_from_catalog(query)
+        if catalog_answer is not None:
+            lines, doc_info = catalog_answer
+            return _aiter_lines(lines), doc_info
+        try:
+            return await pipeline(query)
+        except Exception as exc:
+            docs = self._fallback_docs(exc, query, variant)
+        if docs is None:
+            return _aiter_lines([DEGRADED_ANSWER]), None
+        return astream_lines(self.llm, self.prompt(query, docs, variant)), get_doc_info(docs, "unknown")
@@ -0,0 +1,394 @@
+"""Multi-turn answers with bounded conversation memory.
+
+Each session keeps a window of recent turns limited by a token budget plus a rolling summary
+of older turns, so the prompt stays the same size however long the conversation gets.
+Retrieval is the configured pipeline's (see src.chains.chain_registry), and the first turn of a
+conversation is answered with that pipeline's own prompt. Follow-ups that only refer back to
+the chunks of the previous turn ("what about the black one?") reuse those chunks without
+searching; other follow-ups are condensed into a standalone query before retrieval.
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from src.chains.async_chain import agenerate, astream_lines
+from src.chains.llm_route_chain import (
+    LIST_PARSER,
+    RESPONSE_SYSTEM_MESSAGE,
+    get_context,
+    get_doc_info,
+    parse_answer,
+    stream_text,
+)
+from src.utils.concurrency import get_llm_limiter
+from src.utils.metrics import METRICS, estimate_tokens, timed
+from src.utils.resilient_client import DEGRADED_ANSWER, is_degraded_answer, is_unavailable
+
+logger = logging.getLogger(__name__)
+
+# Summaries of evicted turns are written off the request path, shared by every session of the process
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="summarize")
+
+# Queries opening with a continuation ("and in black?", "what about returns?") or a demonstrative
+# ("is that available in black?"), unless it names the store or the current time ("is this store open?")
+FOLLOW_UP_OPENING = re.compile(
+    r"^\s*(and|but|or|also|what about|how about|same|"
+    r"((is|are|was|were|does|do|did|can|could|will|would|has|have)\s+)?(that|this|these|those)\b"
+    r"(?!\s+(store|shop|site|website|app|company|week|weekend|month|year)\b))",
+    re.IGNORECASE,
+)
+# Pronouns standing in for something named in an earlier turn ("what colors does it come in?")
+ANAPHOR_PATTERN = re.compile(r"\b(it|its|they|them|these|those|this one|that one|the same|the other one)\b", re.IGNORECASE)
+# "it" that refers to nothing ("is it possible to...", "how long does it take to...")
+IMPERSONAL_IT = re.compile(r"\s+(is\s+)?(possible|ok|okay|true|necessary|takes?|took)\b", re.IGNORECASE)
+# "they" meaning the store ("do they ship internationally?")
+STORE_THEY = re.compile(r"\s+(\w+ly\s+)?(ship|deliver|sell|accept|offer|charge|open|close)\b", re.IGNORECASE)
+# A noun phrase followed by a clause boundary, before a pronoun referring to it ("track my order once it ships")
+QUERY_REFERENT = re.compile(
+    r"\b(my|your|our|the|a|an)\s+\w+.*([,;.]|\b(and|but|or|if|when|once|after|before|until|since|because|while)\b)",
+    re.IGNORECASE,
+)
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = {
+    "the", "and", "but", "what", "about", "how", "does", "did", "can", "could", "would", "should", "will",
+    "have", "has", "had", "with", "for", "from", "that", "this", "these", "those", "they", "them", "its",
+    "one", "ones", "same", "also", "too", "another", "other", "else", "instead", "there", "any", "come",
+    "comes", "get", "you", "your", "are", "was", "were", "much", "many", "which", "who", "why", "when",
+    "where", "tell", "more", "please", "thanks", "not", "yes",
+}
+
+CONDENSE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Rewrite the follow-up question as a standalone question that can be understood without the "
+               "conversation. Return only the question."),
+    ("system", "Conversation summary: {summary}\n\nRecent conversation:\n{history}"),
+    ("human", "Follow-up question: {query}"),
+])
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Summarize this customer support conversation in at most {max_words} words. Keep the products, "
+               "orders and decisions mentioned. Return only the summary."),
+    ("human", "Current summary: {summary}\n\nNew turns:\n{turns}"),
+])
+# Starts with the answer prompts' static system message, so follow-ups reuse its provider cache
+CONVERSATION_PROMPT = ChatPromptTemplate.from_messages([
+    RESPONSE_SYSTEM_MESSAGE,
+    ("human", "Conversation summary: {summary}\n\nRecent conversation:\n{history}\n\n"
+              "Context: {context}\n\nQuestion: {query}"),
+])
+
+
+def content_tokens(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 2 and token not in STOPWORDS]
+
+
+@dataclass
+class Turn:
+    query: str
+    answer: str
+    doc_info: Optional[str] = None
+    tokens: int = 0
+
+
+@dataclass
+class ConversationMemory:
+    """Token-budgeted window of recent turns, a rolling summary of older ones and the last turn's chunks.
+
+    When the window exceeds ``max_history_tokens`` the oldest turns are folded into the summary by
+    their questions right away, and rewritten with the LLM in the background if ``summarizer`` is
+    given, so recording a turn never waits for a model call. Concurrent requests of one session
+    may record turns at the same time, so the memory is guarded by a lock.
+    """
+
+    max_history_tokens: int = 600
+    max_summary_tokens: int = 200
+    summarizer: Any = None
+    turns: deque = field(default_factory=deque)
+    summary: str = ""
+    last_docs: List[Any] = field(default_factory=list)
+    last_doc_info: Optional[str] = None
+    # Summary written by the summarizer, and the evicted turns it does not cover yet
+    _summarized: str = field(default="", init=False, repr=False)
+    _evicted: List[Turn] = field(default_factory=list, init=False, repr=False)
+    _summarizing: bool = field(default=False, init=False, repr=False)
+    _lock: Any = field(default_factory=threading.Condition, init=False, repr=False, compare=False)
+
+    @property
+    def is_empty(self):
+        return not self.turns and not self.summary
+
+    def history_text(self):
+        with self._lock:
+            return "\n".join(f"User: {turn.query}\nAssistant: {turn.answer}" for turn in self.turns)
+
+    def add_turn(self, query, answer, doc_info=None, docs=None):
+        """Records a finished turn; docs (the chunks the answer was built on) are kept for follow-ups.
+
+        Turns answered with DEGRADED_ANSWER are not recorded, so the conversation resumes where it
+        was before the outage.
+        """
+        if is_degraded_answer(answer):
+            return
+        answer = "\n".join(answer) if isinstance(answer, list) else str(answer)
+        with self._lock:
+            self.turns.append(Turn(query, answer, doc_info, estimate_tokens(query) + estimate_tokens(answer)))
+            self.last_docs = list(docs or [])
+            self.last_doc_info = doc_info
+
+            evicted = []
+            while len(self.turns) > 1 and sum(turn.tokens for turn in self.turns) > self.max_history_tokens:
+                evicted.append(self.turns.popleft())
+            if not evicted:
+                return
+            if self.summarizer is None:
+                self._summarized = self._with_questions(self._summarized, evicted)
+            else:
+                self._evicted.extend(evicted)
+            self._update_summary()
+            start = self.summarizer is not None and not self._summarizing
+            self._summarizing = self._summarizing or start
+        if start:
+            SUMMARY_EXECUTOR.submit(self._summarize_evicted)
+
+    def wait_for_summary(self, timeout=None):
+        """Blocks until the background summarizer has folded in every evicted turn; returns False on timeout."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._summarizing, timeout)
+
+    def _with_questions(self, summary, turns):
+        return " ".join([summary] + [f"User asked: {turn.query}" for turn in turns]).strip()
+
+    def _update_summary(self):
+        # Keep the most recent part if the summary still exceeds its budget
+        max_chars = self.max_summary_tokens * 4
+        self._summarized = self._summarized[-max_chars:]
+        self.summary = self._with_questions(self._summarized, self._evicted)[-max_chars:]
+
+    def _summarize_evicted(self):
+        """Folds the evicted turns into the summary with the summarizer, until none are left (runs in the background)."""
+        while True:
+            with self._lock:
+                turns, summary = list(self._evicted), self._summarized
+                if not turns:
+                    self._summarizing = False
+                    self._lock.notify_all()
+                    return
+            try:
+                summary = self._summarize(summary, turns)
+            except Exception:
+                logger.exception("Summarizing the conversation failed; keeping the questions of the evicted turns")
+                summary = self._with_questions(summary, turns)
+            with self._lock:
+                del self._evicted[:len(turns)]
+                self._summarized = summary
+                self._update_summary()
+
+    def _summarize(self, summary, turns):
+        with timed("summarize"):
+            prompt = SUMMARY_PROMPT.format_messages(
+                max_words=self.max_summary_tokens * 3 // 4,
+                summary=summary or "None",
+                turns="\n".join(f"User: {turn.query}\nAssistant: {turn.answer}" for turn in turns),
+            )
+            result = str(self.summarizer.invoke(prompt).content).strip()
+        # While the model is unavailable the summary is extended without it rather than replaced
+        if not result or is_degraded_answer(result):
+            return self._with_questions(summary, turns)
+        return result
+
+
+def has_unresolved_anaphor(query):
+    """True if the query uses a pronoun whose referent is not inside the query itself."""
+    for match in ANAPHOR_PATTERN.finditer(query):
+        pronoun, rest = match.group(1).lower(), query[match.end():]
+        if pronoun == "it" and IMPERSONAL_IT.match(rest) or pronoun == "they" and STORE_THEY.match(rest):
+            continue
+        if not QUERY_REFERENT.search(query[:match.start()]):
+            return True
+    return False
+
+
+def is_follow_up(query, memory, catalog=None):
+    """True if the query refers back to the conversation and cannot be answered on its own.
+
+    That is when it opens with a continuation or a demonstrative, has no content words of its own,
+    or uses a pronoun whose referent is neither in the query nor a product of the catalog (if
+    given). Words such as "other", "that" or "too" alone do not make a follow-up ("Can I pay with
+    PayPal too?").
+    """
+    if memory.is_empty:
+        return False
+    if FOLLOW_UP_OPENING.match(query) or not content_tokens(query):
+        return True
+    return has_unresolved_anaphor(query) and (catalog is None or catalog.match(query) is None)
+
+
+def can_reuse_context(query, memory, catalog=None):
+    """True if the follow-up only mentions things found in the previous turn's chunks."""
+    if not memory.last_docs or not is_follow_up(query, memory, catalog):
+        return False
+    context = set(TOKEN_PATTERN.findall(" ".join(doc.page_content for doc in memory.last_docs).lower()))
+    return all(token in context for token in content_tokens(query))
+
+
+class ConversationalChain:
+    """Answers the turns of a conversation with the registry's pipelines and bounded history.
+
+    Standalone questions are retrieved with the pipeline variant (default: the registry's
+    configured one), or answered from the product catalog; follow-ups reuse the previous turn's
+    chunks when possible, and are otherwise condensed into a standalone query first. The first
+    turn uses the variant's answer prompt; later turns use a prompt carrying the summary and the
+    recent window of the session's ConversationMemory.
+    """
+
+    def __init__(self, llm, registry):
+        self.llm = llm
+        self.registry = registry
+
+    def _history(self, memory):
+        return {"summary": memory.summary or "None", "history": memory.history_text() or "None"}
+
+    def _answer_prompt(self, query, docs, memory, variant=None):
+        if memory.is_empty:
+            return self.registry.prompt(query, docs, variant=variant)
+        return CONVERSATION_PROMPT.format_messages(context=get_context(docs), query=query, **self._history(memory))
+
+    def _condensed(self, result, query):
+        """Returns the condensed query, or the query itself if the model returned nothing or was unavailable."""
+        text = str(result.content).strip()
+        return query if not text or is_degraded_answer(text) else text
+
+    def condense(self, query, memory):
+        """Rewrites a follow-up into a standalone query with one LLM call."""
+        with timed("condense"):
+            result = self.llm.invoke(CONDENSE_PROMPT.format_messages(query=query, **self._history(memory)))
+        return self._condensed(result, query)
+
+    async def acondense(self, query, memory, limiter=None):
+        with timed("condense"):
+            async with limiter or get_llm_limiter():
+                result = await self.llm.ainvoke(CONDENSE_PROMPT.format_messages(query=query, **self._history(memory)))
+        return self._condensed(result, query)
+
+    def prepare(self, query, memory, variant=None):
+        """Returns ("catalog", lines, doc_info, []) or ("prompt", prompt, doc_info, docs) for the turn.
+
+        "catalog" lines are the answer itself: a catalog answer, or DEGRADED_ANSWER if the query cannot be
+        retrieved while the embedding model is unavailable.
+        """
+        if can_reuse_context(query, memory, self.registry.catalog):
+            METRICS.increment("chatbot_conversation_context_reused_total")
+            docs = memory.last_docs
+            return "prompt", self._answer_prompt(query, docs, memory), memory.last_doc_info, docs
+
+        search_query = self.condense(query, memory) if is_follow_up(query, memory, self.registry.catalog) else query
+        catalog_answer = self.registry.answer_from_catalog(search_query)
+        if catalog_answer is not None:
+            return ("catalog", *catalog_answer, [])
+
+        try:
+            docs = self.registry.retrieve(search_query, variant=variant)
+        except Exception as exc:
+            if not is_unavailable(exc):
+                raise
+            return "catalog", [DEGRADED_ANSWER], None, []
+        return "prompt", self._answer_prompt(query, docs, memory, variant), get_doc_info(docs, "unknown"), docs
+
+    async def aprepare(self, query, memory, limiter=None, variant=None):
+        """Async variant of prepare."""
+        if can_reuse_context(query, memory, self.registry.catalog):
+            METRICS.increment("chatbot_conversation_context_reused_total")
+            docs = memory.last_docs
+            return "prompt", self._answer_prompt(query, docs, memory), memory.last_doc_info, docs
+
+        search_query = await self.acondense(query, memory, limiter) if is_follow_up(query, memory, self.registry.catalog) else query
+        catalog_answer = self.registry.answer_from_catalog(search_query)
+        if catalog_answer is not None:
+            return ("catalog", *catalog_answer, [])
+
+        try:
+            docs = await self.registry.aretrieve(search_query, variant=variant)
+        except Exception as exc:
+            if not is_unavailable(exc):
+                raise
+            return "catalog", [DEGRADED_ANSWER], None, []
+        return "prompt", self._answer_prompt(query, docs, memory, variant), get_doc_info(docs, "unknown"), docs
+
+    def answer(self, query, memory, variant=None):
+        """Answers one turn and records it in memory; returns (response, doc_info)."""
+        kind, payload, doc_info, docs = self.prepare(query, memory, variant)
+        response = payload if kind == "catalog" else parse_answer(str(self.llm.invoke(payload).content))
+        memory.add_turn(query, response, doc_info, docs)
+        return response, doc_info
+
+    def stream(self, query, memory, variant=None):
+        """Streaming variant of answer: returns (iterator of lines, doc_info); the turn is recorded once the iterator is exhausted."""
+        kind, payload, doc_info, docs = self.prepare(query, memory, variant)
+        lines = iter(payload) if kind == "catalog" else LIST_PARSER.parse_iter(stream_text(self.llm, payload))
+
+        def record():
+            response = []
+            for line in lines:
+                response.append(line)
+                yield line
+            memory.add_turn(query, response, doc_info, docs)
+
+        return record(), doc_info
+
+    async def aanswer(self, query, memory, limiter=None, variant=None):
+        kind, payload, doc_info, docs = await self.aprepare(query, memory, limiter, variant)
+        response = payload if kind == "catalog" else await agenerate(self.llm, payload, limiter=limiter)
+        memory.add_turn(query, response, doc_info, docs)
+        return response, doc_info
+
+    async def astream(self, query, memory, limiter=None, variant=None):
+        """Returns (async iterator of answer lines, doc_info); the turn is recorded once the iterator is exhausted."""
+        kind, payload, doc_info, docs = await self.aprepare(query, memory, limiter, variant)
+
+        async def record():
+            response = []
+            if kind == "catalog":
+                response = list(payload)
+                for line in response:
+                    yield line
+            else:
+                async for line in astream_lines(self.llm, payload, limiter=limiter):
+                    response.append(line)
+                    yield line
+            memory.add_turn(query, response, doc_info, docs)
+
+        return record(), doc_info
+
+
+class SessionStore:
+    """Per-process conversation memories keyed by session id, with LRU eviction and an idle TTL.
+
+    Memories live in the worker that created them, so multi-worker deployments need sticky sessions.
+    """
+
+    def __init__(self, max_sessions=1000, ttl_seconds=1800, **memory_kwargs):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.memory_kwargs = memory_kwargs
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Returns the session's memory, creating a new one if it is unknown or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None or now - entry[0] > self.ttl_seconds:
+                entry = (now, ConversationMemory(**self.memory_kwargs))
+            self._sessions[session_id] = (now, entry[1])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return entry[1]
+
+    def __len__(self):
+        return len(self._sessions)
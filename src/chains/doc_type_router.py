@@ -0,0 +1,170 @@
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from src.chains.llm_route_chain import aroute_to_doc_type, route_to_doc_type
+from src.utils.concurrency import get_llm_limiter
+from src.utils.resilient_client import is_unavailable
+
+# Possible doc_types based on the corpus (plus "refund", which the LLM router may return)
+DOC_TYPES = ["returns", "refund", "faqs", "ordering", "products", "shipping", "common_issue"]
+
+# Keywords used when the embedding classifier is not confident enough
+DOC_TYPE_KEYWORDS = {
+    "returns": ["return", "refund", "exchange", "money back", "send back", "returnable"],
+    "shipping": ["shipping", "ship", "delivery", "deliver", "arrive", "express", "dispatch", "tracking"],
+    "ordering": ["order", "place an order", "checkout", "minimum", "edit my order", "confirmation"],
+    "products": ["price", "cost", "stock", "warranty", "size", "color", "colour", "brand", "feature", "material"],
+    "faqs": ["promo", "gift", "payment method", "pay with", "paypal", "apple pay", "declined", "address"],
+    "common_issue": ["damaged", "broken", "late", "wrong item", "cancel", "cancellation", "problem", "issue", "not delivered"],
+}
+
+
+class LLMRouter:
+    """Routes a query by asking the LLM to classify it (one model call per query)."""
+
+    def __init__(self, llm, doc_types=None):
+        self.llm = llm
+        self.doc_types = doc_types or DOC_TYPES
+
+    def route(self, query):
+        return route_to_doc_type(self.llm, query, self.doc_types)
+
+    async def aroute(self, query):
+        return await aroute_to_doc_type(self.llm, query, self.doc_types, limiter=get_llm_limiter())
+
+
+class KeywordRouter:
+    """Routes a query by counting doc_type keyword hits."""
+
+    def __init__(self, keywords=None):
+        self.patterns = {
+            doc_type: [re.compile(r"\b" + re.escape(word) + r"\b") for word in words]
+            for doc_type, words in (keywords or DOC_TYPE_KEYWORDS).items()
+        }
+
+    def classify(self, query):
+        """Returns (doc_type, margin) where margin is the hit-count lead over the runner-up."""
+        text = query.lower()
+        hits = Counter({
+            doc_type: sum(1 for pattern in patterns if pattern.search(text))
+            for doc_type, patterns in self.patterns.items()
+        })
+        ranked = hits.most_common(2) + [(None, 0)]
+        (best, best_hits), (_, second_hits) = ranked[0], ranked[1]
+        if best_hits == 0:
+            return None, 0
+        return best, best_hits - second_hits
+
+
+class CentroidRouter:
+    """Routes a query to the doc_type whose chunk-embedding centroid is closest.
+
+    Confidence is the cosine-similarity margin between the best and second best
+    centroid. Below ``confidence_threshold`` the keyword router is tried, and only
+    if that is ambiguous too the ``fallback`` router (normally an LLMRouter) is called.
+    """
+
+    def __init__(self, embeddings, centroids, fallback=None, confidence_threshold=0.05, keyword_router=None):
+        self.embeddings = embeddings
+        self.doc_types = list(centroids)
+        self.matrix = np.vstack([centroids[doc_type] for doc_type in self.doc_types]) if centroids else None
+        self.fallback = fallback
+        self.confidence_threshold = confidence_threshold
+        self.keyword_router = keyword_router or KeywordRouter()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, embeddings, **kwargs):
+        """Builds per-doc_type centroids from the vectors already stored in the index."""
+        data = vectorstore.get(include=["embeddings", "metadatas"])
+        grouped = {}
+        for vector, metadata in zip(data["embeddings"], data["metadatas"]):
+            doc_type = (metadata or {}).get("doc_type")
+            if doc_type:
+                grouped.setdefault(doc_type, []).append(vector)
+
+        centroids = {}
+        for doc_type, vectors in grouped.items():
+            centroid = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+            centroids[doc_type] = centroid / (np.linalg.norm(centroid) or 1.0)
+        return cls(embeddings, centroids, **kwargs)
+
+    def _classify_vector(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = self.matrix @ (vector / (np.linalg.norm(vector) or 1.0))
+        if len(scores) == 1:
+            return self.doc_types[0], 1.0
+        second, best = np.argsort(scores)[-2:]
+        return self.doc_types[best], float(scores[best] - scores[second])
+
+    def classify(self, query):
+        """Returns (doc_type, confidence) from the embedding centroids alone.
+
+        The confidence is 0 while the embedding model is unavailable, so the keyword router decides.
+        """
+        if self.matrix is None:
+            return None, 0.0
+        try:
+            vector = self.embeddings.embed_query(query)
+        except Exception as exc:
+            if not is_unavailable(exc):
+                raise
+            return None, 0.0
+        return self._classify_vector(vector)
+
+    async def aclassify(self, query):
+        if self.matrix is None:
+            return None, 0.0
+        try:
+            vector = await self.embeddings.aembed_query(query)
+        except Exception as exc:
+            if not is_unavailable(exc):
+                raise
+            return None, 0.0
+        return self._classify_vector(vector)
+
+    def _route_locally(self, query, doc_type, confidence):
+        """Returns the doc_type if the centroid or keyword classifier is confident, else None."""
+        if doc_type and confidence >= self.confidence_threshold:
+            return self._record("centroid", doc_type)
+
+        keyword_type, margin = self.keyword_router.classify(query)
+        if keyword_type and margin > 0:
+            return self._record("keyword", keyword_type)
+
+        if self.fallback is None:
+            return self._record("centroid", doc_type or keyword_type or "faqs")
+        return None
+
+    def route(self, query):
+        guess, confidence = self.classify(query)
+        doc_type = self._route_locally(query, guess, confidence)
+        if doc_type is None:
+            # The fallback returns None while the model is unavailable; the centroid's guess is used then
+            doc_type = self._record("llm", self.fallback.route(query) or guess)
+        return doc_type
+
+    async def aroute(self, query):
+        guess, confidence = await self.aclassify(query)
+        doc_type = self._route_locally(query, guess, confidence)
+        if doc_type is None:
+            doc_type = self._record("llm", await self.fallback.aroute(query) or guess)
+        return doc_type
+
+    def _record(self, method, doc_type):
+        with self._lock:
+            self.stats[method] += 1
+        return doc_type
+
+    def get_stats(self):
+        """Returns how many queries each routing method resolved and the LLM fallback rate."""
+        with self._lock:
+            stats = dict(self.stats)
+        total = sum(stats.values())
+        stats["total"] = total
+        stats["llm_fallback_rate"] = stats.get("llm", 0) / total if total else 0.0
+        return stats
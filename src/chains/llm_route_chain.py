@@ -1,128 +1,213 @@
+from functools import lru_cache
 from operator import itemgetter
 from typing import Literal
 from typing_extensions import TypedDict
 
 from langchain.prompts import PromptTemplate
+from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers import StrOutputParser, ListOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda, RunnableMap
 from langchain.chains import LLMRouterChain
+from src.utils.context_budget import fit_context
 from src.utils.custom_output_parser import CustomListOutputParser
+from src.utils.metrics import get_metrics_callbacks, timed
+from src.utils.resilient_client import is_degraded_answer
 
-def invoke_llm_with_vectorstore(llm, vectorstore, query):
-    """Invokes the LLM with the relevant documentation retrieved from the vectorstore and returns only the content using a custom output parser."""
-    # Retrieve the most relevant document from the vectorstore
-    docs = vectorstore.as_retriever().invoke(query)
-    context = docs[0].page_content if docs else "No relevant documentation found."
+# Router labels that are not doc_types of their own, mapped to the doc_type stamped on the chunks
+DOC_TYPE_ALIASES = {"refund": "returns"}
+# Possible doc_types based on the corpus
+DOC_TYPES = ["returns", "refund", "faqs", "ordering", "products", "shipping", "common_issue"]
 
-    # Create a prompt with the retrieved context
-    prompt_template = ChatPromptTemplate.from_messages([
-        ("system", "You are an assistant for an e-commerce platform. Use the following context to answer the query."),
-        ("system", "Context: {context}"),
-        ("human", "{query}"),
-    ])
-    prompt = prompt_template.format(context=context, query=query)
+# Static system message every answer prompt starts with, so the provider can cache it (see src.utils.prompt_cache)
+RESPONSE_SYSTEM_MESSAGE = SystemMessage(
+    content="You are an assistant for an e-commerce platform. Use the following context to answer the query."
+)
+# Prompt and parser shared by every answer; built once at import time
+RESPONSE_PROMPT = ChatPromptTemplate.from_messages([
+    RESPONSE_SYSTEM_MESSAGE,
+    ("human", "Context: {context}\n\nQuestion: {query}"),
+])
+LIST_PARSER = CustomListOutputParser(separator="\n")
+NO_DOCS_ANSWER = "I couldn't find relevant information to answer your question."
+
+def get_doc_info(docs, default_source):
+    """Returns "source - product name" for the top document, used as the answer's attribution."""
+    if not docs:
+        return None
+    metadata = docs[0].metadata
+    doc_info = metadata.get("source", "").split("/")[-1].split(".")[0] if "source" in metadata else default_source
+    if metadata.get("product_name"):
+        doc_info += f" - {metadata['product_name']}"
+    return doc_info
+
+def stream_text(llm, prompt):
+    """Yields the text of each chunk as the LLM generates it."""
+    for chunk in llm.stream(prompt):
+        yield str(chunk.content)
+
+def get_context(docs, numbered=False):
+    """Joins the retrieved chunks, deduplicated and trimmed to the context token budget, into the prompt context."""
+    docs = fit_context(docs)
+    if not docs:
+        return "No relevant documentation found."
+    if numbered:
+        return "\n\n".join(f"Document {i+1}:\n{doc.page_content}" for i, doc in enumerate(docs))
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def retrieve_similarity(vectorstore, query, retriever=None):
+    """Returns the most relevant documents (no routing), by default only the top one."""
+    retriever = retriever or vectorstore.as_retriever(search_kwargs={"k": 1})
+    return retriever.invoke(query, config={"callbacks": get_metrics_callbacks()})
+
+def prepare_similarity_search(vectorstore, query, retriever=None):
+    """Retrieves the most relevant documents (no routing) and returns (prompt, doc_info)."""
+    docs = retrieve_similarity(vectorstore, query, retriever=retriever)
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs), query=query), get_doc_info(docs, "unknown")
+
+def invoke_llm_with_similarity_search(llm, vectorstore, query, retriever=None):
+    """Invokes the LLM with the relevant documentation retrieved from the vectorstore (no routing) and parses the output."""
+    prompt, doc_info = prepare_similarity_search(vectorstore, query, retriever=retriever)
 
     # Use custom output parser to return only the content as a list
-    parser = CustomListOutputParser(separator="\n")
     result = llm.invoke(prompt)
-    return parser.parse(str(result.content))
+    return parse_answer(str(result.content)), doc_info
 
+def stream_llm_with_similarity_search(llm, vectorstore, query, retriever=None):
+    """Streaming variant of invoke_llm_with_similarity_search: returns (iterator of answer lines, doc_info)."""
+    prompt, doc_info = prepare_similarity_search(vectorstore, query, retriever=retriever)
+    return LIST_PARSER.parse_iter(stream_text(llm, prompt)), doc_info
 
-def route_to_doc_type(llm, query, doc_types):
-    """Use LLM to classify the query into a doc_type (e.g., returns, faqs, ordering, etc.)."""
+
+@lru_cache(maxsize=None)
+def get_route_prompt(doc_types):
+    """Returns the classification prompt for a tuple of doc_types (built once per tuple)."""
     system_msg = (
         "You are an e-commerce assistant. Classify the user's query into one of the following documentation types: "
         + ", ".join(doc_types) + ". "
         "Return only the most relevant type as a single word."
     )
-    prompt = ChatPromptTemplate.from_messages([
+    return ChatPromptTemplate.from_messages([
         ("system", system_msg),
         ("human", "{query}"),
     ])
-    chain = prompt | llm
-    result = chain.invoke({"query": query})
-    return str(result.content).strip().lower()
-
-def invoke_llm_with_vectorstore(llm, vectorstore, query):
-    """Route query to the right doc_type, retrieve only relevant docs, and parse output."""
-    # Define possible doc_types based on your corpus
-    doc_types = ["returns", "refund", "faqs", "ordering", "products", "shipping", "common_issue"]
-    doc_type = route_to_doc_type(llm, query, doc_types)
-    
-    # Retrieve only relevant docs for that doc_type
-    docs = vectorstore.similarity_search(f"{doc_type} {query}", k=1)
-    context = docs[0].page_content if docs else "No relevant documentation found."
+
+def parse_answer(text):
+    """Splits the answer into lines, returning the raw text if parsing fails."""
+    with timed("parse"):
+        try:
+            return LIST_PARSER.parse(text)
+        except Exception:
+            # Fallback if parsing fails
+            return text
+
+def route_query(llm, query, doc_types, router=None):
+    """Routes the query with the router if given, otherwise with the LLM classifier."""
+    with timed("route"):
+        return router.route(query) if router is not None else route_to_doc_type(llm, query, doc_types)
+
+def parse_doc_type(result):
+    """Returns the doc_type label of a routing answer, or None if the model was unavailable (degraded answer)."""
+    text = str(result.content).strip()
+    return None if is_degraded_answer(text) else text.lower()
+
+def route_to_doc_type(llm, query, doc_types):
+    """Use LLM to classify the query into a doc_type (e.g., returns, faqs, ordering, etc.).
+
+    Returns None while the model is unavailable; routed searches then search every doc_type.
+    """
+    prompt = get_route_prompt(tuple(doc_types)).invoke({"query": query})
+    result = llm.invoke(prompt)
+    return parse_doc_type(result)
+
+async def aroute_to_doc_type(llm, query, doc_types, limiter=None):
+    """Async variant of route_to_doc_type; the LLM call is bounded by the limiter if one is given."""
+    prompt = get_route_prompt(tuple(doc_types)).invoke({"query": query})
+    if limiter is None:
+        result = await llm.ainvoke(prompt)
+    else:
+        async with limiter:
+            result = await llm.ainvoke(prompt)
+    return parse_doc_type(result)
+
+def get_doc_type_filter(doc_type):
+    """Returns the metadata filter restricting a vectorstore search to the routed doc_type."""
+    doc_type = doc_type.strip(" .\"'`")
+    return {"doc_type": DOC_TYPE_ALIASES.get(doc_type, doc_type)}
+
+def search_routed(vectorstore, query, doc_type, search="similarity", **search_kwargs):
+    """Searches only the chunks of the routed doc_type, retrying unfiltered if the label matched nothing.
+
+    Without a doc_type (routing failed) every chunk is searched.
+    """
+    search_fn = vectorstore.max_marginal_relevance_search if search == "mmr" else vectorstore.similarity_search
+    with timed("vector_search"):
+        docs = search_fn(query, filter=get_doc_type_filter(doc_type), **search_kwargs) if doc_type else []
+        if not docs:
+            docs = search_fn(query, **search_kwargs)
+    return docs
+
+def retrieve_routed(llm, vectorstore, query, doc_types=None, router=None, search="similarity", **search_kwargs):
+    """Routes the query and searches only the chunks of that doc_type; returns (docs, doc_type)."""
+    doc_type = route_query(llm, query, doc_types or DOC_TYPES, router=router)
+    return search_routed(vectorstore, query, doc_type, search=search, **search_kwargs), doc_type
+
+def prepare_llm_with_vectorstore(llm, vectorstore, query, router=None, k=1):
+    """Routes the query, retrieves the top k documents of that doc_type and returns (prompt, doc_info)."""
+    docs, doc_type = retrieve_routed(llm, vectorstore, query, router=router, k=k)
     
     # Lấy thông tin về doc_type để trả về cho người dùng
-    doc_info = None
-    if docs:
-        metadata = docs[0].metadata
-        doc_source = metadata.get("source", "").split("/")[-1].split(".")[0] if "source" in metadata else doc_type
-        doc_info = f"{doc_source}"
-        if "product_name" in metadata:
-            doc_info += f" - {metadata['product_name']}"
-    
-    prompt_template = ChatPromptTemplate.from_messages([
-        ("system", "You are an assistant for an e-commerce platform. Use the following context to answer the query."),
-        ("system", "Context: {context}"),
-        ("human", "{query}"),
-    ])
-    prompt = prompt_template.format(context=context, query=query)
-    parser = CustomListOutputParser(separator="\n")
+    doc_info = get_doc_info(docs, doc_type)
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs), query=query), doc_info
+
+def invoke_llm_with_vectorstore(llm, vectorstore, query, router=None, k=1):
+    """Route query to the right doc_type, retrieve only relevant docs, and parse output.
+
+    If a router (see src.chains.doc_type_router) is given it is used instead of the LLM classification call.
+    """
+    prompt, doc_info = prepare_llm_with_vectorstore(llm, vectorstore, query, router=router, k=k)
     result = llm.invoke(prompt)
-    return parser.parse(str(result.content)), doc_info
+    return parse_answer(str(result.content)), doc_info
 
-def invoke_llm_with_vectorstore_mmr_improved(llm, vectorstore, query, doc_types=None):
-    if doc_types is None:
-        doc_types = ["returns", "refund", "faqs", "ordering", "products", "shipping", "common_issue"]
-    
-    doc_type = route_to_doc_type(llm, query, doc_types)
-    
-    mmr_params = {
-        "query": f"{doc_type} {query}",
-        "k": 1,                 
-        "fetch_k": 12,           
-        "lambda_mult": 0.75     
-    }
-    
-    docs = vectorstore.max_marginal_relevance_search(**mmr_params)
+def stream_llm_with_vectorstore(llm, vectorstore, query, router=None, k=1):
+    """Streaming variant of invoke_llm_with_vectorstore: returns (iterator of answer lines, doc_info)."""
+    prompt, doc_info = prepare_llm_with_vectorstore(llm, vectorstore, query, router=router, k=k)
+    return LIST_PARSER.parse_iter(stream_text(llm, prompt)), doc_info
+
+def prepare_llm_with_vectorstore_mmr(llm, vectorstore, query, doc_types=None, router=None, k=1, fetch_k=12,
+                                     lambda_mult=0.75):
+    """Routes the query and retrieves with MMR; returns (prompt, source_info), or (None, None) if nothing was found."""
+    # fetch_k candidates come only from the routed doc_type
+    docs, doc_type = retrieve_routed(
+        llm, vectorstore, query, doc_types=doc_types, router=router, search="mmr",
+        k=k, fetch_k=fetch_k, lambda_mult=lambda_mult,
+    )
     
     if not docs:
-        return "I couldn't find relevant information to answer your question.", None
-    
-    context = "\n\n".join([
-        f"Document {i+1}:\n{doc.page_content}" 
-        for i, doc in enumerate(docs)
-    ])
-    
-    doc_info = {}
-    if docs:
-        metadata = docs[0].metadata
-        doc_info = {
-            "source": metadata.get("source", "").split("/")[-1].split(".")[0] if "source" in metadata else doc_type,
-            "product_name": metadata.get("product_name", ""),
-            "relevance_score": metadata.get("score", "N/A")
-        }
-    
-    source_info = f"{doc_info.get('source', '')}"
-    if doc_info.get('product_name'):
-        source_info += f" - {doc_info['product_name']}"
+        return None, None
     
-    response_prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an assistant for an e-commerce platform. Use the following context to answer the query."),
-        ("system", "Context: {context}"),
-        ("human", "{query}")
-    ])
+    source_info = get_doc_info(docs, doc_type)
+    return RESPONSE_PROMPT.format_messages(context=get_context(docs, numbered=True), query=query), source_info
+
+def invoke_llm_with_vectorstore_mmr_improved(llm, vectorstore, query, doc_types=None, router=None, k=1, fetch_k=12,
+                                             lambda_mult=0.75):
+    formatted_prompt, source_info = prepare_llm_with_vectorstore_mmr(
+        llm, vectorstore, query, doc_types=doc_types, router=router, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+    )
+    if formatted_prompt is None:
+        return NO_DOCS_ANSWER, None
     
-    formatted_prompt = response_prompt.format(context=context, query=query)
     result = llm.invoke(formatted_prompt)
     
     # Parse and return the response
-    parser = CustomListOutputParser(separator="\n")
-    try:
-        parsed_response = parser.parse(str(result.content))
-        return parsed_response, source_info
-    except Exception:
-        # Fallback if parsing fails
-        return str(result.content), source_info
\ No newline at end of file
+    return parse_answer(str(result.content)), source_info
+
+def stream_llm_with_vectorstore_mmr_improved(llm, vectorstore, query, doc_types=None, router=None, k=1, fetch_k=12,
+                                             lambda_mult=0.75):
+    """Streaming variant of invoke_llm_with_vectorstore_mmr_improved: returns (iterator of answer lines, source_info)."""
+    formatted_prompt, source_info = prepare_llm_with_vectorstore_mmr(
+        llm, vectorstore, query, doc_types=doc_types, router=router, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+    )
+    if formatted_prompt is None:
+        return iter([NO_DOCS_ANSWER]), None
+    return LIST_PARSER.parse_iter(stream_text(llm, formatted_prompt)), source_info
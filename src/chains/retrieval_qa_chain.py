@@ -1,91 +1,119 @@
+from functools import lru_cache
+
 from langchain.chains import RetrievalQA
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate
+from src.utils.context_budget import fit_context
 from src.utils.custom_output_parser import CustomListOutputParser
+from src.utils.metrics import get_metrics_callbacks, timed
 
-def create_few_shot_prompt_template():
-    """
-    Creates a few-shot prompt template for the e-commerce customer support chatbot.
-    This approach provides examples of good responses to help guide the model.
+QA_SYSTEM_MESSAGE = "You are a knowledgeable e-commerce customer support assistant. Answer questions based on the provided context. Be helpful, concise, and friendly."
+
+FEW_SHOT_EXAMPLES = [
+    {
+        "query": "How do I return a product?",
+        "context": "Our return policy allows customers to return products within 14 days of delivery. The product must be in its original packaging and condition. To initiate a return, log into your account, go to order history, select the item, and click 'Return Item'. A return shipping label will be provided for your convenience.",
+        "answer": "You can return a product within 14 days of delivery. The item must be in its original packaging and condition. To start the return process:\n1. Log into your account\n2. Go to your order history\n3. Select the specific item\n4. Click 'Return Item'\n\nA return shipping label will be provided for you. If you need further assistance, please contact our customer service team."
+    },
+    {
+        "query": "When will my order arrive?",
+        "context": "Standard shipping typically takes 3-5 business days for domestic orders. Express shipping is available for an additional fee and delivers within 1-2 business days. International shipping may take 7-14 business days depending on the destination country. Once your order is shipped, you will receive a tracking number via email.",
+        "answer": "Your order delivery time depends on the shipping method you selected:\n- Standard shipping: 3-5 business days (domestic)\n- Express shipping: 1-2 business days (domestic)\n- International shipping: 7-14 business days\n\nYou'll receive a tracking number by email once your order ships. You can also check your order status in your account dashboard."
+    },
+    {
+        "query": "Do you have the SmartWatch Pro V3 in stock?",
+        "context": "Product Name: SmartWatch Pro V3\nBrand: TechZone\nPrice: $89.00\nWarranty: 18 months\nFeatures: Heart rate monitor, sleep tracking, water resistant, Bluetooth\nCompatible Devices: Android & iOS\nReturnable: Within 7 days (if unopened)\nIn Stock: Limited stock available",
+        "answer": "Yes, the SmartWatch Pro V3 is currently in stock, but with limited availability. This $89.00 smartwatch from TechZone features heart rate monitoring, sleep tracking, water resistance, and Bluetooth connectivity. It's compatible with both Android and iOS devices and comes with an 18-month warranty. If you're interested in purchasing, I'd recommend doing so soon while supplies last."
+    }
+]
+
+
+@lru_cache(maxsize=1)
+def get_few_shot_prefix():
+    """Returns the system message and the few-shot examples as messages, rendered once per process.
+
+    The prefix is static, so it is never formatted again and is sent byte-identical with every
+    prompt, which lets the provider cache it (see src.utils.prompt_cache).
     """
-    examples = [
-        {
-            "query": "How do I return a product?",
-            "context": "Our return policy allows customers to return products within 14 days of delivery. The product must be in its original packaging and condition. To initiate a return, log into your account, go to order history, select the item, and click 'Return Item'. A return shipping label will be provided for your convenience.",
-            "answer": "You can return a product within 14 days of delivery. The item must be in its original packaging and condition. To start the return process:\n1. Log into your account\n2. Go to your order history\n3. Select the specific item\n4. Click 'Return Item'\n\nA return shipping label will be provided for you. If you need further assistance, please contact our customer service team."
-        },
-        {
-            "query": "When will my order arrive?",
-            "context": "Standard shipping typically takes 3-5 business days for domestic orders. Express shipping is available for an additional fee and delivers within 1-2 business days. International shipping may take 7-14 business days depending on the destination country. Once your order is shipped, you will receive a tracking number via email.",
-            "answer": "Your order delivery time depends on the shipping method you selected:\n- Standard shipping: 3-5 business days (domestic)\n- Express shipping: 1-2 business days (domestic)\n- International shipping: 7-14 business days\n\nYou'll receive a tracking number by email once your order ships. You can also check your order status in your account dashboard."
-        },
-        {
-            "query": "Do you have the SmartWatch Pro V3 in stock?",
-            "context": "Product Name: SmartWatch Pro V3\nBrand: TechZone\nPrice: $89.00\nWarranty: 18 months\nFeatures: Heart rate monitor, sleep tracking, water resistant, Bluetooth\nCompatible Devices: Android & iOS\nReturnable: Within 7 days (if unopened)\nIn Stock: Limited stock available",
-            "answer": "Yes, the SmartWatch Pro V3 is currently in stock, but with limited availability. This $89.00 smartwatch from TechZone features heart rate monitoring, sleep tracking, water resistance, and Bluetooth connectivity. It's compatible with both Android and iOS devices and comes with an 18-month warranty. If you're interested in purchasing, I'd recommend doing so soon while supplies last."
-        }
-    ]
-
-    # Create the few-shot prompt template
     example_prompt = ChatPromptTemplate.from_messages([
         ("human", "Question: {query}"),
         ("human", "Context: {context}"),
         ("ai", "{answer}")
     ])
-
     few_shot_prompt = FewShotChatMessagePromptTemplate(
-        examples=examples,
+        examples=FEW_SHOT_EXAMPLES,
         example_prompt=example_prompt,
-        input_variables=["query", "context"]
     )
+    return (SystemMessage(content=QA_SYSTEM_MESSAGE), *few_shot_prompt.format_messages())
 
-    final_prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a knowledgeable e-commerce customer support assistant. Answer questions based on the provided context. Be helpful, concise, and friendly."),
-        few_shot_prompt,
-        ("human", "Question: {query}\nContext: {context}")
+
+def create_few_shot_prompt_template():
+    """
+    Creates a few-shot prompt template for the e-commerce customer support chatbot.
+    This approach provides examples of good responses to help guide the model.
+    Only the final question and context are formatted per call; the examples are the prerendered prefix.
+    """
+    return ChatPromptTemplate.from_messages([
+        *get_few_shot_prefix(),
+        ("human", "Question: {question}\nContext: {context}")
     ])
 
-    return final_prompt
 
+@lru_cache(maxsize=1)
+def get_qa_prefix():
+    """Returns the static system message the RetrievalQA prompt starts with (the few-shot prefix without examples)."""
+    return (SystemMessage(content=QA_SYSTEM_MESSAGE),)
 
-def invoke_retrieval_qa_chain(llm, vectorstore, query):
-    from langchain_core.prompts import PromptTemplate
-    
-    template = """You are a knowledgeable e-commerce customer support assistant. Answer questions based on the provided context. Be helpful, concise, and friendly.
 
-                Context: {context}
+QA_PROMPT = ChatPromptTemplate.from_messages([
+    *get_qa_prefix(),
+    ("human", "Context: {context}\n\nQuestion: {question}\n\nAnswer:"),
+])
+LIST_PARSER = CustomListOutputParser(separator="\n")
 
-                Question: {question}
 
-                Answer:"""
-    
-    prompt = PromptTemplate(
-        template=template,
-        input_variables=["context", "question"]
-    )
-    
-    qa_chain = RetrievalQA.from_chain_type(
+class BudgetedRetrievalQA(RetrievalQA):
+    """RetrievalQA whose retrieved documents are deduplicated and trimmed to the context budget before the "stuff" step."""
+
+    def _get_docs(self, question, *, run_manager):
+        return fit_context(super()._get_docs(question, run_manager=run_manager))
+
+    async def _aget_docs(self, question, *, run_manager):
+        return fit_context(await super()._aget_docs(question, run_manager=run_manager))
+
+
+def build_retrieval_qa_chain(llm, vectorstore, k=1, fetch_k=10, lambda_mult=0.7, few_shot=False):
+    """Builds the RetrievalQA chain with an MMR retriever; build once and reuse it for every question.
+
+    With ``few_shot`` the answer prompt is the few-shot chat prompt instead of QA_PROMPT.
+    """
+    return BudgetedRetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",  
         retriever=vectorstore.as_retriever(
             search_type="mmr", 
             search_kwargs={
-                "k": 1,         
-                "fetch_k": 10,  
-                "lambda_mult": 0.7  
+                "k": k,
+                "fetch_k": fetch_k,
+                "lambda_mult": lambda_mult
             }
         ),
         return_source_documents=True,
         chain_type_kwargs={
-            "prompt": prompt
+            "prompt": create_few_shot_prompt_template() if few_shot else QA_PROMPT
         },
         input_key="question"  
     )
-    
-    result = qa_chain.invoke({"question": query})
-    
-    answer = result.get("result", "I couldn't find relevant information to answer your question.")
-    source_docs = result.get("source_documents", [])
-    
+
+
+def format_qa_prompt(qa_chain, query, source_docs):
+    """Formats the chain's "stuff" prompt for documents already passed through fit_context."""
+    context = "\n\n".join(doc.page_content for doc in source_docs)
+    return qa_chain.combine_documents_chain.llm_chain.prompt.format_prompt(context=context, question=query)
+
+
+def get_source_info(source_docs):
+    """Returns "source - product name" for the top source document."""
     source_info = None
     if source_docs:
         doc = source_docs[0]
@@ -96,11 +124,38 @@ def invoke_retrieval_qa_chain(llm, vectorstore, query):
         source_info = source
         if product_name:
             source_info += f" - {product_name}"
+    return source_info
+
+
+def invoke_retrieval_qa_chain(llm, vectorstore, query, qa_chain=None):
+    """Answers the query with a RetrievalQA chain, building one only if no prebuilt chain is passed."""
+    if qa_chain is None:
+        qa_chain = build_retrieval_qa_chain(llm, vectorstore)
+    
+    # Records the retriever and LLM latency of the chain run
+    result = qa_chain.invoke({"question": query}, config={"callbacks": get_metrics_callbacks()})
+    
+    answer = result.get("result", "I couldn't find relevant information to answer your question.")
+    source_info = get_source_info(result.get("source_documents", []))
     
-    parser = CustomListOutputParser(separator="\n")
-    try:
-        parsed_answer = parser.parse(answer)
-        return parsed_answer, source_info
-    except Exception:
-        return answer, source_info
+    with timed("parse"):
+        try:
+            parsed_answer = LIST_PARSER.parse(answer)
+            return parsed_answer, source_info
+        except Exception:
+            return answer, source_info
 
+
+def stream_retrieval_qa_chain(llm, vectorstore, query, qa_chain=None):
+    """Streaming variant of invoke_retrieval_qa_chain: returns (iterator of answer lines, source_info).
+
+    Runs the chain's retriever and "stuff" prompt directly so the answer can be streamed from the LLM.
+    """
+    if qa_chain is None:
+        qa_chain = build_retrieval_qa_chain(llm, vectorstore)
+    
+    source_docs = fit_context(qa_chain.retriever.invoke(query, config={"callbacks": get_metrics_callbacks()}))
+    prompt = format_qa_prompt(qa_chain, query, source_docs)
+    
+    text_chunks = (str(chunk.content) for chunk in llm.stream(prompt))
+    return LIST_PARSER.parse_iter(text_chunks), get_source_info(source_docs)
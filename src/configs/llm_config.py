@@ -1,26 +1,183 @@
 import os
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-import google.auth
+from functools import lru_cache, partial
 from dotenv import load_dotenv
-
-credentials, project_id = google.auth.default()
+from src.utils.embedding_cache import CachedEmbeddings
+from src.utils.metrics import METRICS, InstrumentedEmbeddings, get_metrics_callbacks
+from src.utils.offline_models import HashEmbeddings, OfflineChatModel
+from src.utils.prompt_cache import ContextCache, PrefixCachedChatModel
+from src.utils.resilient_client import (
+    CircuitBreaker,
+    ResilientCaller,
+    ResilientChatModel,
+    ResilientEmbeddings,
+    get_rate_limiter,
+)
 
 load_dotenv()
-def get_embeddings_model():
-    """Returns the embeddings model configuration."""
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set")
-    return GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
-
-def get_chat_model():
-    """Returns the chat model configuration."""
+
+# "google" (default) or "offline" for the deterministic stand-ins used by benchmarks
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "google")
+
+EMBEDDING_MODEL = "models/embedding-001"
+CHAT_MODEL = "gemini-2.0-flash"
+
+@lru_cache(maxsize=1)
+def get_credentials():
+    """Resolves the Google application default credentials on first use: returns (credentials, project_id).
+
+    Resolution can query the metadata server, so it is deferred until a Google model is created
+    instead of running when this module is imported.
+    """
+    import google.auth
+    return google.auth.default()
+
+def get_client_options():
+    """Points the Gemini clients at GEMINI_API_ENDPOINT (e.g. the local stub server) when it is set."""
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if not endpoint:
+        return {}
+    return {"client_options": {"api_endpoint": endpoint}, "transport": "rest"}
+
+def to_gemini_contents(messages):
+    """Converts chat messages to Gemini (system_instruction, contents): system messages become the instruction."""
+    from google.ai.generativelanguage_v1beta import Content, Part
+
+    system_parts, contents = [], []
+    for message in messages:
+        part = Part(text=str(message.content))
+        if message.type == "system":
+            system_parts.append(part)
+            continue
+        role = "model" if message.type == "ai" else "user"
+        # Consecutive messages of one role form a single turn
+        if contents and contents[-1].role == role:
+            contents[-1].parts.append(part)
+        else:
+            contents.append(Content(role=role, parts=[part]))
+    return (Content(parts=system_parts) if system_parts else None), contents
+
+def create_gemini_context_cache(messages, ttl_seconds):
+    """Stores messages (a system message followed by conversation turns) as Gemini cached content; returns its name."""
+    from google.ai.generativelanguage_v1beta import CacheServiceClient, CachedContent
+    from google.protobuf import duration_pb2
+
+    system_instruction, contents = to_gemini_contents(messages)
+    options = get_client_options()
+    client = CacheServiceClient(
+        client_options={"api_key": os.getenv("GOOGLE_API_KEY"), **options.get("client_options", {})},
+        transport=options.get("transport"),
+    )
+    cached_content = client.create_cached_content(cached_content=CachedContent(
+        model=f"models/{CHAT_MODEL}",
+        system_instruction=system_instruction,
+        contents=contents,
+        ttl=duration_pb2.Duration(seconds=int(ttl_seconds)),
+    ))
+    return cached_content.name
+
+@lru_cache(maxsize=None)
+def get_caller(model_name, kind):
+    """Returns the process-wide rate limiter, circuit breaker and retry policy of a "chat" or "embedding" model.
+
+    Rate limits are in requests per minute (GEMINI_CHAT_RPM, GEMINI_EMBEDDING_RPM; 0 disables
+    them, the default for the offline models).
+    """
+    default_rpm = "0" if LLM_PROVIDER == "offline" else ("1000" if kind == "chat" else "1500")
+    rpm = float(os.getenv(f"GEMINI_{kind.upper()}_RPM", default_rpm))
+    breaker = CircuitBreaker(
+        failure_threshold=int(os.getenv("GEMINI_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET", "30")),
+    )
+    METRICS.register_collector(f"{kind}_breaker", breaker.get_stats)
+    return ResilientCaller(
+        model_name,
+        rate_limiter=get_rate_limiter(model_name, rpm),
+        breaker=breaker,
+        timeout=float(os.getenv("GEMINI_TIMEOUT", "30")),
+        max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "3")),
+    )
+
+def get_embeddings_model(cache_path=None):
+    """Returns the embeddings model configuration.
+
+    If ``cache_path`` (or the EMBEDDING_CACHE_PATH environment variable) is set, the model is
+    wrapped in a CachedEmbeddings backed by a SQLite file at that path.
+    """
+    if LLM_PROVIDER == "offline":
+        model_name = "offline-hash"
+        embeddings = HashEmbeddings(latency=float(os.getenv("OFFLINE_EMBEDDING_LATENCY", "0")))
+        batch_queries = embeddings.embed_documents
+    else:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY environment variable is not set")
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        get_credentials()
+        model_name = EMBEDDING_MODEL
+        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key, **get_client_options())
+        batch_queries = partial(embeddings.embed_documents, task_type="RETRIEVAL_QUERY")
+
+    # Concurrent query embeddings from all sessions are sent upstream in micro-batches
+    embeddings = ResilientEmbeddings(
+        embeddings,
+        get_caller(model_name, "embedding"),
+        batch_queries=batch_queries,
+        max_batch=int(os.getenv("EMBEDDING_QUERY_BATCH_SIZE", "32")),
+        max_wait=float(os.getenv("EMBEDDING_QUERY_BATCH_WAIT_MS", "5")) / 1000,
+    )
+
+    # Instrument the remote model itself, so cache hits are not counted as embedding calls
+    embeddings = InstrumentedEmbeddings(embeddings)
+
+    cache_path = cache_path or os.getenv("EMBEDDING_CACHE_PATH")
+    if not cache_path:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        cache_path,
+        model_name=model_name,
+        batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+        max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+        memory_size=int(os.getenv("EMBEDDING_MEMORY_CACHE_SIZE", "2048")),
+    )
+
+
+def get_chat_model(cached_prefix=None):
+    """Returns the chat model configuration, wrapped in the shared rate limit, retries and circuit breaker.
+
+    With GEMINI_CONTEXT_CACHE=true, prompts starting with ``cached_prefix`` (a static sequence of
+    messages) send that prefix as Gemini cached content instead of inline.
+    """
+    if LLM_PROVIDER == "offline":
+        model = OfflineChatModel(
+            latency=float(os.getenv("OFFLINE_LLM_LATENCY", "0.05")),
+            per_token_latency=float(os.getenv("OFFLINE_LLM_TOKEN_LATENCY", "0")),
+            callbacks=get_metrics_callbacks(),
+        )
+        return ResilientChatModel(model=model, caller=get_caller("offline-chat", "chat"))
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    get_credentials()
     os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
-    return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
+    model = ChatGoogleGenerativeAI(
+        model=CHAT_MODEL,
         temperature=0,
         max_tokens=None,
-        timeout=None,
-        max_retries=2,
-    )
\ No newline at end of file
+        timeout=float(os.getenv("GEMINI_TIMEOUT", "30")),
+        # Retried with jittered backoff by the resilient client instead
+        max_retries=0,
+        callbacks=get_metrics_callbacks(),
+        **get_client_options(),
+    )
+    if cached_prefix and os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true":
+        cache = ContextCache(
+            create_gemini_context_cache,
+            cached_prefix,
+            ttl_seconds=float(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600")),
+            # Gemini rejects caches below a per-model minimum size
+            min_tokens=int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024")),
+        )
+        METRICS.register_collector("context_cache", cache.get_stats)
+        model = PrefixCachedChatModel(model=model, context_cache=cache)
+    return ResilientChatModel(model=model, caller=get_caller(CHAT_MODEL, "chat"))
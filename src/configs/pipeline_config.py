@@ -0,0 +1,74 @@
+"""Runtime selection of the answer pipeline and its retrieval parameters.
+
+The configuration is read from the JSON file named by PIPELINE_CONFIG (as written by
+``python -m benchmarks.run_eval --write-config``), then overridden by CHAIN_VARIANT,
+RETRIEVAL_K, RETRIEVAL_FETCH_K, RETRIEVAL_LAMBDA_MULT, HYBRID_RRF_K and FEW_SHOT_PROMPT. Parameters left
+unset fall back to the defaults of the selected variant.
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, replace
+from typing import Optional
+
+# Retrieval (and prompt) parameters each variant uses, with their defaults
+VARIANT_PARAMS = {
+    "similarity": {"k": 1},
+    "routed": {"k": 1},
+    "mmr": {"k": 1, "fetch_k": 12, "lambda_mult": 0.75},
+    "retrieval_qa": {"k": 1, "fetch_k": 10, "lambda_mult": 0.7, "few_shot": False},
+    "hybrid": {"k": 1, "fetch_k": 20, "rrf_k": 60},
+}
+ENV_OVERRIDES = {
+    "variant": ("CHAIN_VARIANT", str),
+    "k": ("RETRIEVAL_K", int),
+    "fetch_k": ("RETRIEVAL_FETCH_K", int),
+    "lambda_mult": ("RETRIEVAL_LAMBDA_MULT", float),
+    "rrf_k": ("HYBRID_RRF_K", int),
+    "few_shot": ("FEW_SHOT_PROMPT", lambda value: value.lower() == "true"),
+}
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    variant: str = "retrieval_qa"
+    k: Optional[int] = None
+    fetch_k: Optional[int] = None
+    lambda_mult: Optional[float] = None
+    rrf_k: Optional[int] = None
+    few_shot: Optional[bool] = None
+
+    def __post_init__(self):
+        if self.variant not in VARIANT_PARAMS:
+            raise ValueError(f"Unknown chain variant '{self.variant}', expected one of {tuple(VARIANT_PARAMS)}")
+
+    def params(self, variant=None):
+        """Returns the retrieval parameters of a variant (default: the selected one), filling in its defaults."""
+        defaults = VARIANT_PARAMS[variant or self.variant]
+        return {name: default if getattr(self, name) is None else getattr(self, name) for name, default in defaults.items()}
+
+    @property
+    def label(self):
+        return " ".join([self.variant] + [f"{name}={value}" for name, value in self.params().items()])
+
+    def to_dict(self):
+        return {"variant": self.variant, **self.params()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in asdict(cls()) if data.get(name) is not None})
+
+
+def save_pipeline_config(config, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config.to_dict(), f, indent=2)
+
+
+def load_pipeline_config(path=None):
+    """Returns the configuration from path (default: PIPELINE_CONFIG) with environment overrides applied."""
+    path = path or os.getenv("PIPELINE_CONFIG")
+    config = PipelineConfig()
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config = PipelineConfig.from_dict(json.load(f))
+    overrides = {name: parse(os.environ[env]) for name, (env, parse) in ENV_OVERRIDES.items() if os.getenv(env)}
+    return replace(config, **overrides)
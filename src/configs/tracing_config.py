@@ -0,0 +1,22 @@
+import os
+
+
+def configure_langsmith_tracing():
+    """Enables LangSmith tracing only when LANGSMITH_API_KEY is set.
+
+    Tracing is skipped when LANGSMITH_TRACING is "false". Only the LangSmith settings that are
+    present are copied to their LANGCHAIN_* names, so missing ones no longer raise a TypeError.
+    Returns True if tracing was enabled.
+    """
+    api_key = os.getenv("LANGSMITH_API_KEY")
+    if not api_key or os.getenv("LANGSMITH_TRACING", "true").lower() == "false":
+        os.environ["LANGCHAIN_TRACING_V2"] = "false"
+        return False
+
+    os.environ["LANGCHAIN_TRACING_V2"] = "true"
+    os.environ["LANGCHAIN_API_KEY"] = api_key
+    for source, target in (("LANGSMITH_PROJECT", "LANGCHAIN_PROJECT"), ("LANGSMITH_ENDPOINT", "LANGCHAIN_ENDPOINT")):
+        value = os.getenv(source)
+        if value:
+            os.environ[target] = value
+    return True
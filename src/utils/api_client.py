@@ -0,0 +1,44 @@
+import json
+import urllib.request
+
+
+def _post(base_url, path, payload, timeout):
+    request = urllib.request.Request(
+        base_url.rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def chat(base_url, query, variant=None, session_id=None, timeout=60):
+    """Calls the API server's /chat endpoint; returns (response, doc_info).
+
+    Requests sharing a session_id are answered as one conversation.
+    """
+    payload = {"query": query, "variant": variant, "session_id": session_id}
+    with _post(base_url, "/chat", payload, timeout) as response:
+        body = json.loads(response.read())
+    return body["response"], body["doc_info"]
+
+
+def stream_chat(base_url, query, variant=None, session_id=None, timeout=60):
+    """Calls the API server's /chat/stream endpoint; returns (iterator of answer lines, doc_info).
+
+    The server sends newline-delimited JSON: one {"doc_info": ...} event, one {"line": ...} per answer line
+    and a final {"usage": ...} event with the request's token counts.
+    """
+    payload = {"query": query, "variant": variant, "session_id": session_id}
+    response = _post(base_url, "/chat/stream", payload, timeout)
+    doc_info = json.loads(response.readline())["doc_info"]
+
+    def lines():
+        with response:
+            for raw in response:
+                if raw.strip():
+                    event = json.loads(raw)
+                    if "line" in event:
+                        yield event["line"]
+
+    return lines(), doc_info
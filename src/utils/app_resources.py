@@ -0,0 +1,191 @@
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where a single process syncs the index
+    fcntl = None
+
+from src.chains.chain_registry import ChainRegistry, get_prompt_prefix
+from src.chains.conversation_chain import ConversationalChain, SessionStore
+from src.chains.doc_type_router import CentroidRouter, LLMRouter
+from src.configs.llm_config import get_chat_model, get_embeddings_model
+from src.configs.pipeline_config import load_pipeline_config
+from src.utils.lexical_index import LEXICAL_INDEX_FILE, BM25Index, load_or_build_lexical_index
+from src.utils.metrics import METRICS, timed
+from src.utils.mmap_vectorstore import MMAP_INDEX_DIR, MmapVectorStore, sync_mmap_index
+from src.utils.product_catalog import CATALOG_FILE, ProductCatalog
+from src.utils.semantic_cache import SemanticCache
+from src.utils.vectorstore_utils import create_vectorstore, load_documents, open_vectorstore
+
+
+INDEX_LOCK_FILE = ".index.lock"
+
+
+@dataclass
+class Resources:
+    """Everything a process needs to answer questions; built once per process (Streamlit or API worker)."""
+    chat_model: Any
+    embeddings_model: Any
+    vectorstore: Any
+    router: Any
+    lexical_index: BM25Index
+    catalog: ProductCatalog
+    registry: ChainRegistry
+    answer_cache: SemanticCache
+    conversation: ConversationalChain
+    sessions: SessionStore
+    chunk_count: int
+
+
+def get_embeddings():
+    return get_embeddings_model(cache_path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache/embeddings.sqlite"))
+
+
+def get_vectorstore_backend():
+    """Returns (backend, quantize) from VECTORSTORE_BACKEND ("chroma" or "mmap") and VECTORSTORE_QUANTIZE ("int8")."""
+    backend = os.getenv("VECTORSTORE_BACKEND", "chroma")
+    if backend not in ("chroma", "mmap"):
+        raise ValueError(f"Unknown VECTORSTORE_BACKEND '{backend}', expected 'chroma' or 'mmap'")
+    return backend, os.getenv("VECTORSTORE_QUANTIZE") or None
+
+
+def build_index(data_path="data", persist_directory="chroma_vectorstore", embeddings_model=None):
+    """Syncs the vector index, lexical index and product catalog in persist_directory with data_path.
+
+    Returns (vectorstore, lexical_index, catalog).
+    """
+    embeddings_model = embeddings_model or get_embeddings()
+    backend, quantize = get_vectorstore_backend()
+    docs = load_documents(data_path)
+    # Chroma keeps the incremental index; the mmap backend serves an export of its vectors
+    vectorstore = create_vectorstore(
+        docs, embeddings_model, persist_directory,
+        partition_by_doc_type=backend == "chroma",
+        max_workers=int(os.getenv("INGEST_WORKERS", "0")) or None,
+    )
+    if backend == "mmap":
+        vectorstore = sync_mmap_index(vectorstore, os.path.join(persist_directory, MMAP_INDEX_DIR), quantize=quantize)
+    lexical_index = load_or_build_lexical_index(vectorstore, persist_directory)
+    catalog = ProductCatalog.from_documents(docs)
+    catalog.save(os.path.join(persist_directory, CATALOG_FILE))
+    return vectorstore, lexical_index, catalog
+
+
+@contextmanager
+def index_lock(persist_directory):
+    """Holds an exclusive inter-process lock on persist_directory.
+
+    API workers start together and would otherwise all sync the same Chroma database, BM25
+    index and mmap export at once; with the lock one worker syncs while the others wait and
+    then find the index up to date (an incremental sync without writes or embedding calls).
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    with open(os.path.join(persist_directory, INDEX_LOCK_FILE), "a") as lock_file:
+        if fcntl is not None:
+            with timed("index_lock_wait"):
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def open_index(persist_directory="chroma_vectorstore", embeddings_model=None):
+    """Opens an index prebuilt by build_index without reading data/ or writing to the index.
+
+    Returns (vectorstore, lexical_index, catalog).
+    """
+    embeddings_model = embeddings_model or get_embeddings()
+    backend, _ = get_vectorstore_backend()
+    if backend == "mmap":
+        vectorstore = MmapVectorStore(os.path.join(persist_directory, MMAP_INDEX_DIR), embeddings_model)
+    else:
+        vectorstore = open_vectorstore(embeddings_model, persist_directory, partition_by_doc_type=True)
+    lexical_index = BM25Index.load(os.path.join(persist_directory, LEXICAL_INDEX_FILE))
+    catalog = ProductCatalog.load(os.path.join(persist_directory, CATALOG_FILE))
+    return vectorstore, lexical_index, catalog
+
+
+def build_resources(data_path="data", persist_directory="chroma_vectorstore", prebuilt=None):
+    """Loads the models, syncs the vector index with data_path and builds the chains, answer cache and session store.
+
+    With ``prebuilt`` (default: INDEX_MODE=prebuilt) the index in persist_directory is opened as is
+    and data_path is never read, which makes cold starts independent of the corpus size.
+    """
+    if prebuilt is None:
+        prebuilt = os.getenv("INDEX_MODE", "sync") == "prebuilt"
+    # Variants: "similarity", "routed" (similarity search), "mmr" (routed MMR search), "retrieval_qa",
+    # "hybrid" (routed BM25 + vector search); the variant and its retrieval parameters come from
+    # PIPELINE_CONFIG / CHAIN_VARIANT / RETRIEVAL_* (see src.configs.pipeline_config)
+    config = load_pipeline_config()
+    # The static prefix of the configured variant's answer prompt can be cached by the provider (GEMINI_CONTEXT_CACHE)
+    chat_model = get_chat_model(cached_prefix=get_prompt_prefix(config))
+    embeddings_model = get_embeddings()
+    if prebuilt:
+        vectorstore, lexical_index, catalog = open_index(persist_directory, embeddings_model)
+    else:
+        with index_lock(persist_directory):
+            vectorstore, lexical_index, catalog = build_index(data_path, persist_directory, embeddings_model)
+    router = CentroidRouter.from_vectorstore(
+        vectorstore,
+        embeddings_model,
+        fallback=LLMRouter(chat_model),
+        confidence_threshold=float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.05")),
+    )
+    registry = ChainRegistry(
+        chat_model,
+        vectorstore,
+        router=router,
+        config=config,
+        lexical_index=lexical_index,
+        # Simple product attribute lookups are answered from the catalog without an LLM call
+        catalog=catalog if os.getenv("CATALOG_FAST_PATH", "true").lower() != "false" else None,
+    )
+    answer_cache = SemanticCache(
+        embeddings_model,
+        similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "1024")),
+        # A prebuilt index does not follow data/, so neither does the cache
+        data_path=None if prebuilt else data_path,
+    )
+    # Multi-turn chat: the registry's configured pipeline with per-session memory
+    conversation = ConversationalChain(chat_model, registry)
+    sessions = SessionStore(
+        max_sessions=int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000")),
+        ttl_seconds=float(os.getenv("CONVERSATION_TTL", "1800")),
+        max_history_tokens=int(os.getenv("CONVERSATION_HISTORY_TOKENS", "600")),
+        max_summary_tokens=int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "200")),
+        summarizer=chat_model,
+    )
+    # Cache and router statistics are exported as gauges alongside the stage latencies
+    METRICS.register_collector("semantic_cache", answer_cache.get_stats)
+    METRICS.register_collector("router", router.get_stats)
+    if hasattr(embeddings_model, "get_stats"):
+        METRICS.register_collector("embedding_cache", embeddings_model.get_stats)
+    return Resources(
+        chat_model=chat_model,
+        embeddings_model=embeddings_model,
+        vectorstore=vectorstore,
+        router=router,
+        lexical_index=lexical_index,
+        catalog=catalog,
+        registry=registry,
+        answer_cache=answer_cache,
+        conversation=conversation,
+        sessions=sessions,
+        chunk_count=len(vectorstore.get(include=[])["ids"]),
+    )
+
+
+if __name__ == "__main__":
+    # Prebuild the index (e.g. in a container build step) for INDEX_MODE=prebuilt
+    persist_directory = os.getenv("PERSIST_DIRECTORY", "chroma_vectorstore")
+    with index_lock(persist_directory):
+        vectorstore, lexical_index, catalog = build_index(os.getenv("DATA_PATH", "data"), persist_directory)
+    print(f"Indexed {len(lexical_index.ids)} chunks and {len(catalog)} products")
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import weakref
+
+
+class AsyncLimiter:
+    """Bounds the number of concurrent outbound calls made from coroutines.
+
+    One semaphore is kept per event loop, so the limiter can be shared module-wide
+    (e.g. by several API workers or repeated ``asyncio.run`` calls).
+
+        async with limiter:
+            await llm.ainvoke(prompt)
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def __aenter__(self):
+        await self._semaphore().acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore().release()
+        return False
+
+
+_llm_limiter = None
+
+
+def get_llm_limiter():
+    """Returns the process-wide limiter for outbound Gemini calls (GEMINI_MAX_CONCURRENCY, default 8)."""
+    global _llm_limiter
+    if _llm_limiter is None:
+        _llm_limiter = AsyncLimiter(int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")))
+    return _llm_limiter
@@ -0,0 +1,65 @@
+"""Deduplication and token budgeting of retrieved chunks before they are stuffed into a prompt.
+
+Input tokens drive both generation latency and cost, so every answer prompt carries at most
+CONTEXT_MAX_TOKENS (default 1500) tokens of context. Chunks keep their rank order; chunks
+whose text repeats a higher-ranked one are dropped, and the chunk crossing the budget is cut
+at a line boundary.
+"""
+import os
+
+from langchain_core.documents import Document
+
+from src.utils.metrics import METRICS, estimate_tokens
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+# A cut chunk shorter than this is dropped instead, as a fragment carries little information
+MIN_PARTIAL_TOKENS = 32
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def dedupe_docs(docs):
+    """Drops chunks whose text equals or is contained in a higher-ranked chunk (e.g. overlapping splits)."""
+    kept, seen = [], []
+    for doc in docs:
+        text = _normalize(doc.page_content)
+        if not text or any(text in other for other in seen):
+            METRICS.increment("chatbot_context_chunks_dropped_total", reason="duplicate")
+            continue
+        kept.append(doc)
+        seen.append(text)
+    return kept
+
+
+def _truncate(doc, max_tokens):
+    """Returns a copy of doc cut to about max_tokens, at the last line break that fits if there is one."""
+    max_chars = max_tokens * 4
+    text = doc.page_content[:max_chars]
+    cut = text.rfind("\n")
+    if cut > max_chars // 2:
+        text = text[:cut]
+    return Document(page_content=text.rstrip(), metadata=doc.metadata)
+
+
+def fit_context(docs, max_tokens=None):
+    """Returns the deduplicated docs, in rank order, that fit in max_tokens (default: CONTEXT_MAX_TOKENS).
+
+    The top chunk is always kept (cut if it alone exceeds the budget).
+    """
+    max_tokens = max_tokens or CONTEXT_MAX_TOKENS
+    fitted, used = [], 0
+    for doc in dedupe_docs(docs):
+        tokens = estimate_tokens(doc.page_content)
+        remaining = max_tokens - used
+        if tokens > remaining:
+            if fitted and remaining < MIN_PARTIAL_TOKENS:
+                METRICS.increment("chatbot_context_chunks_dropped_total", reason="budget")
+                METRICS.increment("chatbot_context_tokens_trimmed_total", tokens)
+                continue
+            doc = _truncate(doc, remaining)
+            METRICS.increment("chatbot_context_tokens_trimmed_total", tokens - remaining)
+        fitted.append(doc)
+        used += estimate_tokens(doc.page_content)
+    return fitted
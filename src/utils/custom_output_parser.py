@@ -10,6 +10,30 @@ class CustomListOutputParser(BaseOutputParser):
     def parse(self, text: str) -> list:
         items = text.strip().split(self.separator)
         return [item.strip() for item in items if item.strip()]
+
+    def _split_completed(self, buffer):
+        """Splits off the items completed so far; returns (items, remaining buffer)."""
+        *items, buffer = buffer.split(self.separator)
+        return [item.strip() for item in items if item.strip()], buffer
+
+    def parse_iter(self, chunks):
+        """Incremental mode: yields each item as soon as its separator arrives in a stream of text chunks."""
+        buffer = ""
+        for chunk in chunks:
+            items, buffer = self._split_completed(buffer + chunk)
+            yield from items
+        if buffer.strip():
+            yield buffer.strip()
+
+    async def aparse_iter(self, chunks):
+        """Async variant of parse_iter for an async iterator of text chunks."""
+        buffer = ""
+        async for chunk in chunks:
+            items, buffer = self._split_completed(buffer + chunk)
+            for item in items:
+                yield item
+        if buffer.strip():
+            yield buffer.strip()
     
     def get_format_instructions(self) -> str:
         if self.separator == "\n":
@@ -1,7 +1,40 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter, CharacterTextSplitter
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from src.utils.metrics import METRICS, STAGE_METRIC, timed
+from src.utils.partitioned_vectorstore import PartitionedVectorStore, sync_partitions
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import json
+import logging
 import os
+import queue
 import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_NAME_PATTERN = re.compile(r"Product Name: (.+)")
+BRAND_PATTERN = re.compile(r"Brand: (.+)")
+PRICE_PATTERN = re.compile(r"Price: (.+)")
+QUESTION_PATTERN = re.compile(r"Q: (.+?)\nA:")
+ISSUE_PATTERN = re.compile(r"Issue: (.+?)\nSolution:")
+
+# Cấu hình splitter theo loại tài liệu; cũng được dùng để tính fingerprint của chunk
+SPLITTER_SETTINGS = {
+    "products": {"chunk_size": 300, "chunk_overlap": 50, "separators": ["\n\nProduct Name:", "\n\n"]},
+    "faqs": {"chunk_size": 300, "chunk_overlap": 50, "separators": ["\n\nQ:", "\n\n"]},
+    "common_issue": {"chunk_size": 300, "chunk_overlap": 50, "separators": ["Issue:", "\n\n"]},
+}
+DEFAULT_SPLITTER_SETTINGS = {"chunk_size": 250, "chunk_overlap": 30}
+
+# Số chunk được embed trong mỗi lần gọi embeddings khi cập nhật vector store
+EMBEDDING_BATCH_SIZE = 64
+# Số batch tối đa chờ embed; khi đầy, việc chia chunk tạm dừng (backpressure)
+MAX_PENDING_BATCHES = 4
 
 def get_document_type(file_path):
     """Xác định loại tài liệu dựa trên tên file."""
@@ -16,17 +49,17 @@ def extract_metadata(text, doc_type):
     # Trích xuất các thông tin thêm dựa vào loại tài liệu
     if doc_type == "products":
         # Tìm tên sản phẩm
-        product_match = re.search(r"Product Name: (.+)", text)
+        product_match = PRODUCT_NAME_PATTERN.search(text)
         if product_match:
             metadata["product_name"] = product_match.group(1)
             
         # Tìm thương hiệu
-        brand_match = re.search(r"Brand: (.+)", text)
+        brand_match = BRAND_PATTERN.search(text)
         if brand_match:
             metadata["brand"] = brand_match.group(1)
             
         # Tìm giá
-        price_match = re.search(r"Price: (.+)", text)
+        price_match = PRICE_PATTERN.search(text)
         if price_match:
             metadata["price"] = price_match.group(1)
     
@@ -35,7 +68,7 @@ def extract_metadata(text, doc_type):
         metadata["content_type"] = "question_answer"
         
         # Tìm cụ thể câu hỏi nếu có
-        q_match = re.search(r"Q: (.+?)\nA:", text)
+        q_match = QUESTION_PATTERN.search(text)
         if q_match:
             metadata["question"] = q_match.group(1)
     
@@ -49,41 +82,30 @@ def extract_metadata(text, doc_type):
         metadata["content_type"] = "issue_solution"
         
         # Tìm tên vấn đề
-        issue_match = re.search(r"Issue: (.+?)\nSolution:", text)
+        issue_match = ISSUE_PATTERN.search(text)
         if issue_match:
             metadata["issue"] = issue_match.group(1)
         
     return metadata
 
+def get_splitter_settings(doc_type):
+    """Trả về cấu hình splitter cho loại tài liệu."""
+    return SPLITTER_SETTINGS.get(doc_type, DEFAULT_SPLITTER_SETTINGS)
+
+@lru_cache(maxsize=None)
 def get_text_splitter(doc_type):
-    """Trả về text splitter phù hợp với loại tài liệu."""
-    if doc_type == "products":
-        # Sử dụng RecursiveCharacterTextSplitter cho sản phẩm để tách theo từng sản phẩm
-        return RecursiveCharacterTextSplitter(
-            chunk_size=300,
-            chunk_overlap=50,
-            separators=["\n\nProduct Name:", "\n\n"]
-        )
-    elif doc_type == "faqs":
-        # Sử dụng RecursiveCharacterTextSplitter cho FAQs để tách theo Q&A
-        return RecursiveCharacterTextSplitter(
-            chunk_size=300,
-            chunk_overlap=50,
-            separators=["\n\nQ:", "\n\n"]
-        )
-    elif doc_type == "common_issue":
-        # Tách theo các vấn đề phổ biến
-        return RecursiveCharacterTextSplitter(
-            chunk_size=300,
-            chunk_overlap=50,
-            separators=["Issue:", "\n\n"]
-        )
-    else:
-        # Mặc định dùng CharacterTextSplitter với kích thước nhỏ hơn
-        return CharacterTextSplitter(
-            chunk_size=250,
-            chunk_overlap=30
-        )
+    """Trả về text splitter phù hợp với loại tài liệu (tạo một lần cho mỗi loại)."""
+    settings = get_splitter_settings(doc_type)
+    if "separators" in settings:
+        # Products: tách theo từng sản phẩm, FAQs: theo Q&A, common_issue: theo từng vấn đề
+        return RecursiveCharacterTextSplitter(**settings)
+    # Mặc định dùng CharacterTextSplitter với kích thước nhỏ hơn
+    return CharacterTextSplitter(**settings)
+
+def get_chunk_fingerprint(text, doc_type):
+    """Tính fingerprint của chunk từ nội dung, doc_type và cấu hình splitter."""
+    payload = json.dumps([text, doc_type, get_splitter_settings(doc_type)], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 def chunk_document(document, doc_type):
     """Chia nhỏ tài liệu thành các phần và giữ nguyên metadata."""
@@ -97,37 +119,166 @@ def chunk_document(document, doc_type):
         metadata = document.metadata.copy() if hasattr(document, 'metadata') else {}
         metadata.update(extract_metadata(chunk, doc_type))
         metadata["chunk_id"] = i
+        metadata["chunk_hash"] = get_chunk_fingerprint(chunk, doc_type)
         
         # Tạo Document mới với metadata đầy đủ
-        from langchain_core.documents import Document
         docs_with_metadata.append(Document(page_content=chunk, metadata=metadata))
         
     return docs_with_metadata
 
-def process_documents(docs):
-    """Xử lý danh sách tài liệu, chia nhỏ chúng và thêm metadata."""
-    processed_docs = []
+def process_document(doc):
+    """Xác định loại tài liệu từ tên file và chia nhỏ tài liệu; chạy được trong process con."""
+    # Lấy loại tài liệu từ tên file
+    doc_type = get_document_type(doc.metadata.get("source", "unknown"))
     
-    for doc in docs:
-        # Lấy loại tài liệu từ tên file
-        doc_type = get_document_type(doc.metadata.get("source", "unknown"))
-        
-        # Thêm doc_type vào metadata
-        if not hasattr(doc, 'metadata'):
-            doc.metadata = {}
-        doc.metadata["doc_type"] = doc_type
-        
-        # Chia nhỏ tài liệu
-        chunked_docs = chunk_document(doc, doc_type)
-        processed_docs.extend(chunked_docs)
+    # Thêm doc_type vào metadata
+    if not hasattr(doc, 'metadata'):
+        doc.metadata = {}
+    doc.metadata["doc_type"] = doc_type
     
-    return processed_docs
-
-def create_optimized_vectorstore(docs, embeddings, persist_directory):
-    """Tạo và lưu trữ vector store với các tài liệu đã được xử lý."""
-    processed_docs = process_documents(docs)
-    return Chroma.from_documents(
-        documents=processed_docs, 
-        embedding=embeddings,
+    # Chia nhỏ tài liệu
+    return chunk_document(doc, doc_type)
+
+def _timed_process_document(doc):
+    """Như process_document, kèm thời gian xử lý (giây) để process cha ghi vào metrics."""
+    started = time.perf_counter()
+    chunks = process_document(doc)
+    return chunks, time.perf_counter() - started
+
+def _recorded(result):
+    chunks, duration = result
+    METRICS.observe(STAGE_METRIC, duration, stage="process_document")
+    return chunks
+
+def iter_processed_documents(docs, max_workers=None):
+    """Chia nhỏ từng tài liệu khi được đọc và trả về các chunk theo thứ tự (generator).
+
+    Với max_workers > 1, việc chia chunk và trích xuất metadata chạy trên một process pool;
+    chỉ tối đa 2 * max_workers tài liệu được xử lý đồng thời, nên bộ nhớ không tăng theo
+    kích thước corpus và việc đọc file dừng lại khi bên tiêu thụ (embedding) chậm hơn.
+    Thời gian xử lý mỗi tài liệu được ghi vào stage "process_document".
+    """
+    if not max_workers or max_workers <= 1:
+        for doc in docs:
+            yield from _recorded(_timed_process_document(doc))
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for doc in docs:
+            pending.append(executor.submit(_timed_process_document, doc))
+            if len(pending) >= 2 * max_workers:
+                yield from _recorded(pending.popleft().result())
+        while pending:
+            yield from _recorded(pending.popleft().result())
+
+def process_documents(docs, max_workers=None):
+    """Xử lý danh sách tài liệu, chia nhỏ chúng và thêm metadata."""
+    return list(iter_processed_documents(docs, max_workers=max_workers))
+
+class BatchWriter:
+    """Ghi các batch chunk vào vector store trên một thread riêng.
+
+    Hàng đợi có giới hạn: khi đã có max_pending batch chờ embed, put() sẽ chờ, nên việc chia
+    chunk (CPU) chạy song song với việc gọi embeddings (I/O) mà bộ nhớ vẫn bị chặn trên.
+    """
+
+    _DONE = object()
+
+    def __init__(self, vectorstore, max_pending=MAX_PENDING_BATCHES):
+        self.vectorstore = vectorstore
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="vectorstore-writer", daemon=True)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is self._DONE:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self.vectorstore.add_documents(batch, ids=[doc.metadata["chunk_hash"] for doc in batch])
+            except Exception as e:
+                self._error = e
+
+    def put(self, batch):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(batch)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queue.put(self._DONE)
+        self._thread.join()
+        if exc_type is None and self._error is not None:
+            raise self._error
+        return False
+
+def sync_vectorstore(vectorstore, processed_docs, batch_size=EMBEDDING_BATCH_SIZE, max_pending_batches=MAX_PENDING_BATCHES):
+    """Đồng bộ vector store với các chunk hiện tại: chỉ embed chunk mới, xoá chunk đã biến mất.
+
+    processed_docs có thể là một generator: các chunk mới được gom thành batch và embed ngay
+    trong khi phần còn lại của corpus vẫn đang được xử lý; chỉ id của các chunk được giữ lại.
+    """
+    existing_ids = set(vectorstore.get(include=[])["ids"])
+    # Dùng fingerprint làm id, các chunk trùng nội dung chỉ được lưu một lần
+    seen_ids = set()
+    added = 0
+
+    with BatchWriter(vectorstore, max_pending=max_pending_batches) as writer:
+        batch = []
+        for doc in processed_docs:
+            chunk_id = doc.metadata["chunk_hash"]
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            if chunk_id in existing_ids:
+                continue
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                writer.put(batch)
+                added += len(batch)
+                batch = []
+        if batch:
+            writer.put(batch)
+            added += len(batch)
+
+    stale_ids = list(existing_ids - seen_ids)
+    for start in range(0, len(stale_ids), batch_size):
+        vectorstore.delete(ids=stale_ids[start:start + batch_size])
+
+    stats = {
+        "added": added,
+        "deleted": len(stale_ids),
+        "unchanged": len(seen_ids) - added,
+    }
+    logger.info("Vector store sync: %s", stats)
+    return stats
+
+def create_optimized_vectorstore(docs, embeddings, persist_directory, incremental=True, batch_size=EMBEDDING_BATCH_SIZE,
+                                 partition_by_doc_type=False, max_workers=None):
+    """Tạo và lưu trữ vector store với các tài liệu đã được xử lý.
+
+    Ở chế độ incremental, vector của các chunk không đổi được giữ lại và chỉ chunk mới
+    hoặc đã thay đổi mới được embed; nếu không, collection được xây dựng lại từ đầu.
+    Với partition_by_doc_type, mỗi doc_type có thêm một collection riêng để tìm kiếm theo filter.
+    docs có thể là một generator; tài liệu được chia chunk (trên max_workers process) và
+    embed theo từng batch trong khi đang đọc.
+    """
+    processed_docs = iter_processed_documents(docs, max_workers=max_workers)
+    vectorstore = Chroma(
+        embedding_function=embeddings,
         persist_directory=persist_directory
     )
+    if not incremental:
+        vectorstore.reset_collection()
+    with timed("index_sync"):
+        sync_vectorstore(vectorstore, processed_docs, batch_size=batch_size)
+    if partition_by_doc_type:
+        return PartitionedVectorStore(vectorstore, sync_partitions(vectorstore, persist_directory))
+    return vectorstore
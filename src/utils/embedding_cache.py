@@ -0,0 +1,130 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+
+def _to_blob(vector):
+    return array("f", vector).tobytes()
+
+
+def _from_blob(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that caches vectors on disk (SQLite) and in a bounded in-memory LRU.
+
+    Keys are derived from the model name, the kind of embedding (document or query, which
+    Gemini embeds differently) and the whitespace-normalized text, so the same text is never
+    sent to the remote model twice. Cache misses are embedded in batches of ``batch_size``
+    with at most ``max_concurrency`` requests in flight.
+    """
+
+    def __init__(self, embeddings, cache_path, model_name, batch_size=100, max_concurrency=4, memory_size=2048):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.memory_size = memory_size
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text, kind):
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """Returns {key: vector} for the keys found in memory or on disk."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self.stats["memory_hits"] += len(found)
+
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = _from_blob(blob)
+                    self._remember(key, found[key])
+                self.stats["disk_hits"] += len(rows)
+        return found
+
+    def _save(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, _to_blob(vector)) for key, vector in items]
+            )
+            self._conn.commit()
+            for key, vector in items:
+                self._remember(key, vector)
+            self.stats["misses"] += len(items)
+
+    def embed_documents(self, texts):
+        keys = [self._key(text, "document") for text in texts]
+        found = self._lookup(keys)
+
+        # Embed each missing text once, in batches, with bounded concurrency
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            missing_keys = list(missing)
+            batches = [missing_keys[i:i + self.batch_size] for i in range(0, len(missing_keys), self.batch_size)]
+
+            def embed_batch(batch_keys):
+                vectors = self.embeddings.embed_documents([missing[key] for key in batch_keys])
+                items = list(zip(batch_keys, vectors))
+                self._save(items)
+                return items
+
+            if len(batches) == 1:
+                results = [embed_batch(batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    results = list(executor.map(embed_batch, batches))
+            for items in results:
+                found.update(items)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text, "query")
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self._save([(key, vector)])
+        return vector
+
+    def get_stats(self):
+        """Returns memory/disk hit and miss counters."""
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,93 @@
+import numpy as np
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+RRF_K = 60
+
+
+def _doc_key(doc):
+    return doc.id or doc.metadata.get("chunk_hash") or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K):
+    """Fuses ranked document lists; returns (Document, score) pairs, best first."""
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    return [(docs[key], score) for key, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+
+class HybridVectorStore(VectorStore):
+    """Vector store fusing dense similarity search with a BM25 lexical index.
+
+    Query searches take the ``fetch_k`` best chunks from each side and combine them with
+    reciprocal rank fusion, so a chunk containing the exact product name or model number
+    ranks first even when its embedding is not the closest. MMR re-ranks the fused
+    candidates. Searches by vector, reads and writes go to the wrapped store.
+    """
+
+    def __init__(self, vectorstore, lexical_index, fetch_k=20, rrf_k=RRF_K):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+
+    @property
+    def embeddings(self):
+        return self.vectorstore.embeddings
+
+    def _fused_search(self, query, fetch_k, filter=None):
+        """Returns the fused (Document, score) candidates and the query embedding."""
+        embedding = self.embeddings.embed_query(query)
+        dense = self.vectorstore.similarity_search_by_vector(embedding, k=fetch_k, filter=filter)
+        lexical = [doc for doc, _ in self.lexical_index.search(query, k=fetch_k, filter=filter)]
+        return reciprocal_rank_fusion([dense, lexical], rrf_k=self.rrf_k), embedding
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, fetch_k=None, **kwargs):
+        fused, _ = self._fused_search(query, max(k, fetch_k or self.fetch_k), filter=filter)
+        return fused[:k]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return self.vectorstore.similarity_search_by_vector(embedding, k=k, filter=filter, **kwargs)
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        fused, embedding = self._fused_search(query, fetch_k, filter=filter)
+        candidates = [doc for doc, _ in fused[:fetch_k]]
+        if len(candidates) <= 1:
+            return candidates[:k]
+        stored = self.vectorstore.get(ids=[_doc_key(doc) for doc in candidates], include=["embeddings"])
+        vectors = dict(zip(stored["ids"], stored["embeddings"]))
+        candidates = [doc for doc in candidates if _doc_key(doc) in vectors]
+        selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32),
+            [vectors[_doc_key(doc)] for doc in candidates],
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+        return [candidates[i] for i in selected]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.vectorstore.max_marginal_relevance_search_by_vector(
+            embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter, **kwargs
+        )
+
+    def _select_relevance_score_fn(self):
+        # Fused scores are already "higher is better"
+        return lambda score: score
+
+    def get(self, *args, **kwargs):
+        return self.vectorstore.get(*args, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("Add documents to the wrapped store and rebuild the lexical index.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Build the vector store first and wrap it with its lexical index.")
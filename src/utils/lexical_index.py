@@ -0,0 +1,139 @@
+"""In-process BM25 index over the indexed chunks.
+
+Exact tokens such as product names and model numbers ("SmartWatch Pro V3") are matched
+lexically, which dense embeddings often miss. The index is built from the chunks stored in
+the vector store and persisted next to it, keyed by the set of chunk ids, so it is only
+rebuilt when the indexed corpus changes.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+
+from langchain_core.documents import Document
+
+from src.utils.metrics import timed
+
+LEXICAL_INDEX_FILE = "bm25_index.json"
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def get_ids_fingerprint(ids):
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+
+def _matches(metadata, filter):
+    return all(metadata.get(key) == value for key, value in filter.items())
+
+
+class BM25Index:
+    """Inverted index scoring chunks with Okapi BM25.
+
+    Postings map each term to ``[[chunk position, term frequency], ...]``; chunk texts and
+    metadata are kept in the index so a lookup never touches the vector store.
+    """
+
+    def __init__(self, ids, texts, metadatas, postings, doc_lengths, k1=1.5, b=0.75, fingerprint=None):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint or get_ids_fingerprint(ids)
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        count = len(ids)
+        self.idf = {
+            term: math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in postings.items()
+        }
+
+    @classmethod
+    def from_texts(cls, ids, texts, metadatas, **kwargs):
+        postings = {}
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, frequency in frequencies.items():
+                postings.setdefault(token, []).append([position, frequency])
+        return cls(list(ids), list(texts), [metadata or {} for metadata in metadatas], postings, doc_lengths, **kwargs)
+
+    def search(self, query, k=4, filter=None):
+        """Returns up to k (Document, score) pairs with a positive BM25 score, best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = self.idf[term]
+            for position, frequency in entries:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for position, score in ranked:
+            if filter and not _matches(self.metadatas[position], filter):
+                continue
+            results.append((
+                Document(id=self.ids[position], page_content=self.texts[position], metadata=self.metadatas[position]),
+                score,
+            ))
+            if len(results) == k:
+                break
+        return results
+
+    def save(self, path):
+        data = {
+            "fingerprint": self.fingerprint,
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            data["ids"], data["texts"], data["metadatas"], data["postings"], data["doc_lengths"],
+            k1=data["k1"], b=data["b"], fingerprint=data["fingerprint"],
+        )
+
+
+def load_or_build_lexical_index(vectorstore, persist_directory):
+    """Loads the BM25 index persisted in persist_directory, rebuilding it if the indexed chunks changed."""
+    with timed("lexical_index"):
+        path = os.path.join(persist_directory, LEXICAL_INDEX_FILE)
+        fingerprint = get_ids_fingerprint(vectorstore.get(include=[])["ids"])
+        if os.path.exists(path):
+            try:
+                index = BM25Index.load(path)
+                if index.fingerprint == fingerprint:
+                    return index
+            except (OSError, ValueError, KeyError):
+                pass
+
+        data = vectorstore.get(include=["documents", "metadatas"])
+        index = BM25Index.from_texts(data["ids"], data["documents"], data["metadatas"])
+        os.makedirs(persist_directory, exist_ok=True)
+        index.save(path)
+        return index
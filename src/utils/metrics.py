@@ -0,0 +1,345 @@
+"""In-process metrics: per-stage latency histograms, call/token counters and cache gauges.
+
+Nothing leaves the process; the registry is rendered on demand as Prometheus text or JSON.
+Recording a sample is a perf_counter call, a bisect and a lock, so it is cheap enough to
+leave on in production.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from functools import wraps
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+# Chat models wrapping another (instrumented) model carry this metadata key, so calls are counted once
+WRAPPER_METADATA = {"metrics_wrapper": True}
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Histogram:
+    """Fixed-bucket histogram of observed values."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if empty)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Records value in the histogram of name and labels (created with ``buckets`` on first use)."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_collector(self, name, collect):
+        """Registers a callable returning a dict of numbers, exported as gauges named chatbot_<name>_<key>."""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def _gauges(self):
+        with self._lock:
+            collectors = list(self._collectors.items())
+        gauges = {}
+        for name, collect in collectors:
+            for key, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"chatbot_{name}_{key}"] = value
+        return gauges
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(h.counts), h.count, h.sum, h.buckets) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), (counts, count, total, buckets) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, value in sorted(self._gauges().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Returns a JSON-serializable snapshot with approximate p50/p95/p99 per histogram."""
+        with self._lock:
+            histograms = {}
+            for (name, labels), histogram in self._histograms.items():
+                label = ",".join(f"{key}={value}" for key, value in labels)
+                histograms[f"{name}{{{label}}}" if label else name] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else None,
+                    "p50_le": histogram.quantile(0.5),
+                    "p95_le": histogram.quantile(0.95),
+                    "p99_le": histogram.quantile(0.99),
+                }
+            counters = {}
+            for (name, labels), value in self._counters.items():
+                label = ",".join(f"{key}={val}" for key, val in labels)
+                counters[f"{name}{{{label}}}" if label else name] = value
+        return {"histograms": histograms, "counters": counters, "gauges": self._gauges()}
+
+    def dump_json(self, path=None):
+        """Returns the snapshot as JSON, also writing it to path if given."""
+        text = json.dumps(self.to_dict(), indent=2, default=str)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+
+METRICS = MetricsRegistry()
+STAGE_METRIC = "chatbot_stage_duration_seconds"
+
+
+@contextmanager
+def timed(stage):
+    """Records the duration of the block in the stage latency histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe(STAGE_METRIC, time.perf_counter() - started, stage=stage)
+
+
+def timed_stage(stage):
+    """Decorator variant of timed() for functions."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class TokenUsage:
+    """Tokens sent to and generated by the LLM calls of one request; cached_tokens are part of input_tokens."""
+    llm_calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+_REQUEST_USAGE = ContextVar("request_usage", default=None)
+
+
+@contextmanager
+def track_usage(usage=None):
+    """Adds the token usage of the LLM calls made inside the block to usage (a new TokenUsage by default) and yields it.
+
+    Calls made in tasks and threads started with a copy of the context (asyncio tasks,
+    asyncio.to_thread) are included. Enter it again with the same usage to extend tracking,
+    e.g. into a streaming response generator.
+    """
+    usage = usage if usage is not None else TokenUsage()
+    token = _REQUEST_USAGE.set(usage)
+    try:
+        yield usage
+    finally:
+        _REQUEST_USAGE.reset(token)
+
+
+def observe_request_usage(usage):
+    """Records the tokens of a finished request in the per-request token histograms."""
+    METRICS.observe("chatbot_request_tokens", usage.input_tokens, buckets=TOKEN_BUCKETS, direction="input")
+    METRICS.observe("chatbot_request_tokens", usage.output_tokens, buckets=TOKEN_BUCKETS, direction="output")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LangChain callback recording LLM and retriever latency, LLM call counts and token usage.
+
+    Attach it to the chat model and to retrievers (``callbacks=get_metrics_callbacks()``). Runs of
+    wrapper models (metadata WRAPPER_METADATA) are ignored, as their wrapped model records the call.
+    """
+
+    def __init__(self):
+        self._started = {}
+        self._prompt_tokens = {}
+        self._wrapper_runs = set()
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            METRICS.observe(STAGE_METRIC, time.perf_counter() - started, stage="vector_search")
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        if (metadata or {}).get("metrics_wrapper"):
+            self._wrapper_runs.add(run_id)
+            return
+        self._started[run_id] = time.perf_counter()
+        self._prompt_tokens[run_id] = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+        self._prompt_tokens[run_id] = sum(estimate_tokens(prompt) for prompt in prompts)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id in self._wrapper_runs:
+            self._wrapper_runs.discard(run_id)
+            return
+        started = self._started.pop(run_id, None)
+        prompt_tokens = self._prompt_tokens.pop(run_id, 0)
+        if started is not None:
+            METRICS.observe(STAGE_METRIC, time.perf_counter() - started, stage="llm_call")
+        METRICS.increment("chatbot_llm_calls_total")
+        input_tokens = output_tokens = cached_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+                    cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+                else:
+                    # Estimated when the model does not report usage
+                    input_tokens += prompt_tokens
+                    output_tokens += estimate_tokens(generation.text)
+        METRICS.increment("chatbot_llm_tokens_total", input_tokens, direction="input")
+        METRICS.increment("chatbot_llm_tokens_total", output_tokens, direction="output")
+        if cached_tokens:
+            METRICS.increment("chatbot_llm_tokens_total", cached_tokens, direction="cached")
+        usage = _REQUEST_USAGE.get()
+        if usage is not None:
+            usage.llm_calls += 1
+            usage.input_tokens += input_tokens
+            usage.output_tokens += output_tokens
+            usage.cached_tokens += cached_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if run_id in self._wrapper_runs:
+            self._wrapper_runs.discard(run_id)
+            return
+        self._started.pop(run_id, None)
+        self._prompt_tokens.pop(run_id, None)
+        METRICS.increment("chatbot_llm_errors_total")
+
+
+_METRICS_CALLBACK = MetricsCallbackHandler()
+
+
+def get_metrics_callbacks():
+    """Returns the callbacks list to attach to chat models and retrievers."""
+    return [_METRICS_CALLBACK]
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Embeddings wrapper recording call latency, call counts and (estimated) tokens sent to the model."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's attributes (e.g. the offline model's stats)
+        return getattr(self.embeddings, name)
+
+    def _record(self, kind, texts):
+        METRICS.increment("chatbot_embedding_calls_total", kind=kind)
+        METRICS.increment("chatbot_embedding_texts_total", len(texts), kind=kind)
+        METRICS.increment("chatbot_embedding_tokens_total", sum(estimate_tokens(text) for text in texts), kind=kind)
+
+    def embed_documents(self, texts):
+        self._record("document", texts)
+        with timed("embed_documents"):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        self._record("query", [text])
+        with timed("embed_query"):
+            return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        self._record("document", texts)
+        with timed("embed_documents"):
+            return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text):
+        self._record("query", [text])
+        with timed("embed_query"):
+            return await self.embeddings.aembed_query(text)
@@ -0,0 +1,317 @@
+"""Read-only vector index stored as memory-mapped NumPy arrays.
+
+The chunk vectors (float32, or int8 with a per-row scale) and the chunk texts are opened with
+``mmap_mode="r"``: opening costs no copy, and every worker process on a host shares the same
+pages through the OS page cache. Searches are vectorized dot products over the whole matrix,
+with ``doc_type`` filters applied as boolean masks.
+
+An index directory holds one subdirectory per build and a CURRENT file naming the live one,
+so a rebuild never modifies files that running workers have mapped.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from src.utils.lexical_index import get_ids_fingerprint
+
+MMAP_INDEX_DIR = "mmap_index"
+CURRENT_FILE = "CURRENT"
+QUANTIZATIONS = (None, "int8")
+# Rows dequantized at a time when scoring an int8 index
+BLOCK_ROWS = 65536
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def write_mmap_index(directory, ids, texts, metadatas, vectors, quantize=None, fingerprint=None):
+    """Writes a new index version into directory and makes it the current one; returns its path.
+
+    The previous version is kept, for readers that read CURRENT just before the swap; older ones are deleted.
+    """
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantize}', expected one of {QUANTIZATIONS}")
+    fingerprint = fingerprint or get_ids_fingerprint(ids)
+    version = f"{fingerprint[:16]}-{quantize or 'float32'}"
+    path = os.path.join(directory, version)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    vectors = _normalize(vectors).reshape(len(ids), -1) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+    if quantize == "int8" and len(ids):
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        np.save(os.path.join(tmp_path, "scales.npy"), scales.astype(np.float32))
+        vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+    elif quantize == "int8":
+        np.save(os.path.join(tmp_path, "scales.npy"), np.zeros(0, dtype=np.float32))
+        vectors = vectors.astype(np.int8)
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+
+    # Texts as one UTF-8 blob plus row offsets, so they are memory-mapped too
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(blob) for blob in encoded])
+    np.save(os.path.join(tmp_path, "text_offsets.npy"), offsets)
+    with open(os.path.join(tmp_path, "texts.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+
+    # Columnar metadata; doc_type is also stored as integer codes for vectorized masks
+    metadatas = [metadata or {} for metadata in metadatas]
+    keys = sorted({key for metadata in metadatas for key in metadata})
+    columns = {key: [metadata.get(key) for metadata in metadatas] for key in keys}
+    doc_types = sorted({value for value in columns.get("doc_type", []) if value is not None})
+    codes = {doc_type: code for code, doc_type in enumerate(doc_types)}
+    np.save(
+        os.path.join(tmp_path, "doc_type_codes.npy"),
+        np.array([codes.get(value, -1) for value in columns.get("doc_type", [None] * len(ids))], dtype=np.int16),
+    )
+    _write_json(os.path.join(tmp_path, "metadata.json"), {"ids": list(ids), "columns": columns})
+    _write_json(os.path.join(tmp_path, "manifest.json"), {
+        "count": len(ids),
+        "dim": int(vectors.shape[1]) if len(ids) else 0,
+        "quantize": quantize,
+        "fingerprint": fingerprint,
+        "doc_types": doc_types,
+    })
+
+    previous = read_current(directory)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    current_tmp = os.path.join(directory, f"{CURRENT_FILE}.tmp")
+    with open(current_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(directory, CURRENT_FILE))
+
+    # The previous version is kept for readers that read CURRENT just before the swap; workers
+    # still mapping an older version keep their pages until they reopen the index
+    for name in os.listdir(directory):
+        old_path = os.path.join(directory, name)
+        if name not in (version, previous, CURRENT_FILE) and os.path.isdir(old_path):
+            shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def read_current(directory):
+    """Returns the name of the current index version, or None if there is none."""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def read_manifest(directory):
+    """Returns the manifest of the current index version, or None if there is none."""
+    try:
+        with open(os.path.join(directory, read_current(directory) or "", "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class MmapVectorStore(VectorStore):
+    """Read-only vector store over a memory-mapped index written by write_mmap_index.
+
+    Scores are cosine similarities (higher is better). Supports equality filters on any
+    metadata field; ``doc_type`` filters use precomputed integer codes.
+    """
+
+    def __init__(self, directory, embeddings):
+        self.directory = directory
+        self._embeddings = embeddings
+        try:
+            self._open()
+        except FileNotFoundError:
+            # A rebuild swapped CURRENT and removed the version read here: open the new one
+            self._open()
+
+    def _open(self):
+        with open(os.path.join(self.directory, CURRENT_FILE), encoding="utf-8") as f:
+            self.path = os.path.join(self.directory, f.read().strip())
+        with open(os.path.join(self.path, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(self.path, "metadata.json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        self.ids = metadata["ids"]
+        self.columns = metadata["columns"]
+        self.quantize = self.manifest["quantize"]
+
+        self._vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        self._scales = np.load(os.path.join(self.path, "scales.npy"), mmap_mode="r") if self.quantize == "int8" else None
+        self._offsets = np.load(os.path.join(self.path, "text_offsets.npy"), mmap_mode="r")
+        self._texts = np.memmap(os.path.join(self.path, "texts.bin"), dtype=np.uint8, mode="r") if self._offsets[-1] else None
+        self._doc_type_codes = np.load(os.path.join(self.path, "doc_type_codes.npy"), mmap_mode="r")
+        self._doc_type_index = {doc_type: code for code, doc_type in enumerate(self.manifest["doc_types"])}
+        self._positions = None
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _text(self, row):
+        if self._texts is None:
+            return ""
+        return bytes(self._texts[self._offsets[row]:self._offsets[row + 1]]).decode("utf-8")
+
+    def _metadata(self, row):
+        return {key: values[row] for key, values in self.columns.items() if values[row] is not None}
+
+    def _document(self, row):
+        return Document(id=self.ids[row], page_content=self._text(row), metadata=self._metadata(row))
+
+    def _dequantize(self, rows):
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= np.asarray(self._scales[rows])[:, None]
+        return vectors
+
+    def _mask(self, filter):
+        """Returns the boolean row mask of an equality filter (None for no filter)."""
+        if not filter:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, value in filter.items():
+            if key == "doc_type":
+                code = self._doc_type_index.get(value)
+                if code is None:
+                    return np.zeros(len(self.ids), dtype=bool)
+                mask &= np.asarray(self._doc_type_codes) == code
+            else:
+                mask &= np.array([row_value == value for row_value in self.columns.get(key, [None] * len(self.ids))])
+        return mask
+
+    def _scores(self, queries):
+        """Returns the (rows, queries) cosine similarity matrix for L2-normalized query vectors."""
+        if self._scales is None:
+            return self._vectors @ queries.T
+        scores = np.empty((len(self.ids), len(queries)), dtype=np.float32)
+        for start in range(0, len(self.ids), BLOCK_ROWS):
+            end = start + BLOCK_ROWS
+            block = np.asarray(self._vectors[start:end], dtype=np.float32)
+            scores[start:end] = (block @ queries.T) * np.asarray(self._scales[start:end])[:, None]
+        return scores
+
+    def _top_k(self, scores, k, mask):
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [(int(row), float(scores[row])) for row in rows if np.isfinite(scores[row])]
+
+    def similarity_search_with_score_by_vectors(self, embeddings, k=4, filter=None):
+        """Batched search: returns one list of (Document, score) pairs per query vector."""
+        if not self.ids:
+            return [[] for _ in embeddings]
+        scores = self._scores(_normalize(embeddings).reshape(len(embeddings), -1))
+        mask = self._mask(filter)
+        return [
+            [(self._document(row), score) for row, score in self._top_k(scores[:, i], k, mask)]
+            for i in range(scores.shape[1])
+        ]
+
+    def batch_similarity_search(self, queries, k=4, filter=None):
+        """Searches several queries with a single matrix product; returns one list of Documents per query."""
+        vectors = [self.embeddings.embed_query(query) for query in queries]
+        return [
+            [doc for doc, _ in results]
+            for results in self.similarity_search_with_score_by_vectors(vectors, k=k, filter=filter)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vectors([self.embeddings.embed_query(query)], k=k, filter=filter)[0]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vectors([embedding], k=k, filter=filter)[0]]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        if not self.ids:
+            return []
+        query = _normalize(embedding).reshape(1, -1)
+        candidates = [row for row, _ in self._top_k(self._scores(query)[:, 0], fetch_k, self._mask(filter))]
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(query[0], self._dequantize(candidates), k=k, lambda_mult=lambda_mult)
+        return [self._document(candidates[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embeddings.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), **kwargs):
+        """Chroma-compatible get() returning the ids and the requested fields of the matching rows."""
+        if ids is not None:
+            if self._positions is None:
+                self._positions = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+            rows = [self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]
+        else:
+            rows = list(range(len(self.ids)))
+        mask = self._mask(where)
+        if mask is not None:
+            rows = [row for row in rows if mask[row]]
+        return {
+            "ids": [self.ids[row] for row in rows],
+            "embeddings": self._dequantize(rows) if "embeddings" in include else None,
+            "documents": [self._text(row) for row in rows] if "documents" in include else None,
+            "metadatas": [self._metadata(row) for row in rows] if "metadatas" in include else None,
+        }
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("The memory-mapped index is read-only; rebuild it with sync_mmap_index.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory=None, quantize=None, **kwargs):
+        if directory is None:
+            raise ValueError("from_texts needs the index directory")
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [str(i) for i in range(len(texts))]
+        os.makedirs(directory, exist_ok=True)
+        write_mmap_index(directory, ids, texts, metadatas or [{}] * len(texts), embedding.embed_documents(texts), quantize)
+        return cls(directory, embedding)
+
+
+def sync_mmap_index(vectorstore, directory, quantize=None):
+    """Exports the vectors of vectorstore into a memory-mapped index and opens it.
+
+    The export only runs when the chunk ids or the quantization changed since the last one;
+    vectors are copied from the store, so it costs no embedding calls.
+    """
+    fingerprint = get_ids_fingerprint(vectorstore.get(include=[])["ids"])
+    manifest = read_manifest(directory)
+    if manifest is None or manifest["fingerprint"] != fingerprint or manifest["quantize"] != quantize:
+        data = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+        os.makedirs(directory, exist_ok=True)
+        write_mmap_index(
+            directory, data["ids"], data["documents"], data["metadatas"], data["embeddings"],
+            quantize=quantize, fingerprint=fingerprint,
+        )
+    return MmapVectorStore(directory, vectorstore.embeddings)
@@ -0,0 +1,171 @@
+"""Deterministic stand-ins for the Gemini chat and embeddings models.
+
+They need no network or credentials, so pipelines can be benchmarked and load-tested
+offline with stable numbers. Select them with LLM_PROVIDER=offline (see llm_config).
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+from src.utils.metrics import estimate_tokens
+
+ROUTE_PATTERN = re.compile(r"documentation types: (.+?)\. Return only")
+TOKEN_PATTERN = re.compile(r"\S+\s*")
+CONTEXT_END_PATTERN = re.compile(r"\n\s*(?:Human|Question|Answer|Conversation summary):")
+CONDENSE_PATTERN = re.compile(r"Follow-up question: (.+)$", re.DOTALL)
+SUMMARY_PATTERN = re.compile(r"^Summarize this.*?Current summary: (.*?)\n\nNew turns:", re.DOTALL)
+USER_TURN_PATTERN = re.compile(r"^User: (.+)$", re.MULTILINE)
+
+
+def _stable_hash(text):
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+
+
+class OfflineChatModel(BaseChatModel):
+    """Chat model that answers deterministically after a fixed latency.
+
+    Routing prompts (from route_to_doc_type) are answered with a doc_type named in the query, else the
+    keyword router's choice, else a hash-selected one; follow-ups to condense are prefixed with the last question of the conversation;
+    every other prompt is answered with a few lines quoted from its context.
+    Call counts, token counts and call durations are recorded in ``stats``.
+    """
+
+    latency: float = 0.05
+    per_token_latency: float = 0.0
+    stats: Dict[str, Any] = Field(default_factory=lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0, "durations": []})
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return "offline-chat"
+
+    def _respond(self, messages):
+        text = "\n".join(str(message.content) for message in messages)
+        route_match = ROUTE_PATTERN.search(text)
+        if route_match:
+            doc_types = [doc_type.strip() for doc_type in route_match.group(1).split(",")]
+            query = str(messages[-1].content).lower()
+            for doc_type in doc_types:
+                if doc_type.replace("_", " ") in query or doc_type.rstrip("s") in query:
+                    return text, doc_type
+            from src.chains.doc_type_router import KeywordRouter
+
+            doc_type, _ = KeywordRouter().classify(query)
+            if doc_type in doc_types:
+                return text, doc_type
+            return text, doc_types[_stable_hash(query) % len(doc_types)]
+
+        # Conversation prompts: condense a follow-up with the last question, summarize by keeping the questions
+        condense_match = CONDENSE_PATTERN.search(text)
+        if condense_match:
+            questions = USER_TURN_PATTERN.findall(text)
+            return text, " ".join(questions[-1:] + [condense_match.group(1).strip()])
+        summary_match = SUMMARY_PATTERN.search(text)
+        if summary_match:
+            summary = [summary_match.group(1)] if summary_match.group(1) != "None" else []
+            return text, " ".join(summary + [f"User asked: {question}" for question in USER_TURN_PATTERN.findall(text)])
+
+        context = CONTEXT_END_PATTERN.split(text.split("Context:", 1)[-1])[0]
+        lines = [line.strip(" -") for line in context.splitlines() if line.strip(" -")][:3]
+        answer = ["Thanks for reaching out!"] + [f"According to our records: {line}" for line in lines]
+        return text, "\n".join(answer + ["Let us know if there is anything else we can help with."])
+
+    def _record(self, prompt, answer, started):
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["input_tokens"] += estimate_tokens(prompt)
+            self.stats["output_tokens"] += estimate_tokens(answer)
+            self.stats["durations"].append(time.perf_counter() - started)
+
+    def _usage(self, prompt, answer):
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(answer)
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        prompt, answer = self._respond(messages)
+        time.sleep(self.latency + self.per_token_latency * estimate_tokens(answer))
+        self._record(prompt, answer, started)
+        message = AIMessage(content=answer, usage_metadata=self._usage(prompt, answer))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        prompt, answer = self._respond(messages)
+        await asyncio.sleep(self.latency + self.per_token_latency * estimate_tokens(answer))
+        self._record(prompt, answer, started)
+        message = AIMessage(content=answer, usage_metadata=self._usage(prompt, answer))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        prompt, answer = self._respond(messages)
+        time.sleep(self.latency)
+        for token in TOKEN_PATTERN.findall(answer):
+            time.sleep(self.per_token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, answer)))
+        self._record(prompt, answer, started)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        prompt, answer = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        for token in TOKEN_PATTERN.findall(answer):
+            await asyncio.sleep(self.per_token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, answer)))
+        self._record(prompt, answer, started)
+
+
+class HashEmbeddings(Embeddings):
+    """Local embeddings from hashed word and character n-gram features.
+
+    Texts sharing words get similar vectors, which is enough for retrieval and routing to
+    behave plausibly in benchmarks. Vectors are L2-normalized and fully deterministic.
+    """
+
+    def __init__(self, size=256, ngram=3, latency=0.0):
+        self.size = size
+        self.ngram = ngram
+        self.latency = latency
+        self.stats = {"calls": 0, "texts": 0, "durations": []}
+        self._lock = threading.Lock()
+
+    def _vector(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        words = re.findall(r"\w+", text.lower())
+        for word in words:
+            vector[_stable_hash("w:" + word) % self.size] += 2.0
+            padded = f"#{word}#"
+            for i in range(max(1, len(padded) - self.ngram + 1)):
+                vector[_stable_hash("g:" + padded[i:i + self.ngram]) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _embed(self, texts):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        vectors = [self._vector(text) for text in texts]
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["durations"].append(time.perf_counter() - started)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
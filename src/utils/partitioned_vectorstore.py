@@ -0,0 +1,126 @@
+from langchain_chroma import Chroma
+from langchain_core.vectorstores import VectorStore
+
+PARTITION_PREFIX = "doc_type_"
+
+
+def get_partition(persist_directory, embeddings, doc_type):
+    """Opens (or creates) the Chroma collection holding the chunks of a single doc_type."""
+    return Chroma(
+        collection_name=f"{PARTITION_PREFIX}{doc_type}",
+        embedding_function=embeddings,
+        persist_directory=persist_directory
+    )
+
+
+def list_partition_types(main):
+    """Returns the doc_types that have a partition collection next to the main collection."""
+    names = (getattr(collection, "name", collection) for collection in main._client.list_collections())
+    return [name[len(PARTITION_PREFIX):] for name in names if name.startswith(PARTITION_PREFIX)]
+
+
+def open_partitions(main, persist_directory):
+    """Opens the existing per-doc_type collections without modifying them."""
+    return {
+        doc_type: get_partition(persist_directory, main.embeddings, doc_type)
+        for doc_type in list_partition_types(main)
+    }
+
+
+def sync_partitions(main, persist_directory, batch_size=256):
+    """Mirrors the chunks of the main collection into one collection per doc_type.
+
+    Vectors are copied from the main collection, so building partitions costs no embedding calls.
+    Partitions of doc_types no longer present in the main collection are deleted.
+    """
+    data = main.get(include=["metadatas"])
+    ids_by_type = {}
+    for chunk_id, metadata in zip(data["ids"], data["metadatas"]):
+        doc_type = (metadata or {}).get("doc_type")
+        if doc_type:
+            ids_by_type.setdefault(doc_type, set()).add(chunk_id)
+
+    for doc_type in list_partition_types(main):
+        if doc_type not in ids_by_type:
+            main._client.delete_collection(f"{PARTITION_PREFIX}{doc_type}")
+
+    partitions = {}
+    for doc_type, ids in ids_by_type.items():
+        partition = get_partition(persist_directory, main.embeddings, doc_type)
+        existing_ids = set(partition.get(include=[])["ids"])
+
+        stale_ids = list(existing_ids - ids)
+        if stale_ids:
+            partition.delete(ids=stale_ids)
+
+        new_ids = list(ids - existing_ids)
+        for start in range(0, len(new_ids), batch_size):
+            batch = main.get(ids=new_ids[start:start + batch_size], include=["embeddings", "metadatas", "documents"])
+            partition._collection.upsert(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                metadatas=batch["metadatas"],
+                documents=batch["documents"],
+            )
+        partitions[doc_type] = partition
+    return partitions
+
+
+class PartitionedVectorStore(VectorStore):
+    """Vector store that answers doc_type-filtered searches from a per-doc_type partition.
+
+    Searches whose filter is exactly ``{"doc_type": ...}`` run against that partition's own
+    index, so similarity and MMR ``fetch_k`` candidates are only scored within the partition.
+    Every other search (and all writes and reads) go to the main collection.
+    """
+
+    def __init__(self, main, partitions):
+        self.main = main
+        self.partitions = partitions
+
+    @property
+    def embeddings(self):
+        return self.main.embeddings
+
+    def _resolve(self, filter):
+        """Returns the store to search and the filter still to apply on it."""
+        if filter and set(filter) == {"doc_type"} and filter["doc_type"] in self.partitions:
+            return self.partitions[filter["doc_type"]], None
+        return self.main, filter
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        store, filter = self._resolve(filter)
+        return store.similarity_search(query, k=k, filter=filter, **kwargs)
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        store, filter = self._resolve(filter)
+        return store.similarity_search_with_score(query, k=k, filter=filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        store, filter = self._resolve(filter)
+        return store.similarity_search_by_vector(embedding, k=k, filter=filter, **kwargs)
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        store, filter = self._resolve(filter)
+        return store.max_marginal_relevance_search(
+            query, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter, **kwargs
+        )
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        store, filter = self._resolve(filter)
+        return store.max_marginal_relevance_search_by_vector(
+            embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter, **kwargs
+        )
+
+    def _select_relevance_score_fn(self):
+        return self.main._select_relevance_score_fn()
+
+    def get(self, *args, **kwargs):
+        return self.main.get(*args, **kwargs)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("Add documents to the main collection and re-run sync_partitions.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Build the main collection first and use sync_partitions.")
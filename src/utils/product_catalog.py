@@ -0,0 +1,268 @@
+"""Typed product catalog parsed from data/products.txt at ingest time.
+
+Simple attribute lookups ("price of the SmartWatch Pro V3", "is the office chair in stock")
+are answered straight from the catalog, without retrieval or an LLM call.
+"""
+import difflib
+import json
+import math
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from src.utils.document_processor import get_document_type
+
+FIELD_PATTERN = re.compile(r"^\s*([A-Za-z][A-Za-z ]*?)\s*:\s*(.*\S)\s*$", re.MULTILINE)
+BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+PRICE_PATTERN = re.compile(r"\d+(?:[.,]\d+)?")
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Attribute asked for -> pattern spotting it in a query
+ATTRIBUTE_PATTERNS = {
+    "price": re.compile(r"\b(price|prices|cost|costs|how much)\b|giá"),
+    "in_stock": re.compile(r"\b(in stock|stock|availability|sold out)\b|\bavailable\W*$|còn hàng"),
+    "warranty": re.compile(r"\bwarrant(y|ies)\b|bảo hành"),
+    "returnable": re.compile(r"\b(returnable|return policy|can i return)\b"),
+    "sizes": re.compile(r"\bsizes?\b"),
+    "colors": re.compile(r"\bcolou?rs?\b"),
+}
+# Queries that need reasoning over the catalog or policies go to the LLM pipelines
+COMPLEX_QUERY_PATTERN = re.compile(
+    r"\b(compare|comparison|vs|versus|difference|better|best|cheaper|cheapest|recommend|suggest|"
+    r"why|how do|how can|how to|which|should|all|every)\b"
+)
+MAX_LOOKUP_WORDS = 16
+CATALOG_FILE = "product_catalog.json"
+FUZZY_CACHE_SIZE = 4096
+# Idf-weighted share of a product's name tokens a query must contain to refer to it by a partial name
+MIN_NAME_SHARE = 0.5
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def is_model_token(token):
+    """True for model/number-like tokens ("v3", "2024", "x100"), which must match a name exactly."""
+    return any(char.isdigit() for char in token)
+
+
+def normalize_name(text):
+    return " ".join(tokenize(text))
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+
+@dataclass
+class Product:
+    name: str
+    brand: Optional[str] = None
+    price: Optional[float] = None
+    price_text: Optional[str] = None
+    sizes: List[str] = field(default_factory=list)
+    colors: List[str] = field(default_factory=list)
+    warranty: Optional[str] = None
+    returnable: Optional[str] = None
+    in_stock: Optional[str] = None
+    attributes: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def is_in_stock(self):
+        return self.in_stock is not None and not self.in_stock.lower().startswith(("no", "out of stock"))
+
+    @classmethod
+    def from_fields(cls, fields):
+        price_text = fields.get("Price")
+        price_match = PRICE_PATTERN.search(price_text or "")
+        return cls(
+            name=fields["Product Name"],
+            brand=fields.get("Brand"),
+            price=float(price_match.group(0).replace(",", "")) if price_match else None,
+            price_text=price_text,
+            sizes=_split_list(fields.get("Sizes")),
+            colors=_split_list(fields.get("Colors")),
+            warranty=fields.get("Warranty"),
+            returnable=fields.get("Returnable"),
+            in_stock=fields.get("In Stock"),
+            attributes=dict(fields),
+        )
+
+
+def parse_products(text):
+    """Parses "Field: value" blocks separated by blank lines; blocks without a Product Name are skipped."""
+    products = []
+    for block in BLOCK_SEPARATOR.split(text):
+        fields = {key.strip(): value.strip() for key, value in FIELD_PATTERN.findall(block)}
+        if "Product Name" in fields:
+            products.append(Product.from_fields(fields))
+    return products
+
+
+def render_attribute(product, attribute):
+    """Returns the answer line for an attribute, or None if the catalog does not list it."""
+    name = product.name
+    if attribute == "price" and product.price_text:
+        brand = f" by {product.brand}" if product.brand else ""
+        return f"The {name}{brand} costs {product.price_text}."
+    if attribute == "in_stock" and product.in_stock:
+        if product.in_stock.lower() == "yes":
+            return f"Yes, the {name} is in stock."
+        if not product.is_in_stock:
+            return f"Sorry, the {name} is currently out of stock."
+        return f"The {name}: {product.in_stock}."
+    if attribute == "warranty" and product.warranty:
+        return f"The {name} comes with a warranty of {product.warranty}."
+    if attribute == "returnable" and product.returnable:
+        return f"Returns for the {name}: {product.returnable}."
+    if attribute == "sizes" and product.sizes:
+        return f"The {name} is available in sizes {', '.join(product.sizes)}."
+    if attribute == "colors" and product.colors:
+        return f"The {name} is available in {', '.join(product.colors)}."
+    return None
+
+
+class ProductCatalog:
+    """In-memory product catalog with name and brand indexes and fuzzy name matching."""
+
+    def __init__(self, products, source="products", fuzzy_cutoff=0.85):
+        self.products = list(products)
+        self.source = source
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.by_name = {normalize_name(product.name): product for product in self.products}
+        self.by_brand = {}
+        self.by_token = {}
+        for product in self.products:
+            if product.brand:
+                self.by_brand.setdefault(normalize_name(product.brand), []).append(product)
+            for token in set(tokenize(product.name) + tokenize(product.brand or "")):
+                self.by_token.setdefault(token, []).append(product)
+        count = max(1, len(self.products))
+        self.idf = {token: math.log(1 + count / len(matches)) for token, matches in self.by_token.items()}
+        self._vocabulary = list(self.by_token)
+        self._fuzzy_matches = {}
+        self._by_id = {id(product): product for product in self.products}
+        self._weights = {
+            id(product): sum(self.idf[token] for token in set(tokenize(product.name) + tokenize(product.brand or "")))
+            for product in self.products
+        }
+        # Single letters (e.g. the "t" of "T-Shirt") are left out of the name share
+        self._name_tokens = {
+            id(product): {token for token in tokenize(product.name) if len(token) > 1} for product in self.products
+        }
+
+    @classmethod
+    def from_documents(cls, docs, **kwargs):
+        """Builds the catalog from the loaded documents of the "products" type."""
+        products = []
+        for doc in docs:
+            if get_document_type(doc.metadata.get("source", "")) == "products":
+                products.extend(parse_products(doc.page_content))
+        return cls(products, **kwargs)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(product) for product in self.products], f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls([Product(**product) for product in json.load(f)], **kwargs)
+
+    def __len__(self):
+        return len(self.products)
+
+    def get(self, name):
+        return self.by_name.get(normalize_name(name))
+
+    def find_by_brand(self, brand):
+        return list(self.by_brand.get(normalize_name(brand), []))
+
+    def _match_token(self, token):
+        if token in self.by_token:
+            return token
+        if len(token) < 4:
+            return None
+        if token not in self._fuzzy_matches:
+            if len(self._fuzzy_matches) >= FUZZY_CACHE_SIZE:
+                self._fuzzy_matches.clear()
+            close = difflib.get_close_matches(token, self._vocabulary, n=1, cutoff=self.fuzzy_cutoff)
+            self._fuzzy_matches[token] = close[0] if close else None
+        return self._fuzzy_matches[token]
+
+    def _contradicts(self, product, tokens):
+        """True if the query has a model/number-like token that is not part of the product's name or brand."""
+        product_tokens = set(tokenize(product.name) + tokenize(product.brand or ""))
+        return any(is_model_token(token) and token not in product_tokens for token in tokens)
+
+    def _name_share(self, product, matched):
+        name_tokens = self._name_tokens[id(product)]
+        total = sum(self.idf[token] for token in name_tokens)
+        return sum(self.idf[token] for token in name_tokens & matched) / total if total else 0.0
+
+    def match(self, query):
+        """Returns the single product the query refers to, or None if there is none or it is ambiguous.
+
+        An exact (normalized) product name in the query wins; otherwise products are scored by the
+        idf-weighted share of their name and brand tokens found in the query, tolerating typos, and
+        the best one must cover at least MIN_NAME_SHARE of its name. A model or number in the query
+        that the product's name lacks ("SmartWatch Pro V4") rules the product out, so such queries
+        go to the LLM pipelines instead of being answered for the wrong product.
+        """
+        normalized = f" {normalize_name(query)} "
+        tokens = set(normalized.split())
+        exact = [product for name, product in self.by_name.items() if f" {name} " in normalized]
+        if exact:
+            product = max(exact, key=lambda product: len(product.name))
+            return None if self._contradicts(product, tokens) else product
+
+        scores = {}
+        matched_tokens = set()
+        for token in tokens:
+            # Model tokens differ by a single character ("v3" vs "v4"), so they are never fuzzy-matched
+            if is_model_token(token):
+                matched = token if token in self.by_token else None
+            else:
+                matched = self._match_token(token)
+            if matched is None:
+                continue
+            matched_tokens.add(matched)
+            for product in self.by_token.get(matched, []):
+                scores[id(product)] = scores.get(id(product), 0.0) + self.idf[matched]
+        if not scores:
+            return None
+
+        ranked = sorted(
+            ((score / self._weights[product_id], product_id) for product_id, score in scores.items()),
+            reverse=True,
+        )
+        if len(ranked) > 1 and ranked[0][0] <= ranked[1][0]:
+            return None
+        product = self._by_id[ranked[0][1]]
+        if self._contradicts(product, tokens) or self._name_share(product, matched_tokens) < MIN_NAME_SHARE:
+            return None
+        return product
+
+    def answer(self, query):
+        """Answers a simple attribute lookup from the catalog.
+
+        Returns (answer lines, doc_info), or None when the query is not a simple lookup of a
+        listed attribute of exactly one product and should go to the LLM pipelines.
+        """
+        text = query.lower()
+        if len(text.split()) > MAX_LOOKUP_WORDS or COMPLEX_QUERY_PATTERN.search(text):
+            return None
+        attributes = [attribute for attribute, pattern in ATTRIBUTE_PATTERNS.items() if pattern.search(text)]
+        if not attributes:
+            return None
+        product = self.match(query)
+        if product is None:
+            return None
+        lines = [render_attribute(product, attribute) for attribute in attributes]
+        if any(line is None for line in lines):
+            return None
+        return lines, f"{self.source} - {product.name}"
@@ -0,0 +1,141 @@
+"""Provider-side caching of a static prompt prefix.
+
+Prompts that start with a static prefix (e.g. the system message and few-shot examples
+rendered once by get_few_shot_prefix) can have that prefix stored by the provider, so each
+call only sends the dynamic part and the prefix tokens are billed at the cached rate. With
+Gemini the prefix becomes a cachedContents resource, created on first use and recreated
+shortly before it expires. Prompts are sent whole when the prefix is below the provider's
+minimum cacheable size or the cache cannot be created.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from src.utils.metrics import METRICS, WRAPPER_METADATA, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCache:
+    """Lazily created, self-renewing provider cache of a static prefix (a sequence of messages).
+
+    ``create(prefix, ttl_seconds)`` creates the cache and returns its name. The cache is recreated
+    when less than ``refresh_margin`` seconds of its TTL are left; after a failed creation the
+    prefix is sent inline for ``retry_after`` seconds before creating it is tried again.
+    """
+
+    def __init__(self, create, prefix, ttl_seconds=3600, refresh_margin=300, retry_after=600, min_tokens=0):
+        self.create = create
+        self.prefix = tuple(prefix)
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.prefix_tokens = sum(estimate_tokens(str(message.content)) for message in self.prefix)
+        self.enabled = self.prefix_tokens >= min_tokens
+        self._name = None
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        if not self.enabled:
+            logger.info("Prompt prefix of ~%d tokens is below the %d-token cache minimum; sending it inline",
+                        self.prefix_tokens, min_tokens)
+
+    @property
+    def name(self):
+        """The current cache name, or None if there is no live cache (never blocks)."""
+        return self._name if time.monotonic() < self._expires_at else None
+
+    def needs_refresh(self):
+        now = time.monotonic()
+        return self.enabled and now >= self._expires_at - self.refresh_margin and now >= self._retry_at
+
+    def refresh(self):
+        """Creates the cache if it is missing or about to expire; returns the current name."""
+        with self._lock:
+            if not self.needs_refresh():
+                return self.name
+            started = time.monotonic()
+            try:
+                name = self.create(self.prefix, self.ttl_seconds)
+            except Exception as exc:
+                logger.warning("Could not create the prompt prefix cache, sending it inline: %s", exc)
+                METRICS.increment("chatbot_context_cache_errors_total")
+                self._retry_at = started + self.retry_after
+                return self.name
+            self._name, self._expires_at = name, started + self.ttl_seconds
+            METRICS.increment("chatbot_context_cache_created_total")
+            return name
+
+    def get_stats(self):
+        return {"enabled": int(self.enabled), "live": int(self.name is not None), "prefix_tokens": self.prefix_tokens}
+
+
+class PrefixCachedChatModel(BaseChatModel):
+    """Chat model wrapper sending prompts that start with the context cache's prefix as cached content plus the rest.
+
+    Other prompts (and all prompts while there is no live cache) are passed through unchanged.
+    The wrapped model must accept a ``cached_content`` call argument (ChatGoogleGenerativeAI does).
+    """
+
+    model: Any
+    context_cache: Any
+    metadata: Optional[Dict[str, Any]] = Field(default_factory=lambda: dict(WRAPPER_METADATA))
+
+    @property
+    def _llm_type(self):
+        return f"prefix-cached-{self.model._llm_type}"
+
+    def _starts_with_prefix(self, messages):
+        prefix = self.context_cache.prefix
+        return len(messages) > len(prefix) and all(
+            message.type == cached.type and message.content == cached.content
+            for message, cached in zip(messages, prefix)
+        )
+
+    def _split(self, messages, name):
+        """Returns (messages to send, call kwargs)."""
+        if name is None:
+            return messages, {}
+        METRICS.increment("chatbot_context_cache_hits_total")
+        return messages[len(self.context_cache.prefix):], {"cached_content": name}
+
+    def _prepare(self, messages):
+        if not self._starts_with_prefix(messages):
+            return messages, {}
+        if self.context_cache.needs_refresh():
+            self.context_cache.refresh()
+        return self._split(messages, self.context_cache.name)
+
+    async def _aprepare(self, messages):
+        if not self._starts_with_prefix(messages):
+            return messages, {}
+        if self.context_cache.needs_refresh():
+            # Creating the cache is a blocking API call
+            await asyncio.to_thread(self.context_cache.refresh)
+        return self._split(messages, self.context_cache.name)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        messages, cache_kwargs = self._prepare(messages)
+        message = self.model.invoke(messages, stop=stop, **cache_kwargs, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        messages, cache_kwargs = await self._aprepare(messages)
+        message = await self.model.ainvoke(messages, stop=stop, **cache_kwargs, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        messages, cache_kwargs = self._prepare(messages)
+        for chunk in self.model.stream(messages, stop=stop, **cache_kwargs, **kwargs):
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        messages, cache_kwargs = await self._aprepare(messages)
+        async for chunk in self.model.astream(messages, stop=stop, **cache_kwargs, **kwargs):
+            yield ChatGenerationChunk(message=chunk)
@@ -0,0 +1,487 @@
+"""Shared client layer for the Gemini chat and embeddings models.
+
+Every session of a process goes through the same wrappers, which add:
+
+- a token-bucket rate limit per model (requests per minute),
+- coalescing of identical concurrent chat prompts into one upstream call,
+- micro-batching of concurrent query embeddings into one upstream request,
+- per-call timeouts and retries with jittered exponential backoff,
+- a circuit breaker that fails fast to the last answer for the same prompt, or a degraded answer.
+
+Chat models run with temperature 0, so callers sending the same prompt at the same time
+can share one response.
+"""
+import asyncio
+import hashlib
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+from src.utils.metrics import METRICS, WRAPPER_METADATA
+
+DEGRADED_ANSWER = "Sorry, our assistant is temporarily unavailable. Please try again in a few minutes."
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is rejected because the model's circuit breaker is open."""
+
+
+def is_retryable(exc):
+    """True for timeouts, connection errors, rate limiting (429) and server errors (5xx)."""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def is_unavailable(exc):
+    """True if a call failed because the upstream is unavailable (open circuit, timeout, 429 or 5xx)."""
+    return isinstance(exc, CircuitOpenError) or is_retryable(exc)
+
+
+def is_degraded_answer(response):
+    """True if the response is the degraded answer returned while the model is unavailable."""
+    lines = response if isinstance(response, list) else [response]
+    return any(DEGRADED_ANSWER in str(line) for line in lines)
+
+
+def backoff_delay(attempt, base=0.5, maximum=8.0):
+    """Full-jitter exponential backoff: a random delay in [0, min(maximum, base * 2**attempt)]."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and coroutines.
+
+    Each call reserves its tokens up front and waits until the bucket would have refilled
+    them, so callers are served in arrival order and bursts up to ``capacity`` pass at once.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        """Takes the tokens and returns how long the caller must wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        delay = self._reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def aacquire(self, tokens=1):
+        delay = self._reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, requests_per_minute):
+    """Returns the process-wide token bucket for a model, or None if requests_per_minute is 0 (unlimited)."""
+    if not requests_per_minute:
+        return None
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = TokenBucket(requests_per_minute / 60.0, capacity=max(1.0, requests_per_minute / 60.0))
+        return _rate_limiters[name]
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and rejects calls for ``reset_timeout`` seconds.
+
+    After the timeout one trial call is let through (half-open); its success closes the
+    circuit, its failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_total = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state, self._trial_in_flight = self.HALF_OPEN, False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state, self.consecutive_failures, self._trial_in_flight = self.CLOSED, 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened_total += 1
+                self.state, self._opened_at, self._trial_in_flight = self.OPEN, time.monotonic(), False
+
+    def get_stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_total": self.opened_total,
+        }
+
+
+class ResilientCaller:
+    """Runs upstream calls through a rate limiter, a circuit breaker, timeouts and jittered retries."""
+
+    def __init__(self, name, rate_limiter=None, breaker=None, timeout=30.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0):
+        self.name = name
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            METRICS.increment("chatbot_upstream_rejected_total", model=self.name)
+            raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+
+    def _failed(self, exc, attempt):
+        """Records a failed attempt; returns True if the call should be retried."""
+        if not is_retryable(exc):
+            # The upstream answered (e.g. a bad request), so it counts as healthy
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        METRICS.increment("chatbot_upstream_errors_total", model=self.name, error=type(exc).__name__)
+        if attempt >= self.max_retries or self.breaker.state == CircuitBreaker.OPEN:
+            return False
+        METRICS.increment("chatbot_upstream_retries_total", model=self.name)
+        return True
+
+    def call(self, fn, tokens=1):
+        """Calls fn() with retries. Sync calls rely on the client's own timeout (set from ``timeout``)."""
+        attempt = 0
+        while True:
+            self._check_breaker()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as exc:
+                if not self._failed(exc, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, fn, tokens=1):
+        """Awaits fn() with a per-attempt timeout and retries."""
+        attempt = 0
+        while True:
+            self._check_breaker()
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(tokens)
+            try:
+                result = await asyncio.wait_for(fn(), self.timeout)
+            except Exception as exc:
+                if not self._failed(exc, attempt):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+
+def _prompt_key(messages, stop):
+    text = repr([(message.type, message.content) for message in messages]) + repr(stop)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model wrapper sharing one rate limit, circuit breaker and in-flight table per process.
+
+    Identical concurrent prompts are coalesced into a single upstream call. When the circuit
+    is open or retries are exhausted, the last response to the same prompt is returned if
+    one is remembered (up to ``fallback_size`` prompts), otherwise DEGRADED_ANSWER.
+    """
+
+    model: Any
+    caller: Any
+    fallback_size: int = 256
+    metadata: Optional[Dict[str, Any]] = Field(default_factory=lambda: dict(WRAPPER_METADATA))
+    _inflight: Any = PrivateAttr(default_factory=dict)
+    _ainflight: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _fallbacks: Any = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return f"resilient-{self.model._llm_type}"
+
+    @property
+    def stats(self):
+        # Exposes the wrapped model's statistics (e.g. the offline model's call counts)
+        return getattr(self.model, "stats", {})
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._fallbacks[key] = result
+            self._fallbacks.move_to_end(key)
+            while len(self._fallbacks) > self.fallback_size:
+                self._fallbacks.popitem(last=False)
+
+    def _fallback(self, key, exc):
+        """Returns the remembered or degraded result for a prompt the model could not answer."""
+        if not is_unavailable(exc):
+            raise exc
+        with self._lock:
+            result = self._fallbacks.get(key)
+        METRICS.increment("chatbot_llm_degraded_total", source="remembered" if result else "degraded")
+        return result or ChatResult(generations=[ChatGeneration(message=AIMessage(content=DEGRADED_ANSWER))])
+
+    def _upstream(self, messages, stop, key):
+        try:
+            message = self.caller.call(lambda: self.model.invoke(messages, stop=stop))
+        except Exception as exc:
+            return self._fallback(key, exc)
+        result = ChatResult(generations=[ChatGeneration(message=message)])
+        self._remember(key, result)
+        return result
+
+    async def _aupstream(self, messages, stop, key):
+        try:
+            message = await self.caller.acall(lambda: self.model.ainvoke(messages, stop=stop))
+        except Exception as exc:
+            return self._fallback(key, exc)
+        result = ChatResult(generations=[ChatGeneration(message=message)])
+        self._remember(key, result)
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = _prompt_key(messages, stop)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            METRICS.increment("chatbot_llm_coalesced_total")
+            return future.result()
+        try:
+            result = self._upstream(messages, stop, key)
+            future.set_result(result)
+            return result
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = _prompt_key(messages, stop)
+        loop = asyncio.get_running_loop()
+        inflight = self._ainflight.setdefault(loop, {})
+        future = inflight.get(key)
+        if future is not None:
+            METRICS.increment("chatbot_llm_coalesced_total")
+            # Shielded so a cancelled follower does not cancel the shared call
+            return await asyncio.shield(future)
+        future = inflight[key] = loop.create_future()
+        try:
+            result = await self._aupstream(messages, stop, key)
+            future.set_result(result)
+            return result
+        except BaseException as exc:
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+            raise
+        finally:
+            inflight.pop(key, None)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Streams are not coalesced; retries only happen before the first chunk is received
+        key = _prompt_key(messages, stop)
+        try:
+            chunks = self.caller.call(lambda: _first_chunk(self.model.stream(messages, stop=stop)))
+        except Exception as exc:
+            result = self._fallback(key, exc)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].message.content))
+            return
+        content = []
+        for chunk in chunks:
+            content.append(str(chunk.content))
+            yield ChatGenerationChunk(message=chunk)
+        self._remember(key, ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(content)))]))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        key = _prompt_key(messages, stop)
+        try:
+            chunks = await self.caller.acall(lambda: _afirst_chunk(self.model.astream(messages, stop=stop)))
+        except Exception as exc:
+            result = self._fallback(key, exc)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].message.content))
+            return
+        content = []
+        async for chunk in chunks:
+            content.append(str(chunk.content))
+            yield ChatGenerationChunk(message=chunk)
+        self._remember(key, ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(content)))]))
+
+
+def _first_chunk(iterator):
+    """Pulls the first chunk (so connection errors surface inside the retry loop); returns the full stream."""
+    iterator = iter(iterator)
+    first = next(iterator, None)
+
+    def chunks():
+        if first is not None:
+            yield first
+        yield from iterator
+
+    return chunks()
+
+
+async def _afirst_chunk(iterator):
+    first = await anext(iterator, None)
+
+    async def chunks():
+        if first is not None:
+            yield first
+        async for chunk in iterator:
+            yield chunk
+
+    return chunks()
+
+
+class QueryBatcher:
+    """Groups concurrent single-item calls into batched calls.
+
+    The first caller of a batch runs ``batch_fn`` on the distinct queued items on behalf of
+    every caller. While another batch is in flight (i.e. under concurrent load) it first waits
+    up to ``max_wait`` seconds, or until ``max_batch`` items are queued, so a lone caller is
+    never delayed.
+    """
+
+    def __init__(self, batch_fn, max_batch=32, max_wait=0.005):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._running = 0
+        self._full = threading.Event()
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        future = Future()
+        with self._lock:
+            self._pending.append((item, future))
+            leader = len(self._pending) == 1
+            busy = self._running > 0
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+        if leader:
+            if busy:
+                self._full.wait(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._full.clear()
+                self._running += 1
+            try:
+                self._run(batch)
+            finally:
+                with self._lock:
+                    self._running -= 1
+        return future.result()
+
+    def _run(self, batch):
+        items = list(dict.fromkeys(item for item, _ in batch))
+        METRICS.increment("chatbot_embedding_batched_queries_total", len(batch))
+        try:
+            results = {}
+            for start in range(0, len(items), self.max_batch):
+                chunk = items[start:start + self.max_batch]
+                results.update(zip(chunk, self.batch_fn(chunk)))
+        except BaseException as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        for item, future in batch:
+            future.set_result(results[item])
+
+
+class ResilientEmbeddings(Embeddings):
+    """Embeddings wrapper with the rate limit, retries and circuit breaker of ResilientCaller.
+
+    Concurrent embed_query calls from different sessions are micro-batched into one upstream
+    request when ``batch_queries`` is given: it embeds a list of queries in one call (for
+    Gemini, embed_documents with the retrieval-query task type). Document batches go upstream
+    as they are, costing one rate-limit token per ``texts_per_request`` texts.
+    """
+
+    def __init__(self, embeddings, caller, batch_queries=None, max_batch=32, max_wait=0.005, texts_per_request=100):
+        self.embeddings = embeddings
+        self.caller = caller
+        self.texts_per_request = texts_per_request
+        self._batcher = QueryBatcher(self._embed_queries, max_batch, max_wait) if batch_queries else None
+        self._batch_queries = batch_queries
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's attributes (e.g. the offline model's stats)
+        return getattr(self.embeddings, name)
+
+    def _embed_queries(self, texts):
+        return self.caller.call(lambda: self._batch_queries(texts))
+
+    def embed_documents(self, texts):
+        tokens = max(1, -(-len(texts) // self.texts_per_request))
+        return self.caller.call(lambda: self.embeddings.embed_documents(texts), tokens=tokens)
+
+    def embed_query(self, text):
+        if self._batcher is not None:
+            return self._batcher.submit(text)
+        return self.caller.call(lambda: self.embeddings.embed_query(text))
@@ -0,0 +1,164 @@
+import glob
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from src.utils.product_catalog import is_model_token, tokenize
+from src.utils.resilient_client import is_degraded_answer, is_unavailable
+
+
+def get_data_fingerprint(data_path, pattern="*.txt"):
+    """Returns a hash of the name, size and modification time of every ingested file."""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(data_path, pattern))):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def normalize_query(query):
+    """Lowercases the query and collapses whitespace and trailing punctuation for exact matching."""
+    return " ".join(query.lower().split()).strip(" ?!.")
+
+
+def get_model_tokens(query):
+    """Returns the model/number tokens of the query ("v3", "2024"), which a paraphrase must repeat exactly."""
+    return frozenset(token for token in tokenize(query) if is_model_token(token))
+
+
+class SemanticCache:
+    """Caches (response, doc_info) per query and serves them again for the same or a paraphrased query.
+
+    Lookups first try an exact match on the normalized query, then the cosine similarity between the
+    query embedding and the embeddings of cached queries. Entries expire after ``ttl_seconds``, the
+    least recently used entries are evicted beyond ``max_entries``, and the whole cache is cleared when
+    the files in ``data_path`` change. Answers produced by different pipelines are kept apart by
+    ``namespace`` (e.g. the pipeline configuration label): a lookup only matches entries stored
+    under the same namespace. A paraphrase only matches if it has the same model and number tokens,
+    since "SmartWatch Pro V2" and "SmartWatch Pro V3" embed almost identically.
+    """
+
+    def __init__(self, embeddings, similarity_threshold=0.92, ttl_seconds=3600, max_entries=1024,
+                 data_path=None, check_interval=5.0):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.data_path = data_path
+        self.check_interval = check_interval
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+        self._entries = OrderedDict()
+        # Embeddings of recent misses, so store() does not embed the same query again
+        self._pending_vectors = OrderedDict()
+        self._lock = threading.Lock()
+        self._data_fingerprint = get_data_fingerprint(data_path) if data_path else None
+        self._last_check = time.monotonic()
+
+    def _embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _check_data(self):
+        """Clears the cache if the ingested files changed since the last check."""
+        if not self.data_path or time.monotonic() - self._last_check < self.check_interval:
+            return
+        self._last_check = time.monotonic()
+        fingerprint = get_data_fingerprint(self.data_path)
+        if fingerprint != self._data_fingerprint:
+            self._data_fingerprint = fingerprint
+            self._entries.clear()
+            self._pending_vectors.clear()
+            self.stats["invalidations"] += 1
+
+    def _evict_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, query, namespace=None):
+        """Returns the cached (response, doc_info) for the query, or None on a miss."""
+        key = (namespace, normalize_query(query))
+        now = time.monotonic()
+        with self._lock:
+            self._check_data()
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return entry["response"], entry["doc_info"]
+            model_tokens = get_model_tokens(query)
+            keys = [
+                entry_key for entry_key, entry in self._entries.items()
+                if entry_key[0] == namespace and entry["model_tokens"] == model_tokens
+            ]
+            matrix = np.vstack([self._entries[k]["vector"] for k in keys]) if keys else None
+
+        try:
+            vector = self._embed(query)
+        except Exception as exc:
+            if not is_unavailable(exc):
+                raise
+            # While the embedding model is unavailable only exact matches are served
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            if matrix is not None:
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                entry = self._entries.get(keys[best])
+                if scores[best] >= self.similarity_threshold and entry is not None:
+                    self._entries.move_to_end(keys[best])
+                    self.stats["semantic_hits"] += 1
+                    return entry["response"], entry["doc_info"]
+            self.stats["misses"] += 1
+            self._pending_vectors[key[1]] = vector
+            while len(self._pending_vectors) > 64:
+                self._pending_vectors.popitem(last=False)
+        return None
+
+    def store(self, query, response, doc_info, namespace=None):
+        """Caches the answer to the query, evicting the least recently used entries if full."""
+        if is_degraded_answer(response):
+            # Answers given while the model was unavailable must not outlive the outage
+            return
+        key = (namespace, normalize_query(query))
+        with self._lock:
+            vector = self._pending_vectors.pop(key[1], None)
+        if vector is None:
+            try:
+                vector = self._embed(query)
+            except Exception as exc:
+                if not is_unavailable(exc):
+                    raise
+                return
+        with self._lock:
+            self._entries[key] = {
+                "vector": vector,
+                "model_tokens": get_model_tokens(query),
+                "response": response,
+                "doc_info": doc_info,
+                "created": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pending_vectors.clear()
+
+    def get_stats(self):
+        """Returns hit/miss counters, the hit rate and the current number of entries."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -1,14 +1,49 @@
+import os
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import DirectoryLoader
 from langchain.text_splitter import CharacterTextSplitter
-from src.utils.document_processor import create_optimized_vectorstore, process_documents
+from src.utils.document_processor import create_optimized_vectorstore
+from src.utils.metrics import timed_stage
+from src.utils.partitioned_vectorstore import PartitionedVectorStore, open_partitions
 
-def load_documents(data_path):
-    """Loads documents from the specified path."""
-    loader = DirectoryLoader(data_path, glob='*.txt')
-    docs = loader.load()
+def iter_documents(data_path, loader_cls=None):
+    """Yields the documents under data_path one file at a time, so the corpus is never fully in memory."""
+    loader_kwargs = {"loader_cls": loader_cls} if loader_cls else {}
+    loader = DirectoryLoader(data_path, glob='*.txt', **loader_kwargs)
+    return loader.lazy_load()
+
+@timed_stage("load_documents")
+def load_documents(data_path, loader_cls=None):
+    """Loads documents from the specified path (optionally with a specific loader, e.g. TextLoader for offline use)."""
+    docs = list(iter_documents(data_path, loader_cls=loader_cls))
     return docs
 
-def create_vectorstore(docs, embeddings, persist_directory):
-    """Creates and persists a vector store with optimized document chunking."""
-    return create_optimized_vectorstore(docs, embeddings, persist_directory)
\ No newline at end of file
+def create_vectorstore(docs, embeddings, persist_directory, incremental=True, partition_by_doc_type=False,
+                       max_workers=None):
+    """Creates and persists a vector store with optimized document chunking.
+
+    With ``incremental=True`` only new or changed chunks are embedded and chunks that
+    disappeared from the corpus are removed, so restarts reuse the persisted vectors.
+    With ``partition_by_doc_type=True`` searches filtered on ``doc_type`` run against a
+    per-doc_type collection instead of the whole index.
+    ``docs`` may be a generator (see iter_documents); with ``max_workers`` > 1 chunking runs
+    on a process pool while earlier batches are being embedded.
+    """
+    return create_optimized_vectorstore(
+        docs, embeddings, persist_directory,
+        incremental=incremental,
+        partition_by_doc_type=partition_by_doc_type,
+        max_workers=max_workers
+    )
+
+def open_vectorstore(embeddings, persist_directory, partition_by_doc_type=False):
+    """Opens a prebuilt vector store as is: no documents are loaded, chunked or embedded."""
+    if not os.path.exists(os.path.join(persist_directory, "chroma.sqlite3")):
+        raise FileNotFoundError(f"No prebuilt vector store found in '{persist_directory}'")
+    vectorstore = Chroma(
+        embedding_function=embeddings,
+        persist_directory=persist_directory
+    )
+    if partition_by_doc_type:
+        return PartitionedVectorStore(vectorstore, open_partitions(vectorstore, persist_directory))
+    return vectorstore
@@ -0,0 +1,47 @@
+"""Background warm-up with a readiness flag.
+
+Kept free of heavy imports so the UI or API can start serving immediately; the build
+function imports the models, vector store and chains when it runs.
+"""
+import threading
+import time
+
+
+class WarmupState:
+    """Runs build() once in the background and tracks its status ("starting", "warming_up", "ready", "failed")."""
+
+    def __init__(self, build):
+        self.build = build
+        self.status = "starting"
+        self.error = None
+        self.resources = None
+        self.started_at = time.time()
+        self.ready_at = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    @property
+    def warmup_seconds(self):
+        return round(self.ready_at - self.started_at, 3) if self.ready_at else None
+
+    def run(self):
+        """Builds the resources in the calling thread."""
+        self.status = "warming_up"
+        try:
+            self.resources = self.build()
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            return
+        self.status = "ready"
+        self.ready_at = time.time()
+
+    def start(self):
+        """Starts run() on a daemon thread (once) and returns self."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+        return self
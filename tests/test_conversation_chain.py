@@ -0,0 +1,118 @@
+import os
+import re
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.chains.conversation_chain import ConversationMemory, is_follow_up
+from src.utils.product_catalog import ProductCatalog, parse_products
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+def read_data(name):
+    with open(os.path.join(DATA_PATH, name), encoding="utf-8") as f:
+        return f.read()
+
+
+FAQ_QUESTIONS = re.findall(r"^Q: (.+)$", read_data("faqs.txt"), re.MULTILINE)
+
+STANDALONE = FAQ_QUESTIONS + [
+    "How long does it take to get a refund?",
+    "What if my package is lost?",
+    "Do they ship internationally?",
+    "How do I track my order once it ships?",
+    "Is this store open on weekends?",
+    "Is it possible to change my delivery address?",
+    "So what is your return policy?",
+    "Then how do I cancel an order?",
+    "Can I pay with PayPal too?",
+    "Does the SmartWatch Pro V3 work with iOS, and is it waterproof?",
+    "Can I return the headphones if they don't fit?",
+]
+
+FOLLOW_UPS = [
+    "And in black?",
+    "What about returns?",
+    "How about express shipping?",
+    "Is it waterproof?",
+    "Does it come in navy blue?",
+    "Is that available in XL?",
+    "Do they come in other colors?",
+    "How much is that one?",
+    "Can I return them?",
+    "What is the warranty on it?",
+    "Thanks!",
+]
+
+
+@pytest.fixture
+def memory():
+    memory = ConversationMemory()
+    memory.add_turn("Tell me about the SmartWatch Pro V3", ["It has a heart rate monitor."], "products")
+    return memory
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return ProductCatalog(parse_products(read_data("products.txt")))
+
+
+def test_faq_questions_are_found():
+    assert len(FAQ_QUESTIONS) >= 9
+
+
+@pytest.mark.parametrize("query", STANDALONE)
+def test_standalone_questions(query, memory, catalog):
+    assert not is_follow_up(query, memory, catalog)
+
+
+@pytest.mark.parametrize("query", FOLLOW_UPS)
+def test_follow_ups(query, memory, catalog):
+    assert is_follow_up(query, memory, catalog)
+
+
+def test_first_turn_is_never_a_follow_up(catalog):
+    assert not is_follow_up("Is it waterproof?", ConversationMemory(), catalog)
+
+
+class BlockingSummarizer:
+    def __init__(self):
+        self.release = threading.Event()
+        self.prompts = []
+
+    def invoke(self, prompt):
+        assert self.release.wait(5)
+        self.prompts.append(prompt)
+        return AIMessage(content=f"Summary {len(self.prompts)}")
+
+
+def test_summarizing_runs_off_the_request_path():
+    summarizer = BlockingSummarizer()
+    memory = ConversationMemory(max_history_tokens=20, summarizer=summarizer)
+    started = time.perf_counter()
+    for i in range(4):
+        memory.add_turn(f"Question {i} about shipping fees", [f"Answer {i} " * 5])
+    assert time.perf_counter() - started < 1
+    # Until the summarizer is done, evicted turns are kept by their questions
+    assert "User asked: Question 0 about shipping fees" in memory.summary
+
+    summarizer.release.set()
+    assert memory.wait_for_summary(timeout=5)
+    assert memory.summary.startswith("Summary")
+    assert "Question 3" in memory.history_text()
+
+
+def test_concurrent_turns_of_one_session_are_all_recorded():
+    memory = ConversationMemory(max_history_tokens=10_000)
+    threads = [
+        threading.Thread(target=lambda n=n: [memory.add_turn(f"q{n}-{i}", ["a"]) for i in range(50)])
+        for n in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(memory.turns) == 400
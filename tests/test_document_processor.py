@@ -0,0 +1,26 @@
+import pytest
+from langchain_core.documents import Document
+
+from src.utils.document_processor import iter_processed_documents
+from src.utils.metrics import METRICS
+
+DOCS = [
+    Document("Shipping Policy:\n- Standard shipping fee: $4.99.", metadata={"source": "data/shipping.txt"}),
+    Document("Q: Do you offer gift wrapping?\nA: Yes, for $2.50 per item.", metadata={"source": "data/faqs.txt"}),
+]
+
+
+def process_document_count():
+    histograms = METRICS.to_dict()["histograms"]
+    return sum(
+        histogram["count"] for key, histogram in histograms.items()
+        if key.startswith("chatbot_stage_duration_seconds") and "stage=process_document}" in key
+    )
+
+
+@pytest.mark.parametrize("max_workers", [None, 2])
+def test_streaming_ingest_records_each_document(max_workers):
+    before = process_document_count()
+    chunks = list(iter_processed_documents(iter(DOCS), max_workers=max_workers))
+    assert [chunk.metadata["doc_type"] for chunk in chunks] == ["shipping", "faqs"]
+    assert process_document_count() - before == len(DOCS)
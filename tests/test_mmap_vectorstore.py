@@ -0,0 +1,46 @@
+import os
+
+from src.utils.mmap_vectorstore import CURRENT_FILE, MmapVectorStore, read_current, write_mmap_index
+from src.utils.offline_models import HashEmbeddings
+
+
+def write_version(directory, texts):
+    embeddings = HashEmbeddings()
+    ids = list(texts)
+    metadatas = [{"doc_type": "faqs"}] * len(texts)
+    return os.path.basename(write_mmap_index(directory, ids, texts, metadatas, embeddings.embed_documents(texts)))
+
+
+def test_rebuild_keeps_the_previous_version_only(tmp_path):
+    directory = str(tmp_path)
+    first = write_version(directory, ["Free shipping above $100."])
+    second = write_version(directory, ["Free shipping above $100.", "Returns within 14 days."])
+    assert sorted(os.listdir(directory)) == sorted([CURRENT_FILE, first, second])
+
+    third = write_version(directory, ["Returns within 14 days."])
+    assert sorted(os.listdir(directory)) == sorted([CURRENT_FILE, second, third])
+    assert read_current(directory) == third
+
+
+def test_reader_opens_the_version_swapped_in_after_reading_current(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    write_version(directory, ["Free shipping above $100."])
+    original_open = MmapVectorStore._open
+    calls = []
+
+    def racing_open(self):
+        calls.append(1)
+        if len(calls) == 1:
+            # Two rebuilds land between reading CURRENT and opening its files
+            stale = os.path.join(directory, read_current(directory))
+            write_version(directory, ["Returns within 14 days."])
+            write_version(directory, ["Orders ship in 2 days."])
+            assert not os.path.exists(stale)
+            self.path = stale
+            raise FileNotFoundError(stale)
+        original_open(self)
+
+    monkeypatch.setattr(MmapVectorStore, "_open", racing_open)
+    store = MmapVectorStore(directory, HashEmbeddings())
+    assert len(calls) == 2
+    assert [doc.page_content for doc in store.similarity_search("when do orders ship", k=1)] == ["Orders ship in 2 days."]
@@ -0,0 +1,19 @@
+import pytest
+
+from src.chains.doc_type_router import DOC_TYPES
+from src.chains.llm_route_chain import route_to_doc_type
+from src.utils.offline_models import OfflineChatModel
+
+
+@pytest.mark.parametrize("query, doc_type", [
+    ("How much is the express delivery fee?", "shipping"),
+    ("Can I get my money back?", "returns"),
+    ("Which payment methods can I pay with?", "faqs"),
+    ("My item arrived damaged", "common_issue"),
+    ("Is there a minimum amount to place an order?", "ordering"),
+    ("What is the warranty of this brand?", "products"),
+])
+def test_offline_routing_uses_keywords(query, doc_type):
+    model = OfflineChatModel(latency=0)
+    assert route_to_doc_type(model, query, DOC_TYPES) == doc_type
+    assert route_to_doc_type(model, query, DOC_TYPES) == doc_type
@@ -0,0 +1,21 @@
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from src.utils.offline_models import HashEmbeddings
+from src.utils.partitioned_vectorstore import open_partitions, sync_partitions
+
+
+def test_sync_partitions_deletes_partitions_of_removed_doc_types(tmp_path):
+    persist_directory = str(tmp_path)
+    main = Chroma(collection_name="main", embedding_function=HashEmbeddings(), persist_directory=persist_directory)
+    main.add_documents([
+        Document("Free shipping above $100.", metadata={"doc_type": "shipping"}),
+        Document("Returns within 14 days.", metadata={"doc_type": "returns"}),
+    ], ids=["shipping-1", "returns-1"])
+    assert sorted(sync_partitions(main, persist_directory)) == ["returns", "shipping"]
+
+    main.delete(ids=["shipping-1"])
+    partitions = sync_partitions(main, persist_directory)
+    assert sorted(partitions) == ["returns"]
+    assert sorted(open_partitions(main, persist_directory)) == ["returns"]
+    assert partitions["returns"].get(include=[])["ids"] == ["returns-1"]
@@ -0,0 +1,93 @@
+from typing import Any
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.vectorstores import InMemoryVectorStore
+from pydantic import PrivateAttr
+
+from src.chains.chain_registry import ChainRegistry, get_prompt_prefix
+from src.chains.conversation_chain import CONVERSATION_PROMPT
+from src.configs.llm_config import to_gemini_contents
+from src.configs.pipeline_config import PipelineConfig
+from src.utils.offline_models import HashEmbeddings
+from src.utils.prompt_cache import ContextCache, PrefixCachedChatModel
+
+DOCS = [Document("Standard shipping fee: $4.99.", metadata={"source": "data/shipping.txt", "doc_type": "shipping"})]
+
+
+class RecordingChatModel(BaseChatModel):
+    _calls: Any = PrivateAttr(default_factory=list)
+
+    @property
+    def _llm_type(self):
+        return "recording-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._calls.append((messages, kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok"))])
+
+
+class FakeCreate:
+    def __init__(self):
+        self.prefixes = []
+
+    def __call__(self, prefix, ttl_seconds):
+        self.prefixes.append(prefix)
+        return f"cachedContents/{len(self.prefixes)}"
+
+
+def cached_model(config):
+    create = FakeCreate()
+    model = RecordingChatModel()
+    cache = ContextCache(create, get_prompt_prefix(config), min_tokens=0)
+    return PrefixCachedChatModel(model=model, context_cache=cache), model, create
+
+
+@pytest.mark.parametrize("config", [
+    PipelineConfig(),
+    PipelineConfig(few_shot=True),
+    PipelineConfig(variant="routed"),
+    PipelineConfig(variant="mmr"),
+])
+def test_answer_prompts_send_the_static_prefix_as_cached_content(config):
+    llm, model, create = cached_model(config)
+    registry = ChainRegistry(llm, InMemoryVectorStore(HashEmbeddings()), config=config)
+    prompt = registry.get(mode="prompt")
+    for query in ("How much is shipping?", "Is shipping free above $100?"):
+        llm.invoke(prompt(query, DOCS))
+
+    prefix = get_prompt_prefix(config)
+    assert create.prefixes == [prefix]
+    assert len(model._calls) == 2
+    for messages, kwargs in model._calls:
+        assert kwargs == {"cached_content": "cachedContents/1"}
+        # Gemini rejects a system instruction next to cached content
+        assert [message.type for message in messages] == ["human"]
+        assert "shipping" in messages[0].content
+
+
+def test_follow_up_prompts_reuse_the_answer_prefix():
+    llm, model, create = cached_model(PipelineConfig(variant="routed"))
+    llm.invoke(CONVERSATION_PROMPT.format_messages(context="Free above $100.", query="And express?", summary="", history=""))
+    assert len(create.prefixes) == 1
+    assert model._calls[0][1] == {"cached_content": "cachedContents/1"}
+
+
+def test_prompts_with_another_prefix_are_sent_inline():
+    llm, model, create = cached_model(PipelineConfig(variant="routed"))
+    registry = ChainRegistry(llm, InMemoryVectorStore(HashEmbeddings()), config=PipelineConfig())
+    llm.invoke(registry.get(mode="prompt")("How much is shipping?", DOCS))
+    assert create.prefixes == []
+    messages, kwargs = model._calls[0]
+    assert kwargs == {} and messages[0].type == "system"
+
+
+def test_gemini_contents_merge_consecutive_turns():
+    config = PipelineConfig(few_shot=True)
+    system_instruction, contents = to_gemini_contents(get_prompt_prefix(config))
+    assert len(system_instruction.parts) == 1
+    assert [content.role for content in contents] == ["user", "model"] * 3
+    assert [len(content.parts) for content in contents] == [2, 1] * 3
@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import time
+from typing import Any
+
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from src.utils.metrics import METRICS
+from src.utils.resilient_client import (
+    DEGRADED_ANSWER,
+    CircuitBreaker,
+    CircuitOpenError,
+    QueryBatcher,
+    ResilientCaller,
+    ResilientChatModel,
+    ResilientEmbeddings,
+    TokenBucket,
+)
+from src.utils.semantic_cache import SemanticCache
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+class StubChatModel(BaseChatModel):
+    """Answers "echo: <last message>" once ``release`` is set, or raises ``error``."""
+
+    error: Any = None
+    _calls: Any = PrivateAttr(default_factory=list)
+    _release: Any = PrivateAttr(default_factory=threading.Event)
+
+    @property
+    def _llm_type(self):
+        return "stub-chat"
+
+    def _answer(self, messages):
+        self._calls.append(messages[-1].content)
+        if self.error is not None:
+            raise self.error
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"echo: {messages[-1].content}"))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        assert self._release.wait(5)
+        return self._answer(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        while not self._release.is_set():
+            await asyncio.sleep(0.01)
+        return self._answer(messages)
+
+
+class StubEmbeddings(Embeddings):
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return [[1.0, float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make_caller(failure_threshold=2, reset_timeout=0.05, max_retries=0):
+    breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+    return ResilientCaller("stub", breaker=breaker, max_retries=max_retries, backoff_base=0.001, backoff_max=0.001)
+
+
+def coalesced_total():
+    return METRICS.to_dict()["counters"].get("chatbot_llm_coalesced_total", 0)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def fail(exc):
+    def call():
+        raise exc
+    return call
+
+
+def test_breaker_opens_after_consecutive_failures():
+    caller = make_caller(failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(Unavailable):
+            caller.call(fail(Unavailable()))
+    assert caller.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        caller.call(lambda: "ok")
+    assert caller.breaker.get_stats()["opened_total"] == 1
+
+
+def test_breaker_half_open_trial_closes_or_reopens():
+    caller = make_caller(failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(Unavailable):
+        caller.call(fail(Unavailable()))
+    assert caller.breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert caller.breaker.allow()
+    assert caller.breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one trial call is let through while half-open
+    assert not caller.breaker.allow()
+    caller.breaker.record_failure()
+    assert caller.breaker.state == CircuitBreaker.OPEN
+    assert caller.breaker.get_stats()["opened_total"] == 2
+
+    time.sleep(0.06)
+    assert caller.call(lambda: "ok") == "ok"
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+    assert caller.breaker.consecutive_failures == 0
+
+
+def test_client_errors_do_not_open_the_breaker():
+    caller = make_caller(failure_threshold=1)
+    with pytest.raises(ValueError):
+        caller.call(fail(ValueError("bad request")))
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries_until_success():
+    caller = make_caller(failure_threshold=5, max_retries=3)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Unavailable()
+        return "ok"
+
+    assert caller.call(flaky) == "ok"
+    assert len(attempts) == 3
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_token_bucket_spaces_calls_beyond_capacity():
+    bucket = TokenBucket(rate=100, capacity=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    delay = bucket._reserve(1)
+    assert 0.005 < delay <= 0.011
+    # Waiting callers are served in arrival order
+    assert bucket._reserve(1) > delay
+
+
+def test_batch_failure_reaches_every_follower():
+    started = threading.Event()
+    release = threading.Event()
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        if len(batches) == 1:
+            started.set()
+            assert release.wait(5)
+            return [item.upper() for item in items]
+        raise Unavailable()
+
+    batcher = QueryBatcher(batch_fn, max_batch=3, max_wait=5)
+    results = {}
+
+    def submit(item):
+        try:
+            results[item] = batcher.submit(item)
+        except Exception as exc:
+            results[item] = exc
+
+    first = threading.Thread(target=submit, args=("a",))
+    first.start()
+    assert started.wait(5)
+    # Queued while the first batch is in flight, so they share the second batch once it is full
+    followers = [threading.Thread(target=submit, args=(item,)) for item in ("b", "c", "b")]
+    for thread in followers:
+        thread.start()
+    for thread in followers:
+        thread.join(5)
+    release.set()
+    first.join(5)
+
+    assert results["a"] == "A"
+    assert isinstance(results["b"], Unavailable) and isinstance(results["c"], Unavailable)
+    assert batches == [["a"], ["b", "c"]]
+
+
+def test_identical_concurrent_prompts_are_coalesced():
+    model = StubChatModel()
+    chat = ResilientChatModel(model=model, caller=make_caller())
+    before = coalesced_total()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(chat.invoke("hello").content)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: coalesced_total() - before == 3)
+    model._release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["echo: hello"] * 4
+    assert model._calls == ["hello"]
+
+
+def test_identical_concurrent_async_prompts_are_coalesced():
+    model = StubChatModel()
+    chat = ResilientChatModel(model=model, caller=make_caller())
+
+    async def run():
+        tasks = [asyncio.create_task(chat.ainvoke("hello")) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        model._release.set()
+        return [message.content for message in await asyncio.gather(*tasks)]
+
+    assert asyncio.run(run()) == ["echo: hello"] * 4
+    assert model._calls == ["hello"]
+
+
+def test_unavailable_model_falls_back_to_remembered_then_degraded_answer():
+    model = StubChatModel()
+    model._release.set()
+    chat = ResilientChatModel(model=model, caller=make_caller(failure_threshold=1, reset_timeout=60))
+    assert chat.invoke("hello").content == "echo: hello"
+
+    model.error = Unavailable()
+    assert chat.invoke("hello").content == "echo: hello"
+    assert chat.caller.breaker.state == CircuitBreaker.OPEN
+    assert chat.invoke("something else").content == DEGRADED_ANSWER
+    # Rejected by the open breaker without reaching the model
+    assert model._calls == ["hello", "hello"]
+
+
+def test_client_errors_are_not_degraded():
+    model = StubChatModel(error=ValueError("bad request"))
+    model._release.set()
+    chat = ResilientChatModel(model=model, caller=make_caller())
+    with pytest.raises(ValueError):
+        chat.invoke("hello")
+
+
+def test_semantic_cache_misses_while_embeddings_are_unavailable():
+    embeddings = ResilientEmbeddings(StubEmbeddings(), make_caller(failure_threshold=1, reset_timeout=60))
+    cache = SemanticCache(embeddings)
+    cache.store("How long does shipping take?", ["3-5 days"], "faqs")
+
+    embeddings.embeddings.error = Unavailable()
+    assert cache.lookup("how long does shipping take") == (["3-5 days"], "faqs")
+    assert cache.lookup("What is the shipping time?") is None
+    assert embeddings.caller.breaker.state == CircuitBreaker.OPEN
+    assert cache.lookup("What is the shipping time?") is None
+    cache.store("What is the shipping time?", ["3-5 days"], "faqs")
+    assert cache.stats["misses"] == 2
@@ -0,0 +1,36 @@
+import re
+
+from langchain_core.embeddings import Embeddings
+
+from src.utils.semantic_cache import SemanticCache
+
+
+class DigitBlindEmbeddings(Embeddings):
+    """Embeds texts that only differ in their digits (or case and punctuation) to the same vector."""
+
+    def _vector(self, text):
+        letters = re.sub(r"[^a-z ]", "", text.lower())
+        return [float(letters.count(char)) for char in "abcdefghijklmnopqrstuvwxyz "]
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def test_paraphrase_hits():
+    cache = SemanticCache(DigitBlindEmbeddings())
+    cache.store("What is the price of the SmartWatch Pro V3?", ["$89.00"], "products")
+    assert cache.lookup("price of the SmartWatch Pro V3, what is it") == (["$89.00"], "products")
+    assert cache.stats["semantic_hits"] == 1
+
+
+def test_paraphrase_with_other_model_number_misses():
+    cache = SemanticCache(DigitBlindEmbeddings())
+    cache.store("What is the price of the SmartWatch Pro V3?", ["$89.00"], "products")
+    assert cache.lookup("What is the price of the SmartWatch Pro V2?") is None
+    assert cache.lookup("What is the price of the SmartWatch Pro?") is None
+
+    cache.store("What is the price of the SmartWatch Pro V2?", ["$59.00"], "products")
+    assert cache.lookup("price of the SmartWatch Pro V2, what is it") == (["$59.00"], "products")